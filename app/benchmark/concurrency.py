@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from benchmark import httpClient, servers
+
+# Compares how the Flask and ASGI versions of the service hold up as the number
+# of concurrent clients grows. Each server mode is started in turn, and for
+# every concurrency level that many clients issue back-to-back requests against
+# one path for a fixed duration. Results are printed as JSON.
+#
+# Run from the app directory, for example:
+#
+#   python -m benchmark.concurrency --concurrency 1,10,100,300 --path /mysfits
+#
+# Set MYSFITS_DATA_SOURCE=dynamodb (and MYSFITS_DYNAMODB_ENDPOINT_URL for
+# DynamoDB Local) to measure the servers while they wait on a backend.
+
+
+async def runLevel(url, path, concurrency, duration):
+    host, port = httpClient.splitUrl(url)
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async def client():
+        nonlocal errors
+        connection = httpClient.HttpConnection(host, port)
+        try:
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                try:
+                    status, _, _ = await connection.request("GET", path)
+                except OSError:
+                    errors += 1
+                    connection.close()
+                    continue
+                if status >= 500:
+                    errors += 1
+                else:
+                    latencies.append(time.monotonic() - started)
+        finally:
+            connection.close()
+
+    started = time.monotonic()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.monotonic() - started
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "requestsPerSecond": round(len(latencies) / elapsed, 1),
+        "p50Ms": _ms(httpClient.percentile(latencies, 0.50)),
+        "p99Ms": _ms(httpClient.percentile(latencies, 0.99)),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def benchmarkMode(mode, levels, path, duration):
+    port = servers.freePort()
+    url = "http://127.0.0.1:{}".format(port)
+    process = servers.startServer(mode, port)
+    try:
+        asyncio.run(httpClient.waitUntilHealthy(url))
+        return [
+            asyncio.run(runLevel(url, path, concurrency, duration))
+            for concurrency in levels
+        ]
+    finally:
+        servers.stopServer(process)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare Flask and ASGI service throughput under concurrency."
+    )
+    parser.add_argument("--modes", default="flask,asgi")
+    parser.add_argument("--concurrency", default="1,10,100,300")
+    parser.add_argument("--path", default="/mysfits")
+    parser.add_argument("--duration", type=float, default=10.0)
+    options = parser.parse_args(argv)
+
+    levels = [int(level) for level in options.concurrency.split(",")]
+    results = {
+        mode: benchmarkMode(mode, levels, options.path, options.duration)
+        for mode in options.modes.split(",")
+    }
+    json.dump({"path": options.path, "results": results}, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+# A minimal HTTP/1.1 client built on asyncio streams, used by the benchmarks to
+# keep hundreds of requests in flight from a single process without pulling in
+# a third-party load generator. It reuses connections when the server allows
+# keep-alive and reconnects when the server closes them.
+
+
+class HttpConnection(object):
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+
+    async def request(self, method, path, headers=None, body=b""):
+        # returns (status, response headers, body bytes).
+        for attempt in (0, 1):
+            if self._writer is None:
+                self._reader, self._writer = await asyncio.open_connection(
+                    self.host, self.port
+                )
+            try:
+                return await self._exchange(method, path, headers or {}, body)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # a kept-alive connection may have been closed by the server
+                # between requests; retry once on a fresh one.
+                self.close()
+                if attempt:
+                    raise
+
+    async def _exchange(self, method, path, headers, body):
+        lines = ["{} {} HTTP/1.1".format(method, path), "Host: {}".format(self.host)]
+        lines.extend("{}: {}".format(name, value) for name, value in headers.items())
+        lines.append("Content-Length: {}".format(len(body)))
+        self._writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await self._writer.drain()
+
+        statusLine = await self._reader.readuntil(b"\r\n")
+        status = int(statusLine.split()[1])
+        responseHeaders = {}
+        while True:
+            line = await self._reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            responseHeaders[name.strip().lower()] = value.strip()
+
+        if "content-length" in responseHeaders:
+            responseBody = await self._reader.readexactly(
+                int(responseHeaders["content-length"])
+            )
+        elif responseHeaders.get("transfer-encoding", "").lower() == "chunked":
+            responseBody = await self._readChunked()
+        elif status in (204, 304) or method == "HEAD":
+            responseBody = b""
+        else:
+            responseBody = await self._reader.read()
+
+        if (
+            responseHeaders.get("connection", "").lower() == "close"
+            or statusLine.startswith(b"HTTP/1.0")
+            and responseHeaders.get("connection", "").lower() != "keep-alive"
+        ):
+            self.close()
+        return status, responseHeaders, responseBody
+
+    async def _readChunked(self):
+        chunks = []
+        while True:
+            size = int((await self._reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if size == 0:
+                await self._reader.readuntil(b"\r\n")
+                return b"".join(chunks)
+            chunks.append(await self._reader.readexactly(size))
+            await self._reader.readexactly(2)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+
+def splitUrl(url):
+    parts = urlsplit(url)
+    return parts.hostname, parts.port or 80
+
+
+async def waitUntilHealthy(url, timeout=30.0, interval=0.05):
+    # poll the service root until it answers 200, returning the number of
+    # seconds that took.
+    host, port = splitUrl(url)
+    started = time.monotonic()
+    while True:
+        connection = HttpConnection(host, port)
+        try:
+            status, _, _ = await connection.request("GET", "/")
+            if status == 200:
+                return time.monotonic() - started
+        except OSError:
+            pass
+        finally:
+            connection.close()
+        if time.monotonic() - started > timeout:
+            raise TimeoutError("{} did not become healthy".format(url))
+        await asyncio.sleep(interval)
+
+
+def percentile(sortedValues, fraction):
+    if not sortedValues:
+        return None
+    index = min(len(sortedValues) - 1, int(round(fraction * (len(sortedValues) - 1))))
+    return sortedValues[index]
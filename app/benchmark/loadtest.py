@@ -0,0 +1,418 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+from benchmark import httpClient, servers
+from tools import catalogFiles
+
+# A reproducible load test of the whole service. A local DynamoDB stand-in
+# (benchmark/localDynamo.py) is started and seeded from
+# data/populate-dynamodb.json, then each server mode is started against it in
+# turn and a fixed mix of traffic is replayed:
+#
+#   health   GET /
+#   list     GET /mysfits
+#   filter   GET /mysfits?filter=<GoodEvil|LawChaos>&value=<...>
+#   item     GET /mysfits/<id>
+#   like     POST /mysfits/<id>/like
+#   adopt    POST /mysfits/<id>/adopt
+#   batch    GET /mysfits/batch?ids=<id>,... (not in the default mix)
+#
+# Every client draws its requests from its own random generator seeded from
+# --seed, so two runs with the same options send the same requests in the same
+# order. Results go to stdout as JSON: throughput, p50/p99 latency overall and
+# per request kind, and the resident memory of every server process at the end
+# of the run, along with the commit and options measured, so that runs from
+# different commits and server modes can be compared directly.
+#
+# Run from the app directory, for example:
+#
+#   python -m benchmark.loadtest --modes flask,gunicorn-flask --source dynamodb
+#
+# --dynamodb-url points the service at an already running DynamoDB (for
+# example DynamoDB Local, already seeded) instead of starting the stand-in.
+# --data-dir runs against a catalog made by tools/generateCatalog.py instead of
+# the hand-written one: the stand-in is seeded from its populate-dynamodb.json
+# and the snapshot source serves its mysfits-response.json.
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_PATH = os.path.join(APP_DIR, "data", "populate-dynamodb.json")
+
+# The relative weight of each kind of request in the default mix.
+DEFAULT_MIX = "health=10,list=25,filter=20,item=30,like=10,adopt=5"
+
+FILTERS = (
+    ("GoodEvil", ("Good", "Neutral", "Evil")),
+    ("LawChaos", ("Lawful", "Neutral", "Chaotic")),
+)
+
+# Credentials and region for the boto3 client in the service; the stand-in
+# ignores them, but boto3 will not sign a request without them.
+LOCAL_AWS_ENVIRONMENT = {
+    "AWS_ACCESS_KEY_ID": "local",
+    "AWS_SECRET_ACCESS_KEY": "local",
+    "AWS_DEFAULT_REGION": "us-east-1",
+}
+
+# BatchWriteItem accepts at most this many writes per call.
+BATCH_WRITE_LIMIT = 25
+
+
+def parseMix(text):
+    mix = []
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in REQUESTS:
+            raise ValueError("unknown request kind: " + kind)
+        mix.append((kind, float(weight)))
+    return mix
+
+
+def readSeedItems(path=SEED_PATH):
+    # the writes seeding MysfitsTable from a catalog in either format, read
+    # one mysfit at a time (see tools.catalogFiles), so that a generated
+    # catalog of any size never has to fit in memory.
+    for item in catalogFiles.iterItems(path):
+        yield {"PutRequest": {"Item": item}}
+
+
+def seedTable(url, writes):
+    # makes the writes, BATCH_WRITE_LIMIT at a time, and returns the
+    # mysfitIds written.
+    mysfitIds = []
+    batch = []
+    for write in writes:
+        mysfitIds.append(write["PutRequest"]["Item"]["MysfitId"]["S"])
+        batch.append(write)
+        if len(batch) == BATCH_WRITE_LIMIT:
+            writeBatch(url, batch)
+            batch = []
+    if batch:
+        writeBatch(url, batch)
+    return mysfitIds
+
+
+def writeBatch(url, writes):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps({"RequestItems": {"MysfitsTable": writes}}).encode("utf-8"),
+        headers={
+            "Content-Type": "application/x-amz-json-1.0",
+            "X-Amz-Target": "DynamoDB_20120810.BatchWriteItem",
+        },
+    )
+    urllib.request.urlopen(request).read()
+
+
+def startLocalDynamo(port, latencyMs):
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmark.localDynamo",
+            "--port",
+            str(port),
+            "--latency-ms",
+            str(latencyMs),
+        ],
+        cwd=APP_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def waitForPort(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), 1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+# -- the traffic mix ------------------------------------------------------
+
+
+def healthRequest(rng, ids):
+    return "GET", "/"
+
+
+def listRequest(rng, ids):
+    return "GET", "/mysfits"
+
+
+def filterRequest(rng, ids):
+    name, values = rng.choice(FILTERS)
+    return "GET", "/mysfits?filter={}&value={}".format(name, rng.choice(values))
+
+
+def itemRequest(rng, ids):
+    return "GET", "/mysfits/" + rng.choice(ids)
+
+
+def likeRequest(rng, ids):
+    return "POST", "/mysfits/{}/like".format(rng.choice(ids))
+
+
+def adoptRequest(rng, ids):
+    return "POST", "/mysfits/{}/adopt".format(rng.choice(ids))
+
+
+def batchRequest(rng, ids):
+    chosen = rng.sample(ids, min(len(ids), 5))
+    return "GET", "/mysfits/batch?ids=" + ",".join(chosen)
+
+
+REQUESTS = {
+    "health": healthRequest,
+    "list": listRequest,
+    "filter": filterRequest,
+    "item": itemRequest,
+    "like": likeRequest,
+    "adopt": adoptRequest,
+    "batch": batchRequest,
+}
+
+
+async def replay(url, mix, ids, concurrency, duration, seed):
+    host, port = httpClient.splitUrl(url)
+    kinds = [kind for kind, _ in mix]
+    weights = [weight for _, weight in mix]
+    latencies = {kind: [] for kind in kinds}
+    errors = {kind: 0 for kind in kinds}
+    shed = {kind: 0 for kind in kinds}
+    deadline = time.monotonic() + duration
+
+    async def client(index):
+        rng = random.Random("{}:{}".format(seed, index))
+        connection = httpClient.HttpConnection(host, port)
+        try:
+            while time.monotonic() < deadline:
+                kind = rng.choices(kinds, weights)[0]
+                method, path = REQUESTS[kind](rng, ids)
+                started = time.monotonic()
+                try:
+                    status, _, _ = await connection.request(method, path)
+                except OSError:
+                    errors[kind] += 1
+                    connection.close()
+                    continue
+                if status == 503:
+                    # turned away by the service's admission control.
+                    shed[kind] += 1
+                elif status >= 400:
+                    errors[kind] += 1
+                else:
+                    latencies[kind].append(time.monotonic() - started)
+        finally:
+            connection.close()
+
+    started = time.monotonic()
+    await asyncio.gather(*(client(index) for index in range(concurrency)))
+    elapsed = time.monotonic() - started
+
+    everything = sorted(value for values in latencies.values() for value in values)
+    result = summarize(everything, sum(errors.values()), elapsed, sum(shed.values()))
+    result["byKind"] = {
+        kind: summarize(sorted(latencies[kind]), errors[kind], elapsed, shed[kind])
+        for kind in kinds
+    }
+    return result
+
+
+def summarize(sortedLatencies, errors, elapsed, shed=0):
+    return {
+        "requests": len(sortedLatencies),
+        "errors": errors,
+        "shed": shed,
+        "requestsPerSecond": round(len(sortedLatencies) / elapsed, 1),
+        "p50Ms": _ms(httpClient.percentile(sortedLatencies, 0.50)),
+        "p99Ms": _ms(httpClient.percentile(sortedLatencies, 0.99)),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+# -- memory ---------------------------------------------------------------
+
+
+def residentKb(pid):
+    # VmRSS from /proc, or None where /proc is not available.
+    try:
+        with open("/proc/{}/status".format(pid)) as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def childPids(pid):
+    children = []
+    try:
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open("/proc/{}/stat".format(entry)) as stat:
+                    # the command name may contain spaces, so split after it.
+                    fields = stat.read().rpartition(")")[2].split()
+            except OSError:
+                continue
+            if int(fields[1]) == pid:
+                children.append(int(entry))
+    except OSError:
+        pass
+    return sorted(children)
+
+
+def memoryReport(pid):
+    # the prefork servers answer requests from their worker processes, while
+    # the single process servers answer them from the process itself.
+    workers = childPids(pid) or [pid]
+    return {
+        "masterRssKb": residentKb(pid),
+        "workerRssKb": [residentKb(worker) for worker in workers],
+    }
+
+
+# -------------------------------------------------------------------------
+
+
+def snapshotIds(path):
+    return [mysfit["mysfitId"] for mysfit in catalogFiles.iterMysfits(path)]
+
+
+def commitId():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=APP_DIR,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode("ascii")
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmarkMode(mode, environment, options, mix, ids):
+    port = servers.freePort()
+    url = "http://127.0.0.1:{}".format(port)
+    process = servers.startServer(mode, port, environment)
+    try:
+        startup = asyncio.run(httpClient.waitUntilHealthy(url))
+        if options.warmup:
+            asyncio.run(
+                replay(url, mix, ids, options.concurrency, options.warmup, options.seed)
+            )
+        result = asyncio.run(
+            replay(url, mix, ids, options.concurrency, options.duration, options.seed)
+        )
+        result["startupSeconds"] = round(startup, 3)
+        result.update(memoryReport(process.pid))
+        return result
+    finally:
+        servers.stopServer(process)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay a mix of traffic against each server mode."
+    )
+    parser.add_argument("--modes", default="flask,asgi,gunicorn-flask,gunicorn-asgi")
+    parser.add_argument(
+        "--source", choices=("snapshot", "dynamodb"), default="dynamodb"
+    )
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--dynamodb-url", default=None)
+    parser.add_argument("--data-dir", default=None)
+    parser.add_argument("--dynamodb-latency-ms", type=float, default=5.0)
+    options = parser.parse_args(argv)
+    mix = parseMix(options.mix)
+
+    snapshotPath = os.environ.get(
+        "MYSFITS_SNAPSHOT_PATH",
+        os.path.join(servers.SERVICE_DIR, "mysfits-response.json"),
+    )
+    seedPath = SEED_PATH
+    if options.data_dir:
+        snapshotPath = os.path.join(options.data_dir, "mysfits-response.json")
+        seedPath = os.path.join(options.data_dir, "populate-dynamodb.json")
+
+    dynamo = None
+    dynamoUrl = options.dynamodb_url
+    if dynamoUrl is None:
+        dynamoPort = servers.freePort()
+        dynamo = startLocalDynamo(dynamoPort, options.dynamodb_latency_ms)
+        dynamoUrl = "http://127.0.0.1:{}".format(dynamoPort)
+    try:
+        if dynamo is not None:
+            waitForPort(dynamoPort)
+            tableIds = seedTable(dynamoUrl, readSeedItems(seedPath))
+        else:
+            tableIds = [
+                item["MysfitId"]["S"] for item in catalogFiles.iterItems(seedPath)
+            ]
+        readIds = (
+            tableIds if options.source == "dynamodb" else snapshotIds(snapshotPath)
+        )
+
+        environment = dict(LOCAL_AWS_ENVIRONMENT)
+        environment["MYSFITS_DYNAMODB_ENDPOINT_URL"] = dynamoUrl
+        environment["MYSFITS_DATA_SOURCE"] = options.source
+        environment["MYSFITS_SNAPSHOT_PATH"] = os.path.abspath(snapshotPath)
+        if options.workers:
+            environment["MYSFITS_WORKERS"] = str(options.workers)
+
+        # reads and writes are both drawn from ids the source and the table
+        # know about, so that item requests and adoptions do not 404.
+        knownIds = set(tableIds)
+        ids = [mysfitId for mysfitId in readIds if mysfitId in knownIds]
+        results = {
+            mode: benchmarkMode(mode, environment, options, mix, ids)
+            for mode in options.modes.split(",")
+        }
+    finally:
+        if dynamo is not None:
+            servers.stopServer(dynamo)
+
+    report = {
+        "commit": commitId(),
+        "source": options.source,
+        "mix": dict(mix),
+        "concurrency": options.concurrency,
+        "durationSeconds": options.duration,
+        "seed": options.seed,
+        "catalogSize": len(tableIds),
+        "dynamodbLatencyMs": (
+            None if options.dynamodb_url else options.dynamodb_latency_ms
+        ),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,502 @@
+import argparse
+import bisect
+import itertools
+import json
+import math
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A small in-memory stand-in for DynamoDB, speaking just enough of the
+# DynamoDB JSON protocol for the mysfits service, its tools and the benchmarks
+# to run against it with an unmodified boto3 client:
+#
+#   GetItem, PutItem, DeleteItem, UpdateItem, Scan (with Limit, pagination and
+#   Segment/TotalSegments), Query (on a table or a GSI, with one equality key
+#   condition), BatchGetItem, BatchWriteItem, TransactWriteItems,
+#   DescribeTable
+#
+# Tables are created at start up with the same keys and indexes as
+# DynamoDbStack. Expressions are limited to the forms the service uses (SET,
+# with if_not_exists, ADD and REMOVE updates; attribute_exists,
+# attribute_not_exists and equality conditions), and every call can be
+# slowed down by a fixed latency to stand in for the network round trip to
+# the real service. Batch writes can be throttled to a write capacity, in WCU
+# per second.
+#
+#   python -m benchmark.localDynamo --port 8000 --latency-ms 5 [--write-capacity 1000]
+#
+# Point the service at it with MYSFITS_DYNAMODB_ENDPOINT_URL=http://127.0.0.1:8000
+# and any AWS credentials and region.
+
+TABLES = {
+    "MysfitsTable": {
+        "key": "MysfitId",
+        "indexes": {
+            "LawChaosIndex": ("LawChaos", "MysfitId"),
+            "GoodEvilIndex": ("GoodEvil", "MysfitId"),
+        },
+    },
+    "MysfitsLikesTable": {"key": "ShardId", "indexes": {}},
+}
+
+# DynamoDB caps a Scan or Query page at 1 MB of data.
+MAX_PAGE_BYTES = 1024 * 1024
+
+ERROR_PREFIX = "com.amazonaws.dynamodb.v20120810#"
+
+
+class DynamoError(Exception):
+    def __init__(self, errorType, message, extra=None):
+        Exception.__init__(self, message)
+        self.errorType = errorType
+        self.extra = extra or {}
+
+
+def itemSize(item):
+    return len(json.dumps(item))
+
+
+def capacity(tableName, units):
+    return {"TableName": tableName, "CapacityUnits": units}
+
+
+def readUnits(size, consistent=False):
+    units = max(1, math.ceil(size / 4096))
+    return units if consistent else units / 2.0
+
+
+def writeUnits(size):
+    return max(1, math.ceil(size / 1024))
+
+
+class Table(object):
+    def __init__(self, name, key, indexes):
+        self.name = name
+        self.key = key
+        self.indexes = indexes
+        self.items = {}
+        # the keys in order, and those of each Scan segment, kept until a key
+        # is added or removed; updates to existing items leave them be.
+        self._orderedKeys = {}
+
+    def put(self, item):
+        key = self.keyOf(item)
+        if key not in self.items:
+            self._orderedKeys.clear()
+        self.items[key] = item
+
+    def remove(self, key):
+        item = self.items.pop(key, None)
+        if item is not None:
+            self._orderedKeys.clear()
+        return item
+
+    def orderedKeys(self, segment=None, totalSegments=None):
+        keys = self._orderedKeys.get((segment, totalSegments))
+        if keys is None:
+            keys = sorted(self.items)
+            if totalSegments:
+                keys = [
+                    key
+                    for key in keys
+                    if zlib.crc32(key.encode("utf-8")) % totalSegments == segment
+                ]
+            self._orderedKeys[(segment, totalSegments)] = keys
+        return keys
+
+    def keyOf(self, item):
+        value = item.get(self.key)
+        if value is None or "S" not in value:
+            raise DynamoError("ValidationException", "missing key " + self.key)
+        return value["S"]
+
+
+class LocalDynamo(object):
+    def __init__(self, latency=0.0, writeCapacity=None):
+        self.latency = latency
+        # with a write capacity, in WCU per second, BatchWriteItem leaves the
+        # writes past it unprocessed, as a throttled table does.
+        self.writeCapacity = writeCapacity
+        self._writeBudget = writeCapacity or 0.0
+        self._writeBudgetTime = time.monotonic()
+        self.lock = threading.Lock()
+        self.tables = {
+            name: Table(name, spec["key"], spec["indexes"])
+            for name, spec in TABLES.items()
+        }
+
+    def table(self, name):
+        table = self.tables.get(name)
+        if table is None:
+            raise DynamoError("ResourceNotFoundException", "no table " + str(name))
+        return table
+
+    def handle(self, operation, request):
+        if self.latency:
+            time.sleep(self.latency)
+        handler = getattr(self, "op" + operation, None)
+        if handler is None:
+            raise DynamoError("UnknownOperationException", operation)
+        with self.lock:
+            return handler(request)
+
+    # -- expressions ------------------------------------------------------
+
+    def _name(self, token, request):
+        token = token.strip()
+        if token.startswith("#"):
+            return request["ExpressionAttributeNames"][token]
+        return token
+
+    def _value(self, token, request):
+        return request["ExpressionAttributeValues"][token.strip()]
+
+    def _project(self, item, request):
+        projection = request.get("ProjectionExpression")
+        if not projection:
+            return dict(item)
+        names = [self._name(token, request) for token in projection.split(",")]
+        return {name: item[name] for name in names if name in item}
+
+    def _check(self, item, request):
+        # conditions are one or more clauses joined by AND, each of which may be
+        # a parenthesised OR of simpler clauses.
+        condition = request.get("ConditionExpression")
+        if not condition:
+            return
+        for clause in re.split(r"\s+AND\s+", condition):
+            options = re.split(r"\s+OR\s+", _unwrap(clause))
+            if not any(self._test(item, option, request) for option in options):
+                raise DynamoError(
+                    "ConditionalCheckFailedException", "The conditional request failed"
+                )
+
+    def _test(self, item, clause, request):
+        clause = _unwrap(clause)
+        match = re.match(r"attribute_(not_)?exists\(\s*([^)]+?)\s*\)$", clause)
+        if match:
+            present = item is not None and self._name(match.group(2), request) in item
+            return not present if match.group(1) else present
+        left, _, right = clause.partition("=")
+        if item is None:
+            return False
+        return item.get(self._name(left, request)) == self._value(right, request)
+
+    def _update(self, item, expression, request):
+        for action, body in re.findall(
+            r"(SET|ADD|REMOVE)\s+(.*?)(?=\s+(?:SET|ADD|REMOVE)\s+|$)", expression
+        ):
+            # commas inside if_not_exists(...) do not separate actions.
+            for part in re.split(r",(?![^(]*\))", body):
+                if action == "SET":
+                    name, _, value = part.partition("=")
+                    name = self._name(name, request)
+                    match = re.match(r"\s*if_not_exists\(([^,]+),([^)]+)\)\s*$", value)
+                    if match is None:
+                        item[name] = self._value(value, request)
+                    else:
+                        current = item.get(self._name(match.group(1), request))
+                        if current is None:
+                            current = self._value(match.group(2), request)
+                        item[name] = current
+                elif action == "ADD":
+                    name, value = part.split()
+                    name = self._name(name, request)
+                    amount = self._value(value, request)["N"]
+                    current = item.get(name, {"N": "0"})["N"]
+                    total = _number(current) + _number(amount)
+                    item[name] = {"N": str(total)}
+                else:
+                    item.pop(self._name(part, request), None)
+
+    # -- single items -----------------------------------------------------
+
+    def opGetItem(self, request):
+        table = self.table(request["TableName"])
+        item = table.items.get(table.keyOf(request["Key"]))
+        response = {}
+        if item is not None:
+            response["Item"] = self._project(item, request)
+        size = itemSize(item) if item else 0
+        response["ConsumedCapacity"] = capacity(
+            table.name, readUnits(size, request.get("ConsistentRead", False))
+        )
+        return response
+
+    def opPutItem(self, request):
+        table = self.table(request["TableName"])
+        key = table.keyOf(request["Item"])
+        self._check(table.items.get(key), request)
+        table.put(request["Item"])
+        return {
+            "ConsumedCapacity": capacity(
+                table.name, writeUnits(itemSize(request["Item"]))
+            )
+        }
+
+    def opDeleteItem(self, request):
+        table = self.table(request["TableName"])
+        key = table.keyOf(request["Key"])
+        self._check(table.items.get(key), request)
+        item = table.remove(key)
+        return {
+            "ConsumedCapacity": capacity(
+                table.name, writeUnits(itemSize(item) if item else 0)
+            )
+        }
+
+    def opUpdateItem(self, request):
+        table = self.table(request["TableName"])
+        key = table.keyOf(request["Key"])
+        existing = table.items.get(key)
+        self._check(existing, request)
+        item = dict(existing) if existing is not None else dict(request["Key"])
+        self._update(item, request["UpdateExpression"], request)
+        table.put(item)
+        return {"ConsumedCapacity": capacity(table.name, writeUnits(itemSize(item)))}
+
+    # -- listings ---------------------------------------------------------
+
+    def _page(self, table, items, request, keyAttributes):
+        # apply Limit and the 1 MB page cap to items, an iterable of the items
+        # after ExclusiveStartKey in the order the listing returns them.
+        limit = request.get("Limit")
+        page, size, more = [], 0, False
+        for item in items:
+            if (limit is not None and len(page) >= limit) or (
+                page and size + itemSize(item) > MAX_PAGE_BYTES
+            ):
+                more = True
+                break
+            page.append(item)
+            size += itemSize(item)
+        response = {
+            "Items": [self._project(item, request) for item in page],
+            "Count": len(page),
+            "ScannedCount": len(page),
+            "ConsumedCapacity": capacity(
+                table.name, readUnits(size, request.get("ConsistentRead", False))
+            ),
+        }
+        if more:
+            response["LastEvaluatedKey"] = {
+                name: page[-1][name] for name in keyAttributes
+            }
+        return response
+
+    def opScan(self, request):
+        table = self.table(request["TableName"])
+        totalSegments = request.get("TotalSegments")
+        keys = table.orderedKeys(
+            request["Segment"] if totalSegments else None, totalSegments
+        )
+        start = 0
+        startKey = request.get("ExclusiveStartKey")
+        if startKey is not None:
+            start = bisect.bisect_right(keys, startKey[table.key]["S"])
+        items = (table.items[key] for key in itertools.islice(keys, start, None))
+        return self._page(table, items, request, [table.key])
+
+    def opQuery(self, request):
+        table = self.table(request["TableName"])
+        match = re.match(
+            r"^\s*(\S+)\s*=\s*(\S+)\s*$", request["KeyConditionExpression"]
+        )
+        if match is None:
+            raise DynamoError("ValidationException", "unsupported key condition")
+        name = self._name(match.group(1), request)
+        value = self._value(match.group(2), request)
+        indexName = request.get("IndexName")
+        if indexName:
+            hashKey, rangeKey = table.indexes[indexName]
+            if name != hashKey:
+                raise DynamoError("ValidationException", "not the index hash key")
+            keyAttributes = [hashKey, rangeKey, table.key]
+            keyAttributes = list(dict.fromkeys(keyAttributes))
+            items = sorted(
+                (item for item in table.items.values() if item.get(name) == value),
+                key=lambda item: item[rangeKey]["S"],
+            )
+        else:
+            keyAttributes = [table.key]
+            items = [item for item in table.items.values() if item.get(name) == value]
+        startKey = request.get("ExclusiveStartKey")
+        if startKey is not None:
+            marker = tuple(startKey[name]["S"] for name in keyAttributes)
+            items = [
+                item
+                for item in items
+                if tuple(item[name]["S"] for name in keyAttributes) > marker
+            ]
+        return self._page(table, items, request, keyAttributes)
+
+    # -- batches ----------------------------------------------------------
+
+    def opBatchGetItem(self, request):
+        responses, consumed = {}, []
+        for tableName, spec in request["RequestItems"].items():
+            table = self.table(tableName)
+            found, size = [], 0
+            for key in spec["Keys"]:
+                item = table.items.get(table.keyOf(key))
+                if item is not None:
+                    found.append(self._project(item, spec))
+                    size += itemSize(item)
+            responses[tableName] = found
+            consumed.append(capacity(tableName, readUnits(size)))
+        return {
+            "Responses": responses,
+            "UnprocessedKeys": {},
+            "ConsumedCapacity": consumed,
+        }
+
+    def opBatchWriteItem(self, request):
+        consumed, unprocessed = [], {}
+        for tableName, writes in request["RequestItems"].items():
+            table = self.table(tableName)
+            units = 0
+            for write in writes:
+                if "PutRequest" in write:
+                    item = write["PutRequest"]["Item"]
+                    cost = writeUnits(itemSize(item))
+                else:
+                    cost = 1
+                if not self._spendWriteCapacity(cost):
+                    unprocessed.setdefault(tableName, []).append(write)
+                    continue
+                if "PutRequest" in write:
+                    table.put(item)
+                else:
+                    table.remove(table.keyOf(write["DeleteRequest"]["Key"]))
+                units += cost
+            consumed.append(capacity(tableName, units))
+        return {"UnprocessedItems": unprocessed, "ConsumedCapacity": consumed}
+
+    def _spendWriteCapacity(self, units):
+        # a token bucket holding up to one second of write capacity.
+        if not self.writeCapacity:
+            return True
+        now = time.monotonic()
+        self._writeBudget = min(
+            self.writeCapacity,
+            self._writeBudget + (now - self._writeBudgetTime) * self.writeCapacity,
+        )
+        self._writeBudgetTime = now
+        if self._writeBudget < units:
+            return False
+        self._writeBudget -= units
+        return True
+
+    def opTransactWriteItems(self, request):
+        actions = request["TransactItems"]
+        # check every condition before applying anything, so the transaction
+        # is all or nothing.
+        for action in actions:
+            ((kind, spec),) = action.items()
+            table = self.table(spec["TableName"])
+            key = table.keyOf(spec.get("Key") or spec.get("Item"))
+            try:
+                self._check(table.items.get(key), spec)
+            except DynamoError:
+                raise DynamoError(
+                    "TransactionCanceledException", "Transaction cancelled"
+                )
+        for action in actions:
+            ((kind, spec),) = action.items()
+            if kind == "Update":
+                self.opUpdateItem(spec)
+            elif kind == "Put":
+                self.opPutItem(spec)
+            elif kind == "Delete":
+                self.opDeleteItem(spec)
+        return {}
+
+    def opDescribeTable(self, request):
+        table = self.table(request["TableName"])
+        return {
+            "Table": {
+                "TableName": table.name,
+                "TableStatus": "ACTIVE",
+                "ItemCount": len(table.items),
+                "TableSizeBytes": sum(itemSize(item) for item in table.items.values()),
+                "KeySchema": [{"AttributeName": table.key, "KeyType": "HASH"}],
+            }
+        }
+
+
+def _unwrap(clause):
+    # strip parentheses around the whole of a clause, if there are any.
+    clause = clause.strip()
+    while clause.startswith("(") and clause.endswith(")"):
+        depth = 0
+        for index, character in enumerate(clause):
+            depth += {"(": 1, ")": -1}.get(character, 0)
+            if depth == 0 and index < len(clause) - 1:
+                return clause
+        clause = clause[1:-1].strip()
+    return clause
+
+
+def _number(text):
+    return float(text) if "." in text else int(text)
+
+
+def makeHandler(dynamo):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", "0"))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            operation = self.headers.get("X-Amz-Target", "").rpartition(".")[2]
+            try:
+                try:
+                    status, response = 200, dynamo.handle(operation, request)
+                except (KeyError, ValueError) as error:
+                    raise DynamoError("ValidationException", repr(error))
+                if request.get("ReturnConsumedCapacity", "NONE") == "NONE":
+                    response.pop("ConsumedCapacity", None)
+            except DynamoError as error:
+                status = 400
+                response = {
+                    "__type": ERROR_PREFIX + error.errorType,
+                    "message": str(error),
+                }
+                response.update(error.extra)
+            body = json.dumps(response).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/x-amz-json-1.0")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port, latency=0.0, host="127.0.0.1", writeCapacity=None):
+    dynamo = LocalDynamo(latency, writeCapacity)
+    server = ThreadingHTTPServer((host, port), makeHandler(dynamo))
+    server.daemon_threads = True
+    return server, dynamo
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local DynamoDB stand-in.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--write-capacity", type=float, default=None)
+    options = parser.parse_args(argv)
+    server, _ = serve(
+        options.port, options.latency_ms / 1000.0, writeCapacity=options.write_capacity
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
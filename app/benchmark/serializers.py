@@ -0,0 +1,94 @@
+import argparse
+import json
+import sys
+import time
+
+from tools import generateCatalog  # also makes the service modules importable
+
+import mysfitsJson
+import mysfitsTableClient
+
+# Measures what it costs to turn a page of DynamoDB items into the JSON body
+# of a listing, for catalogs of different sizes, along each path the service
+# has had:
+#
+#   stdlib   itemToMysfit for every item, then json.dumps of the listing, as
+#            the service did before mysfitsJson
+#   dumps    itemToMysfit for every item, then mysfitsJson.dumps of each
+#            mysfit (orjson when it is installed), as the service does now
+#
+# Every path is checked to produce the same mysfits before it is timed.
+# Results go to stdout as JSON, in items per second and milliseconds per
+# listing, along with the encoder mysfitsJson is using:
+#
+#   python -m benchmark.serializers --sizes 10,1000,100000
+
+BODY_PREFIX = b'{"mysfits":['
+
+
+def stdlibPath(items):
+    mysfits = [mysfitsTableClient.itemToMysfit(item) for item in items]
+    return json.dumps({"mysfits": mysfits}, ensure_ascii=False).encode("utf-8")
+
+
+def dumpsPath(items):
+    itemBodies = [
+        mysfitsJson.dumps(mysfitsTableClient.itemToMysfit(item)) for item in items
+    ]
+    return BODY_PREFIX + b",".join(itemBodies) + b"]}"
+
+
+PATHS = (("stdlib", stdlibPath), ("dumps", dumpsPath))
+
+
+def timePath(path, items, minSeconds):
+    # repeat until at least minSeconds have passed, keeping the best run.
+    best = None
+    spent = 0.0
+    while spent < minSeconds or best is None:
+        started = time.perf_counter()
+        path(items)
+        elapsed = time.perf_counter() - started
+        spent += elapsed
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmarkSize(size, minSeconds):
+    items = list(generateCatalog.generateItems(size))
+    expected = json.loads(stdlibPath(items))
+    result = {}
+    for name, path in PATHS:
+        if json.loads(path(items)) != expected:
+            raise AssertionError("{} produced different mysfits".format(name))
+        elapsed = timePath(path, items, minSeconds)
+        result[name] = {
+            "msPerListing": round(elapsed * 1000, 3),
+            "itemsPerSecond": round(size / elapsed),
+        }
+    baseline = result["stdlib"]["msPerListing"]
+    for name, _ in PATHS:
+        result[name]["speedup"] = round(baseline / result[name]["msPerListing"], 2)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare the ways of serializing DynamoDB items to JSON."
+    )
+    parser.add_argument("--sizes", default="10,1000,100000")
+    parser.add_argument("--min-seconds", type=float, default=1.0)
+    options = parser.parse_args(argv)
+
+    results = {
+        size: benchmarkSize(size, options.min_seconds)
+        for size in (int(size) for size in options.sizes.split(","))
+    }
+    json.dump(
+        {"encoder": mysfitsJson.BACKEND, "results": results}, sys.stdout, indent=2
+    )
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
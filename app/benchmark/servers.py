@@ -0,0 +1,60 @@
+import os
+import socket
+import subprocess
+import sys
+
+# The ways the Mythical Mysfits service can be served, and how to start each
+# one as a local subprocess for benchmarking. Every command is run from the
+# service directory with PORT set to a free port.
+
+SERVICE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "service"
+)
+
+SERVER_COMMANDS = {
+    "flask": [sys.executable, "mythicalMysfitsService.py"],
+    "asgi": [sys.executable, "mythicalMysfitsAsgi.py"],
+    "gunicorn-flask": [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "--config",
+        "gunicorn.conf.py",
+    ],
+    "gunicorn-asgi": [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py"],
+}
+
+# Extra environment for the modes that need it.
+SERVER_ENVIRONMENT = {
+    "gunicorn-flask": {"MYSFITS_SERVER": "flask"},
+    "gunicorn-asgi": {"MYSFITS_SERVER": "asgi"},
+}
+
+
+def freePort():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def startServer(mode, port, environment=None):
+    env = dict(os.environ)
+    env.update(SERVER_ENVIRONMENT.get(mode, {}))
+    env.update(environment or {})
+    env["PORT"] = str(port)
+    return subprocess.Popen(
+        SERVER_COMMANDS[mode],
+        cwd=SERVICE_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def stopServer(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
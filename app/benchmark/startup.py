@@ -0,0 +1,146 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmark import httpClient, servers
+
+# Measures how long the service takes to start: from launching its process to
+# the first healthy response from the service root, which is what ECS waits
+# for before it sends a new task traffic during a deploy or scale-out.
+#
+# Each server mode is started --runs times and the report gives the fastest
+# and the median start. With --image, a built service image is timed the same
+# way with docker run, which includes the container runtime's own start. The
+# report also gives how long importing the service takes in a fresh
+# interpreter, and whether that import pulled in boto3:
+#
+#   python -m benchmark.startup --modes flask,gunicorn-flask --runs 10
+#   python -m benchmark.startup --modes none --image mythicalmysfits/service
+
+IMPORT_PROBE = """
+import sys, time
+started = time.perf_counter()
+import mythicalMysfitsService
+print(time.perf_counter() - started, "boto3" in sys.modules)
+"""
+
+POLL_INTERVAL = 0.01
+
+
+def timeImport(environment):
+    # the service is imported in a fresh interpreter each time, so nothing is
+    # already in sys.modules.
+    env = dict(os.environ)
+    env.update(environment)
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE],
+        cwd=servers.SERVICE_DIR,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.split()
+    return float(output[0]), output[1] == "True"
+
+
+def timeStart(start, url, timeout):
+    # start the service with start() and time it to its first healthy
+    # response, then stop it again with the process start() returned.
+    started = time.monotonic()
+    process = start()
+    try:
+        asyncio.run(
+            httpClient.waitUntilHealthy(url, timeout=timeout, interval=POLL_INTERVAL)
+        )
+        return time.monotonic() - started
+    finally:
+        servers.stopServer(process)
+
+
+def startImage(image, port, environment):
+    command = ["docker", "run", "--rm", "-p", "{}:8080".format(port)]
+    for name, value in environment.items():
+        command.extend(["-e", "{}={}".format(name, value)])
+    command.append(image)
+    return subprocess.Popen(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def summarize(seconds):
+    return {
+        "runs": len(seconds),
+        "minMs": round(min(seconds) * 1000, 1),
+        "medianMs": round(statistics.median(seconds) * 1000, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time the service from process start to its first healthy response."
+    )
+    parser.add_argument(
+        "--modes",
+        default="flask,asgi,gunicorn-flask,gunicorn-asgi",
+        help="comma-separated server modes, or none",
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--image", help="a built service image to time as well")
+    parser.add_argument(
+        "--source",
+        choices=("snapshot", "dynamodb"),
+        default="snapshot",
+        help="MYSFITS_DATA_SOURCE for the service; dynamodb needs no table to start",
+    )
+    options = parser.parse_args(argv)
+
+    environment = {"MYSFITS_DATA_SOURCE": options.source}
+    importSeconds, importsBoto3 = timeImport(environment)
+    results = {}
+    modes = [] if options.modes == "none" else options.modes.split(",")
+    for mode in modes:
+        seconds = []
+        for _ in range(options.runs):
+            port = servers.freePort()
+            seconds.append(
+                timeStart(
+                    lambda: servers.startServer(mode, port, environment),
+                    "http://127.0.0.1:{}".format(port),
+                    options.timeout,
+                )
+            )
+        results[mode] = summarize(seconds)
+    if options.image:
+        seconds = []
+        for _ in range(options.runs):
+            port = servers.freePort()
+            seconds.append(
+                timeStart(
+                    lambda: startImage(options.image, port, environment),
+                    "http://127.0.0.1:{}".format(port),
+                    options.timeout,
+                )
+            )
+        results["image"] = summarize(seconds)
+
+    json.dump(
+        {
+            "source": options.source,
+            "importMs": round(importSeconds * 1000, 1),
+            "importsBoto3": importsBoto3,
+            "results": results,
+        },
+        sys.stdout,
+        indent=2,
+    )
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
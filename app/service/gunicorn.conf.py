@@ -0,0 +1,99 @@
+import gc
+import os
+import sys
+
+# The production server for the Mythical Mysfits service. gunicorn loads the
+# service once in its master process (preload_app), which reads and indexes
+# the mysfits catalog, and then forks the worker processes. The workers share
+# the master's copy of the catalog copy-on-write instead of each loading their
+# own.
+#
+# Everything is tuned from the environment of the ECS task:
+#
+#   MYSFITS_SERVER           flask (default) or asgi
+#   MYSFITS_WORKERS          worker processes, default 2 * vCPUs + 1
+#   MYSFITS_THREADS          threads per Flask worker, default 4
+#   MYSFITS_MAX_IN_FLIGHT    most requests a worker admits at once, default 200;
+#                            fewer while latency climbs (see mysfitsAdmission)
+#   MYSFITS_MAX_QUEUE_MS     how long a request may wait to be admitted, including
+#                            time queued for a Flask worker's threads, default 50
+#   MYSFITS_KEEPALIVE        seconds to hold an idle connection open, default 75
+#   MYSFITS_TIMEOUT          seconds before a stuck worker is restarted, default 30
+#   MYSFITS_GRACEFUL_TIMEOUT seconds workers get to finish on shutdown, default 20
+#   PORT                     listening port, default 8080
+
+
+def _availableCpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+_server = os.environ.get("MYSFITS_SERVER", "flask")
+
+if _server == "asgi":
+    wsgi_app = "mythicalMysfitsAsgi:app"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "mythicalMysfitsService:app"
+    # gunicorn's gthread worker, which tells admission control how long each
+    # request was queued for a thread before it got one (see mysfitsWorker),
+    # so that wait counts against the request's queue budget.
+    worker_class = "mysfitsWorker.QueueTimedWorker"
+    threads = int(os.environ.get("MYSFITS_THREADS", "4"))
+
+bind = "0.0.0.0:{}".format(os.environ.get("PORT", "8080"))
+workers = int(os.environ.get("MYSFITS_WORKERS", str(2 * _availableCpus() + 1)))
+keepalive = int(os.environ.get("MYSFITS_KEEPALIVE", "75"))
+timeout = int(os.environ.get("MYSFITS_TIMEOUT", "30"))
+graceful_timeout = int(os.environ.get("MYSFITS_GRACEFUL_TIMEOUT", "20"))
+preload_app = True
+
+# Access logging is left to the load balancer; errors still go to stderr.
+accesslog = None
+errorlog = "-"
+
+# The service's own logging is set up here rather than in a hook: gunicorn
+# loads the app before it calls any, and loading it logs too. The workers
+# inherit the configuration when they are forked.
+import mysfitsHandlers  # noqa: E402
+
+mysfitsHandlers.configureLogging()
+
+
+def when_ready(server):
+    # boto3 is only imported when first needed (see
+    # mysfitsTableClient.getClient). When every listing is read from
+    # DynamoDB it is needed straight away, so it is imported once here, before
+    # the workers are forked, and shared by all of them like the catalog is.
+    if os.environ.get("MYSFITS_DATA_SOURCE") == "dynamodb":
+        import boto3  # noqa: F401
+        import botocore.config  # noqa: F401
+
+
+def pre_fork(server, worker):
+    # move everything the master has allocated so far, the catalog included,
+    # out of the garbage collector's reach. Otherwise the first collection in
+    # each worker writes to every object header and un-shares their pages.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # threads do not survive fork, and sockets must not be shared between
+    # processes, so each worker starts its own snapshot watcher and its own
+    # DynamoDB connection pool.
+    import mysfitsTableClient
+
+    mysfitsTableClient.resetAfterFork()
+    source = getattr(sys.modules.get(wsgi_app.split(":")[0]), "mysfitsSource", None)
+    if hasattr(source, "restartWatcherAfterFork"):
+        source.restartWatcherAfterFork()
+
+
+def worker_exit(server, worker):
+    # gunicorn stops its workers with SIGTERM; write out any likes and access
+    # log entries the worker is still holding before it goes.
+    import mysfitsHandlers
+
+    mysfitsHandlers.flushBuffers()
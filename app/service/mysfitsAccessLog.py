@@ -0,0 +1,141 @@
+import atexit
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+import mysfitsJson
+
+# Structured access logs, one JSON object per line on stdout, where ECS ships
+# them to CloudWatch Logs:
+#
+#   {"time":1700000000.123,"method":"GET","path":"/mysfits","route":"/mysfits",
+#    "status":200,"latencyMs":1.92,"bytes":5120,"cache":"hit","pid":7}
+#
+# Writing a log line to the console on the request path costs about as much as
+# serving /mysfits from memory, so recording a request only appends a tuple to
+# an in-memory buffer. A background thread formats and writes the buffered
+# entries in one go every flushInterval seconds. If the buffer is full when a
+# request finishes, its entry is dropped and counted rather than making the
+# request wait.
+#
+# Each route is logged at its own sample rate, so the busiest routes can be
+# logged at 1% while rare ones are logged in full. A sampled entry carries its
+# sampleRate, so that counts can be scaled back up.
+
+
+def parseSampleRates(text):
+    # "route=rate,..." as a dict; "*" sets the rate for every other route.
+    rates = {}
+    for part in (text or "").split(","):
+        route, _, rate = part.strip().rpartition("=")
+        if route:
+            rates[route] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+def cacheOutcome(lookups):
+    # summarizes the cache lookups made for one request (see
+    # mysfitsCache.lookups): hit, miss, partial, or None if there were none.
+    if not lookups:
+        return None
+    hits = sum(lookups)
+    if hits == len(lookups):
+        return "hit"
+    return "miss" if hits == 0 else "partial"
+
+
+class AccessLog(object):
+    def __init__(self, write, sampleRates=None, flushInterval=1.0, maxBuffered=10000):
+        # write(data) writes a batch of log lines, as bytes.
+        self._write = write
+        self.sampleRates = dict(sampleRates or {})
+        self.defaultRate = self.sampleRates.pop("*", 1.0)
+        self.flushInterval = flushInterval
+        self.maxBuffered = maxBuffered
+        self.dropped = 0
+        self._entries = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def record(self, method, path, route, status, latency, size, cache):
+        rate = self.sampleRates.get(route, self.defaultRate)
+        if rate < 1.0 and random.random() >= rate:
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._start()
+        # deque appends are atomic, so the request path takes no lock. The
+        # length check may let a few entries past maxBuffered when threads
+        # race, which only matters to the bound, not to correctness.
+        if len(self._entries) >= self.maxBuffered:
+            self.dropped += 1
+            return
+        self._entries.append(
+            (time.time(), method, path, route, status, latency, size, cache, rate)
+        )
+
+    def flush(self):
+        # write out every entry buffered so far.
+        lines = []
+        pid = os.getpid()
+        while True:
+            try:
+                entry = self._entries.popleft()
+            except IndexError:
+                break
+            lines.append(self._format(entry, pid))
+        if lines:
+            try:
+                self._write(b"".join(lines))
+            except Exception:
+                # there is nowhere left to report a failure to write logs to.
+                self.dropped += len(lines)
+
+    def stop(self):
+        # flush whatever is left. Called when the process shuts down.
+        self._stopped = True
+        self._wake.set()
+        self.flush()
+
+    def _format(self, entry, pid):
+        started, method, path, route, status, latency, size, cache, rate = entry
+        document = {
+            "time": round(started, 3),
+            "method": method,
+            "path": path,
+            "route": route,
+            "status": status,
+            "latencyMs": round(latency * 1000, 3),
+            "bytes": size,
+            "cache": cache,
+            "pid": pid,
+        }
+        if rate < 1.0:
+            document["sampleRate"] = rate
+        return mysfitsJson.dumps(document) + b"\n"
+
+    def _start(self):
+        # started with the first entry rather than at import time, so a
+        # preloading prefork master never owns a writer thread that its
+        # workers would not inherit.
+        self._thread = threading.Thread(
+            target=self._run, name="mysfits-access-log", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flushInterval)
+            self.flush()
+
+
+def writeStdout(data):
+    sys.stdout.buffer.write(data)
+    sys.stdout.buffer.flush()
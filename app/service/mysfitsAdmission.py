@@ -0,0 +1,214 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+
+# Admission control for the service. When DynamoDB slows down, requests that
+# need it take longer, more of them are in flight at once, and without a limit
+# they pile up until every one of them times out, health checks on / included,
+# and ECS replaces a task that was only slow.
+#
+# Each worker process therefore admits at most `limit` requests at a time.
+# A request arriving when the limit is reached waits for a slot, but for no
+# longer than maxQueueTime and only behind a queue no longer than the limit
+# itself. Time the request has already spent queued in the server, when the
+# server says (see mysfitsWorker), counts against maxQueueTime. Otherwise it
+# is shed straight away with a 503 and a Retry-After header. Health checks,
+# /metrics and /admin/profile never wait and are never shed.
+#
+# The limit is not fixed. After each request it is moved by the gradient
+# between the long-run average latency and the average over the last few
+# requests: while requests take about as long as usual it grows by roughly
+# sqrt(limit), as soon as they take longer it shrinks in proportion, and a
+# request that fails with a server error cuts it multiplicatively (the
+# decrease half of AIMD). The limit settles at the concurrency the backend
+# can serve without latency climbing, so the requests that are admitted keep
+# a bounded p99.
+
+# Routes that are always admitted, by mysfitsMetrics.routeLabel. A profile
+# takes as long as it was asked to, which says nothing about the backend.
+PRIORITY_ROUTES = frozenset(("/", "/metrics", "/admin/profile"))
+
+# The WSGI environ key under which the server passes the time.perf_counter()
+# a request was queued at, if it does (see mysfitsWorker).
+ENQUEUED_AT = "mysfits.enqueuedAt"
+
+ADMITTED = "admitted"
+QUEUED = "queued"
+SHED = "shed"
+
+
+class _AsyncWaiter(object):
+    # wakes a coroutine waiting in admitAsync from whichever thread released
+    # the slot it was handed.
+    def __init__(self, loop):
+        self._loop = loop
+        self.future = loop.create_future()
+
+    def set(self):
+        self._loop.call_soon_threadsafe(self._grant)
+
+    def _grant(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class AdmissionController(object):
+    def __init__(
+        self,
+        initialLimit=20,
+        minLimit=2,
+        maxLimit=200,
+        maxQueueTime=0.05,
+        tolerance=1.5,
+        smoothing=0.2,
+        shortWindow=10,
+        longWindow=100,
+        backoff=0.9,
+        enabled=True,
+    ):
+        # tolerance is how much slower than usual a request may be before the
+        # limit shrinks; smoothing how far each sample moves the limit;
+        # shortWindow and longWindow how many samples the recent and the usual
+        # latency are averaged over; and backoff what the limit is multiplied
+        # by after a failed request.
+        self.minLimit = min(minLimit, maxLimit)
+        self.maxLimit = maxLimit
+        self.limit = float(min(maxLimit, max(minLimit, initialLimit)))
+        self.maxQueueTime = maxQueueTime
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.shortWindow = shortWindow
+        self.longWindow = longWindow
+        self.backoff = backoff
+        self.enabled = enabled
+        self.inFlight = 0
+        self.shed = 0
+        self._shortLatency = None
+        self._longLatency = None
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def admit(self, queuedSince=None):
+        # blocks a thread until the request is admitted, returning the ticket
+        # to hand back to release(), or returns None if it was shed.
+        # queuedSince is the time.perf_counter() the request started waiting
+        # at, if that was before it got here.
+        if not self.enabled:
+            return time.perf_counter()
+        budget = self._queueBudget(queuedSince)
+        state, waiter = self._enter(threading.Event, budget)
+        if state is QUEUED:
+            waiter.wait(budget)
+            state = self._leaveQueue(waiter)
+        return self._ticket(state)
+
+    async def admitAsync(self, queuedSince=None):
+        # admit() for a coroutine: waiting for a slot never blocks the loop.
+        if not self.enabled:
+            return time.perf_counter()
+        budget = self._queueBudget(queuedSince)
+        state, waiter = self._enter(
+            lambda: _AsyncWaiter(asyncio.get_running_loop()), budget
+        )
+        if state is QUEUED:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), budget)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # the client went away; give back a slot handed over meanwhile.
+                if self._leaveQueue(waiter) is ADMITTED:
+                    self._release(None, True)
+                raise
+            state = self._leaveQueue(waiter)
+        return self._ticket(state)
+
+    def release(self, ticket, ok=True):
+        # ok is False when the request failed with a server error.
+        if not self.enabled:
+            return
+        self._release(time.perf_counter() - ticket, ok)
+
+    def _queueBudget(self, queuedSince):
+        if queuedSince is None:
+            return self.maxQueueTime
+        return self.maxQueueTime - (time.perf_counter() - queuedSince)
+
+    def _enter(self, makeWaiter, budget):
+        with self._lock:
+            # waiting requests are served first, so a new arrival only gets a
+            # free slot straight away when nobody is queued for it.
+            if not self._waiters and self.inFlight < int(self.limit):
+                self.inFlight += 1
+                return ADMITTED, None
+            if budget <= 0 or len(self._waiters) >= int(self.limit):
+                return SHED, None
+            waiter = makeWaiter()
+            self._waiters.append(waiter)
+            return QUEUED, waiter
+
+    def _leaveQueue(self, waiter):
+        # a waiter still in the queue has waited too long. One that is no
+        # longer there was handed a slot by _release, even if it only woke up
+        # because its wait timed out at the same moment.
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                return ADMITTED
+            return SHED
+
+    def _ticket(self, state):
+        if state is ADMITTED:
+            return time.perf_counter()
+        with self._lock:
+            self.shed += 1
+        return None
+
+    def _release(self, latency, ok):
+        with self._lock:
+            if latency is not None:
+                self._adjust(latency, ok)
+            self.inFlight -= 1
+            while self._waiters and self.inFlight < int(self.limit):
+                self.inFlight += 1
+                self._waiters.popleft().set()
+
+    def _adjust(self, latency, ok):
+        if not ok:
+            self.limit = max(self.minLimit, self.limit * self.backoff)
+            return
+        # requests answered from a cache and requests that went to DynamoDB
+        # take very different times, so single samples are too noisy to
+        # compare; the recent latency is averaged over a few of them.
+        latency = max(latency, 1e-6)
+        if self._longLatency is None:
+            self._shortLatency = self._longLatency = latency
+        else:
+            self._shortLatency += (latency - self._shortLatency) / self.shortWindow
+            self._longLatency += (latency - self._longLatency) / self.longWindow
+            # once the backend has recovered, the long-run average is far above
+            # what requests now take; let it catch up rather than holding the
+            # limit down for another longWindow samples.
+            if self._longLatency > 2 * self._shortLatency:
+                self._longLatency *= 0.95
+        gradient = self.tolerance * self._longLatency / self._shortLatency
+        gradient = max(0.5, min(1.0, gradient))
+        # a limit that is not being used says nothing about whether a larger
+        # one would be safe, so it only grows while at least half of it is.
+        if gradient == 1.0 and self.inFlight < self.limit / 2:
+            return
+        newLimit = self.limit * gradient + math.sqrt(self.limit)
+        self.limit = min(
+            self.maxLimit,
+            max(
+                self.minLimit,
+                self.limit * (1 - self.smoothing) + newLimit * self.smoothing,
+            ),
+        )
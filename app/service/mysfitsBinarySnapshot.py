@@ -0,0 +1,737 @@
+import array
+import bisect
+import gzip
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import zlib
+
+import mysfitsCache
+import mysfitsFields
+import mysfitsJson
+import mysfitsPaging
+import mysfitsSnapshot
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# A compact binary form of the mysfits catalog that the snapshot source can
+# serve straight from a read-only memory map, built with
+# "python -m tools.buildSnapshot" (see that tool).
+#
+# A MysfitsSnapshot parses the JSON catalog into Python objects, and every
+# worker process ends up with its own copy of them: memory grows with the
+# number of workers times the size of the catalog. A binary snapshot is
+# instead mapped into memory as it is, so every worker on the task shares the
+# same pages of the kernel's page cache, and serving a mysfit only slices the
+# bytes it was serialized to when the file was built. No Python object is
+# built per mysfit, however big the catalog.
+#
+# The file holds every mysfit serialized once, in the listing of whole
+# mysfits, which is sent from the mapping as it is. Every other listing is
+# assembled from those bytes as it is sent: filtered listings from the
+# mysfits a filter bitmap selects, listings of the summary or of any other
+# fields by projecting each mysfit, a chunk at a time, so no worker ever
+# holds a whole listing in its own memory. Only the two listings asked for
+# most, of whole mysfits and of the summary, are also stored compressed.
+#
+# The file is a preamble, a JSON header describing its sections, and the
+# sections themselves, each starting on an 8-byte boundary:
+#
+#   items            the listing of whole mysfits, {"mysfits":[...]}, exactly
+#                    as /mysfits?fields=all returns it
+#   itemOffsets      uint64 per mysfit, plus one: mysfit i is the bytes from
+#                    itemOffsets[i] up to the comma or bracket at
+#                    itemOffsets[i + 1] - 1
+#   idStarts         uint32 per mysfit: where its mysfitId starts, from the
+#                    start of the mysfit
+#   idLengths        uint16 per mysfit: how many bytes the id takes, as it
+#                    is written inside the quotes of its JSON string
+#   idOrder          uint32 per mysfit: the listing positions in mysfitId order
+#   filter/<name>/<value>
+#                    one bitmap per value of each of FILTER_ATTRIBUTES, bit r
+#                    (least significant first) set when the mysfit with rank
+#                    r in mysfitId order has that value
+#   items.gzip, items.br, summary.gzip, summary.br
+#                    the listings of whole mysfits and of
+#                    mysfitsFields.SUMMARY_FIELDS, as /mysfits returns them by
+#                    default, compressed, when the file was built with
+#                    compression
+#
+# Numbers are little-endian. The header also holds the ETags of those two
+# listings and their compressed variants, computed the same way EncodedBody
+# computes them.
+#
+# The file is about 1.5 times the size of the catalog as JSON; the compressed
+# listings are nearly all of the difference. writeSnapshot reports the ratio, and
+# tools.buildSnapshot and tools.exportSnapshot check it against
+# MAX_SIZE_RATIO.
+#
+# A new catalog must replace the file with a rename, never by writing over it:
+# every worker still has the old file mapped until it has loaded the new one.
+
+MAGIC = b"MYSFSNAP"
+FORMAT_VERSION = 3
+
+# magic, format version, header length.
+PREAMBLE = struct.Struct("<8sII")
+
+ALIGNMENT = 8
+
+# Listings up to this size are sent as one body; bigger ones are sent in
+# chunks of STREAM_CHUNK_BYTES, so sending one never copies the whole listing.
+MAX_SINGLE_BODY = 1024 * 1024
+STREAM_CHUNK_BYTES = 256 * 1024
+
+# Listings streamed compressed are flushed every this many bytes.
+STREAM_FLUSH_BYTES = 64 * 1024
+
+# single mysfits kept encoded, with their compressed variants, per snapshot.
+MAX_ENCODED_MYSFITS = 4096
+
+LISTING_PREFIX = b'{"mysfits":['
+LISTING_SUFFIX = b"]}"
+
+# The most a snapshot should weigh against the catalog as JSON. Below
+# MIN_CHECKED_SIZE bytes of JSON the header and the bitmaps, whose sizes do
+# not depend on the catalog's, make the ratio meaningless.
+MAX_SIZE_RATIO = 1.5
+MIN_CHECKED_SIZE = 1024 * 1024
+
+
+def isBinarySnapshot(path):
+    with open(path, "rb") as snapshotFile:
+        return snapshotFile.read(len(MAGIC)) == MAGIC
+
+
+# -- writing ----------------------------------------------------------------
+
+
+class _Region(object):
+    # one listing being written, with its offset table, digest and compressed
+    # variants built as it goes. With keep=False the listing itself is not
+    # written out, only its compressed variants.
+    def __init__(self, directory, compress, gzipLevel, brotliQuality, keep=True):
+        self.file = tempfile.TemporaryFile(dir=directory) if keep else None
+        self.offsets = array.array("Q")
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.gzipFile = self.brotli = None
+        if compress:
+            self.gzipFile = tempfile.TemporaryFile(dir=directory)
+            self.gzip = gzip.GzipFile(
+                fileobj=self.gzipFile, mode="wb", compresslevel=gzipLevel, mtime=0
+            )
+            if brotli is not None:
+                self.brotliFile = tempfile.TemporaryFile(dir=directory)
+                self.brotli = brotli.Compressor(
+                    mode=brotli.MODE_TEXT, quality=brotliQuality
+                )
+        self._write(LISTING_PREFIX)
+
+    def add(self, itemBody):
+        if self.offsets:
+            self._write(b",")
+        self.offsets.append(self.size)
+        self._write(itemBody)
+
+    def finish(self):
+        # the offset table ends one byte past the last mysfit, where the
+        # closing bracket is, just as a comma follows every other mysfit.
+        self.offsets.append(self.size + 1 if self.offsets else self.size)
+        self._write(LISTING_SUFFIX)
+        if self.file is not None:
+            self.file.flush()
+        if self.gzipFile is not None:
+            self.gzip.close()
+        if self.brotli is not None:
+            self.brotliFile.write(self.brotli.finish())
+
+    def variants(self, name):
+        # the (name, data) sections of the listing's compressed variants, and
+        # the ETags of the listing and of each variant.
+        digest = self.digest.hexdigest()[:32]
+        sections = []
+        etags = {name: '"{}"'.format(digest)}
+        if self.gzipFile is not None:
+            sections.append((name + ".gzip", self.gzipFile))
+            etags[name + ".gzip"] = '"{}-gzip"'.format(digest)
+        if self.brotli is not None:
+            sections.append((name + ".br", self.brotliFile))
+            etags[name + ".br"] = '"{}-br"'.format(digest)
+        return sections, etags
+
+    def _write(self, data):
+        if self.file is not None:
+            self.file.write(data)
+        self.size += len(data)
+        self.digest.update(data)
+        if self.gzipFile is not None:
+            self.gzip.write(data)
+        if self.brotli is not None:
+            self.brotliFile.write(self.brotli.process(data))
+
+
+def _littleEndian(numbers):
+    if sys.byteorder != "little":
+        numbers = array.array(numbers.typecode, numbers)
+        numbers.byteswap()
+    return numbers.tobytes()
+
+
+class BuildReport(object):
+    # what writeSnapshot wrote: the number of mysfits, the size of the file,
+    # and that of the catalog as JSON, which is the listing of whole mysfits.
+    def __init__(self, count, size, jsonSize):
+        self.count = count
+        self.size = size
+        self.jsonSize = jsonSize
+
+    @property
+    def ratio(self):
+        return self.size / max(self.jsonSize, 1)
+
+    def isTooLarge(self):
+        return self.jsonSize >= MIN_CHECKED_SIZE and self.ratio > MAX_SIZE_RATIO
+
+
+def writeSnapshot(
+    mysfits,
+    path,
+    compress=True,
+    gzipLevel=9,
+    brotliQuality=9,
+):
+    # writes the mysfits, an iterable of mysfit dicts, to a binary snapshot at
+    # path, replacing any file there in one rename. The mysfits are streamed
+    # through; only their ids and filter values are held in memory. Returns a
+    # BuildReport.
+    directory = os.path.dirname(os.path.abspath(path))
+    items = _Region(directory, compress, gzipLevel, brotliQuality)
+    summary = _Region(directory, compress, gzipLevel, brotliQuality, keep=False)
+    ids = []
+    idStarts = array.array("I")
+    idLengths = array.array("H")
+    values = {filterName: [] for filterName in mysfitsSnapshot.FILTER_ATTRIBUTES}
+    for mysfit in mysfits:
+        itemBody = mysfitsSnapshot.serializeMysfit(mysfit)
+        items.add(itemBody)
+        summary.add(
+            mysfitsSnapshot.serializeMysfit(
+                mysfitsFields.project(mysfit, mysfitsFields.SUMMARY_FIELDS)
+            )
+        )
+        # the mysfitId is found where it was serialized, rather than stored a
+        # second time.
+        encodedId = mysfitsJson.dumps(mysfit["mysfitId"])
+        idStart = itemBody.find(b'"mysfitId":' + encodedId)
+        if idStart < 0:
+            raise ValueError("mysfit {} has no mysfitId".format(len(ids)))
+        # DynamoDB keys are at most 2048 bytes, and items 400 KB.
+        idStarts.append(idStart + len(b'"mysfitId":"'))
+        idLengths.append(len(encodedId) - 2)
+        ids.append(mysfit["mysfitId"])
+        for filterName, attribute in mysfitsSnapshot.FILTER_ATTRIBUTES.items():
+            values[filterName].append(mysfit.get(attribute))
+    items.finish()
+    summary.finish()
+
+    count = len(ids)
+    encodedIds = [mysfitId.encode("utf-8") for mysfitId in ids]
+    if len(set(encodedIds)) != count:
+        raise ValueError("mysfitIds are not unique")
+    # UTF-8 bytes sort in the same order as the strings they encode.
+    idOrder = array.array("I", sorted(range(count), key=encodedIds.__getitem__))
+    del ids, encodedIds
+
+    sections = [
+        ("items", items.file),
+        ("itemOffsets", _littleEndian(items.offsets)),
+        ("idStarts", _littleEndian(idStarts)),
+        ("idLengths", _littleEndian(idLengths)),
+        ("idOrder", _littleEndian(idOrder)),
+    ]
+    filters = {}
+    for filterName, filterValues in values.items():
+        bitmaps = {}
+        for rank, position in enumerate(idOrder):
+            value = filterValues[position]
+            if value is None:
+                continue
+            bitmap = bitmaps.get(value)
+            if bitmap is None:
+                bitmap = bitmaps[value] = bytearray((count + 7) // 8)
+            bitmap[rank >> 3] |= 1 << (rank & 7)
+        filters[filterName] = sorted(bitmaps)
+        for value in filters[filterName]:
+            sections.append(
+                ("filter/{}/{}".format(filterName, value), bytes(bitmaps[value]))
+            )
+
+    etags = {}
+    for name, region in (("items", items), ("summary", summary)):
+        variantSections, listingEtags = region.variants(name)
+        sections.extend(variantSections)
+        etags.update(listingEtags)
+
+    size = _writeSections(path, count, sections, filters, etags)
+    return BuildReport(count, size, items.size)
+
+
+def _sectionSize(data):
+    if isinstance(data, bytes):
+        return len(data)
+    data.seek(0, os.SEEK_END)
+    return data.tell()
+
+
+def _writeSections(path, count, sections, filters, etags):
+    sizes = [_sectionSize(data) for _, data in sections]
+    # the header records where every section starts, which depends on the
+    # length of the header itself; offsets are first laid out relative to the
+    # end of the header, then the header is padded to a fixed size.
+    layout = {}
+    offset = 0
+    for (name, _), size in zip(sections, sizes):
+        layout[name] = [offset, size]
+        offset += size + (-size % ALIGNMENT)
+    header = {
+        "count": count,
+        "summaryFields": list(mysfitsFields.SUMMARY_FIELDS),
+        "filters": filters,
+        "etags": etags,
+        "sections": layout,
+    }
+    # section offsets written into the header can only make it longer, by a
+    # bounded number of digits per section.
+    headerLength = len(mysfitsJson.dumps(header)) + 20 * len(sections)
+    headerLength += -(PREAMBLE.size + headerLength) % ALIGNMENT
+    base = PREAMBLE.size + headerLength
+    for name in layout:
+        layout[name][0] += base
+    headerBytes = mysfitsJson.dumps(header)
+    headerBytes += b" " * (headerLength - len(headerBytes))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temporaryPath = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as output:
+            output.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, headerLength))
+            output.write(headerBytes)
+            for (name, data), size in zip(sections, sizes):
+                if isinstance(data, bytes):
+                    output.write(data)
+                else:
+                    data.seek(0)
+                    shutil.copyfileobj(data, output, STREAM_CHUNK_BYTES)
+                    data.close()
+                output.write(b"\0" * (-size % ALIGNMENT))
+            output.flush()
+            os.fsync(output.fileno())
+        # mkstemp creates the file readable by its owner only; the service
+        # may run as another user.
+        os.chmod(temporaryPath, 0o644)
+        os.replace(temporaryPath, path)
+    except BaseException:
+        os.unlink(temporaryPath)
+        raise
+    return base + offset
+
+
+# -- reading ----------------------------------------------------------------
+
+
+class ItemBodies(object):
+    # the serialized mysfits of a listing section, as zero-copy slices of the
+    # mapped file, indexed by listing position. separator is the number of
+    # bytes between one entry and the next: the comma in a listing, nothing
+    # between mysfitIds.
+    def __init__(self, region, offsets, separator=1):
+        self._region = region
+        self._offsets = offsets
+        self._separator = separator
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, position):
+        if not 0 <= position < len(self._offsets) - 1:
+            raise IndexError(position)
+        end = self._offsets[position + 1] - self._separator
+        return self._region[self._offsets[position] : end]
+
+
+class IdIndex(object):
+    # finds the listing position of a mysfitId with a binary search over the
+    # mysfits in mysfitId order, reading each id where it was serialized in
+    # the listing of whole mysfits. Answers get() like the dict of positions a
+    # MysfitsSnapshot keeps.
+    def __init__(self, items, itemOffsets, idStarts, idLengths, idOrder):
+        self._items = items
+        self._itemOffsets = itemOffsets
+        self._idStarts = idStarts
+        self._idLengths = idLengths
+        self._idOrder = idOrder
+
+    def _id(self, position):
+        start = self._itemOffsets[position] + self._idStarts[position]
+        encoded = bytes(self._items[start : start + self._idLengths[position]])
+        if b"\\" in encoded:
+            # an id with characters JSON escapes.
+            encoded = mysfitsJson.loads(b'"' + encoded + b'"').encode("utf-8")
+        return encoded
+
+    def get(self, mysfitId, default=None):
+        wanted = mysfitId.encode("utf-8")
+        low, high = 0, len(self._idOrder)
+        while low < high:
+            middle = (low + high) // 2
+            candidate = self._id(self._idOrder[middle])
+            if candidate < wanted:
+                low = middle + 1
+            elif candidate > wanted:
+                high = middle
+            else:
+                return self._idOrder[middle]
+        return default
+
+
+class BitmapMembers(object):
+    # the listing positions of the mysfits in one filter bucket, in mysfitId
+    # order like the GSI the filter mirrors, read from the bucket's bitmap.
+    # Slicing finds its starting point through a directory of how many
+    # members precede each block of the bitmap, so reading a page deep into a
+    # bucket only scans the block it starts in.
+    BLOCK_BYTES = 4096
+
+    def __init__(self, bitmap, idOrder):
+        self._bitmap = bitmap
+        self._idOrder = idOrder
+        self._blockStarts = []
+        total = 0
+        for start in range(0, len(bitmap), self.BLOCK_BYTES):
+            self._blockStarts.append(total)
+            block = bitmap[start : start + self.BLOCK_BYTES]
+            total += int.from_bytes(block, "little").bit_count()
+        self._length = total
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError("filter members can only be sliced")
+        start, stop, step = index.indices(self._length)
+        if step != 1:
+            raise ValueError("filter members can only be sliced with step 1")
+        if start >= stop:
+            return []
+        block = bisect.bisect_right(self._blockStarts, start) - 1
+        skip = start - self._blockStarts[block]
+        wanted = stop - start
+        positions = []
+        offset = block * self.BLOCK_BYTES
+        while len(positions) < wanted:
+            word = int.from_bytes(self._bitmap[offset : offset + 8], "little")
+            while word and len(positions) < wanted:
+                lowest = word & -word
+                word ^= lowest
+                if skip:
+                    skip -= 1
+                else:
+                    rank = offset * 8 + lowest.bit_length() - 1
+                    positions.append(self._idOrder[rank])
+            offset += 8
+        return positions
+
+
+class MappedBody(object):
+    # a listing stored in the snapshot, with the compressed variants stored
+    # alongside it. Answers select() like an EncodedBody; bodies too big to
+    # send in one piece are returned as an iterator of chunks. A listing
+    # stored only compressed, the summary, has no body: a client that takes
+    # none of its encodings is sent it assembled from itemBodies instead.
+    def __init__(self, body, etag, variants, itemBodies=None):
+        self.body = body
+        self.etag = etag
+        self.variants = variants
+        self._itemBodies = itemBodies
+
+    def select(self, acceptEncoding):
+        coding = mysfitsSnapshot.negotiateEncoding(acceptEncoding, self.variants)
+        if coding is None:
+            if self.body is None:
+                return None, _streamItems(self._itemBodies, None), self.etag
+            return None, _sendable(self.body), self.etag
+        body, etag = self.variants[coding]
+        return coding, _sendable(body), etag
+
+
+def _sendable(region):
+    if len(region) <= MAX_SINGLE_BODY:
+        return bytes(region)
+    return (
+        bytes(region[start : start + STREAM_CHUNK_BYTES])
+        for start in range(0, len(region), STREAM_CHUNK_BYTES)
+    )
+
+
+class ProjectedBodies(object):
+    # the mysfits of a snapshot cut down to a set of fields other than the
+    # summary, serialized as they are read.
+    def __init__(self, itemBodies, fields):
+        self._itemBodies = itemBodies
+        self._fields = fields
+
+    def __len__(self):
+        return len(self._itemBodies)
+
+    def __getitem__(self, position):
+        mysfit = mysfitsJson.loads(bytes(self._itemBodies[position]))
+        return mysfitsSnapshot.serializeMysfit(
+            mysfitsFields.project(mysfit, self._fields)
+        )
+
+
+class StreamedListing(object):
+    # a listing of mysfits cut down to fields the file holds no listings of.
+    # Answers select() like an EncodedBody, but the body is projected,
+    # serialized and, for a client that accepts it, compressed a chunk at a
+    # time as it is sent, so it is never held whole. Its ETag is derived from
+    # that of the listing of whole mysfits, which changes with any mysfit,
+    # and from what the listing selects.
+    def __init__(self, itemBodies, positions, listingEtag, key):
+        self._itemBodies = itemBodies
+        self._positions = positions
+        digest = hashlib.sha256(
+            mysfitsJson.dumps([listingEtag] + list(key))
+        ).hexdigest()[:32]
+        self.etag = '"{}"'.format(digest)
+        self.variants = {"gzip": '"{}-gzip"'.format(digest)}
+        if brotli is not None:
+            self.variants["br"] = '"{}-br"'.format(digest)
+
+    def select(self, acceptEncoding):
+        coding = mysfitsSnapshot.negotiateEncoding(acceptEncoding, self.variants)
+        chunks = _streamItems(self._itemBodies, self._positions)
+        if coding is None:
+            return None, chunks, self.etag
+        return coding, _compressChunks(chunks, coding), self.variants[coding]
+
+
+def _streamItems(itemBodies, positions):
+    # the listing of the mysfits at positions, all of them if None, a chunk
+    # of mysfits at a time.
+    if positions is None:
+        positions = range(len(itemBodies))
+    size = mysfitsPaging.STREAM_CHUNK_SIZE
+    return mysfitsPaging.streamBody(
+        [itemBodies[position] for position in positions[start : start + size]]
+        for start in range(0, len(positions), size)
+    )
+
+
+def _compressChunks(chunks, coding):
+    # compress a streamed body as it is sent, at the request path's settings.
+    # The compressor holds back its output until it has a sizeable block, so
+    # it is flushed every STREAM_FLUSH_BYTES of input; otherwise producing the
+    # next piece of the body could mean projecting thousands of mysfits.
+    if coding == "gzip":
+        compressor = zlib.compressobj(
+            mysfitsSnapshot.REQUEST_PATH_GZIP_LEVEL, zlib.DEFLATED, 31
+        )
+        compress, finish = compressor.compress, compressor.flush
+
+        def flush():
+            return compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    else:
+        compressor = brotli.Compressor(
+            mode=brotli.MODE_TEXT, quality=mysfitsSnapshot.REQUEST_PATH_BROTLI_QUALITY
+        )
+        compress, flush, finish = (
+            compressor.process,
+            compressor.flush,
+            compressor.finish,
+        )
+    unflushed = 0
+    for chunk in chunks:
+        compressed = compress(chunk)
+        unflushed += len(chunk)
+        if unflushed >= STREAM_FLUSH_BYTES:
+            compressed += flush()
+            unflushed = 0
+        if compressed:
+            yield compressed
+    yield finish()
+
+
+class MappedView(object):
+    # the listings of a mapped snapshot for one set of fields. The whole
+    # listings of whole mysfits and of the summary are read from the file;
+    # every other listing is streamed (see StreamedListing).
+    def __init__(self, snapshot, fields, itemBodies, listing=None):
+        self.fields = fields
+        self.itemBodies = itemBodies
+        self._snapshot = snapshot
+        self._listing = listing
+
+    @property
+    def listing(self):
+        return self.encodedListing(None, None)
+
+    def encodedListing(self, filterName, value):
+        # the listing of every mysfit in the snapshot, or in one bucket of a
+        # filter, which must be a known filter and value.
+        if filterName is None and self._listing is not None:
+            return self._listing
+        return StreamedListing(
+            self.itemBodies,
+            self._snapshot.members(filterName, value),
+            self._snapshot.listing.etag,
+            (self.fields, filterName, value),
+        )
+
+    def joinItems(self, positions, nextCursor):
+        return mysfitsPaging.pageBody(
+            [self.itemBodies[position] for position in positions], nextCursor
+        )
+
+
+class MappedSnapshot(object):
+    # A binary snapshot mapped read-only into memory, with the same interface
+    # as MysfitsSnapshot, so SnapshotStore serves either. Pages and single
+    # mysfits are built from the mapped bytes when first requested and kept
+    # in bounded caches.
+    def __init__(self, path):
+        if sys.byteorder != "little":
+            raise ValueError("binary snapshots can only be read on little-endian hosts")
+        with open(path, "rb") as snapshotFile:
+            stat = os.fstat(snapshotFile.fileno())
+            self._map = mmap.mmap(snapshotFile.fileno(), 0, access=mmap.ACCESS_READ)
+        self.version = (stat.st_mtime_ns, stat.st_size)
+        mapped = memoryview(self._map)
+        if len(mapped) < PREAMBLE.size:
+            raise ValueError("{} is not a mysfits snapshot".format(path))
+        magic, formatVersion, headerLength = PREAMBLE.unpack_from(mapped)
+        if magic != MAGIC:
+            raise ValueError("{} is not a mysfits snapshot".format(path))
+        if formatVersion != FORMAT_VERSION:
+            raise ValueError(
+                "{} is snapshot format {}, this service reads format {}".format(
+                    path, formatVersion, FORMAT_VERSION
+                )
+            )
+        header = mysfitsJson.loads(
+            bytes(mapped[PREAMBLE.size : PREAMBLE.size + headerLength])
+        )
+        if tuple(header["summaryFields"]) != mysfitsFields.SUMMARY_FIELDS:
+            raise ValueError("{} has a different summary; rebuild it".format(path))
+        sections = {}
+        for name, (offset, size) in header["sections"].items():
+            if offset + size > len(mapped):
+                raise ValueError("{} is truncated".format(path))
+            sections[name] = mapped[offset : offset + size]
+        etags = header["etags"]
+        self.count = header["count"]
+
+        itemOffsets = sections["itemOffsets"].cast("Q")
+        self.itemBodies = ItemBodies(sections["items"], itemOffsets)
+        idOrder = sections["idOrder"].cast("I")
+        self.positions = IdIndex(
+            sections["items"],
+            itemOffsets,
+            sections["idStarts"].cast("I"),
+            sections["idLengths"].cast("H"),
+            idOrder,
+        )
+        self.filterMembers = {
+            filterName: {
+                value: BitmapMembers(
+                    sections["filter/{}/{}".format(filterName, value)], idOrder
+                )
+                for value in values
+            }
+            for filterName, values in header["filters"].items()
+        }
+
+        def mappedBody(name, itemBodies):
+            variants = {
+                coding: (sections[name + "." + coding], etags[name + "." + coding])
+                for coding in mysfitsSnapshot.PREFERRED_ENCODINGS
+                if name + "." + coding in sections
+            }
+            return MappedBody(sections.get(name), etags[name], variants, itemBodies)
+
+        self.full = MappedView(
+            self, None, self.itemBodies, mappedBody("items", self.itemBodies)
+        )
+        summaryBodies = ProjectedBodies(self.itemBodies, mysfitsFields.SUMMARY_FIELDS)
+        self.summary = MappedView(
+            self,
+            mysfitsFields.SUMMARY_FIELDS,
+            summaryBodies,
+            mappedBody("summary", summaryBodies),
+        )
+        self.listing = self.full.listing
+        self.emptyListing = mysfitsSnapshot.EncodedBody(
+            mysfitsSnapshot.serializeMysfits([])
+        )
+        self.itemEncoded = mysfitsCache.TtlCache(
+            maxSize=MAX_ENCODED_MYSFITS, ttl=float("inf")
+        )
+        self.pages = mysfitsCache.TtlCache(maxSize=1024, ttl=float("inf"))
+
+    def view(self, fields):
+        if fields is None:
+            return self.full
+        if fields == mysfitsFields.SUMMARY_FIELDS:
+            return self.summary
+        return MappedView(self, fields, ProjectedBodies(self.itemBodies, fields))
+
+    def filter(self, filterName, value, fields=None):
+        buckets = self.filterMembers.get(filterName)
+        if buckets is None:
+            return None
+        if value not in buckets:
+            return self.emptyListing
+        return self.view(fields).encodedListing(filterName, value)
+
+    def isListingBuilt(self, filterName, value, fields, stream=False):
+        # every listing is either in the file or streamed.
+        return True
+
+    def isPageBuilt(self, filterName, value, cursor, limit, fields):
+        return mysfitsSnapshot.isSnapshotPageBuilt(
+            self, filterName, value, cursor, limit, fields
+        )
+
+    def mysfit(self, mysfitId):
+        position = self.positions.get(mysfitId)
+        if position is None:
+            return None
+        return self.itemEncoded.getOrLoad(
+            position,
+            lambda: mysfitsSnapshot.encodeOnRequestPath(
+                bytes(self.itemBodies[position])
+            ),
+        )
+
+    def members(self, filterName, value):
+        if not filterName:
+            return range(self.count)
+        buckets = self.filterMembers.get(filterName)
+        if buckets is None:
+            return None
+        return buckets.get(value, ())
+
+    def page(self, filterName, value, cursor, limit, fields=None):
+        return mysfitsSnapshot.snapshotPage(
+            self, filterName, value, cursor, limit, fields
+        )
@@ -0,0 +1,92 @@
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+
+# A small in-process read-through cache used in front of DynamoDB. Entries
+# expire after a fixed time to live, the cache never holds more than maxSize
+# entries (the least recently used entry is evicted first), and writers can
+# invalidate entries explicitly when they know the underlying data changed.
+
+_MISSING = object()
+
+# The outcome of every cache lookup made while serving the current request,
+# True for a hit, for the access log. The frameworks set it to a fresh list
+# at the start of each request; outside of one it is None.
+lookups = contextvars.ContextVar("mysfitsCacheLookups", default=None)
+
+
+class TtlCache(object):
+    def __init__(self, maxSize=1024, ttl=5.0, clock=time.monotonic):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = self._clock()
+        noted = lookups.get()
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires, value = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    if noted is not None:
+                        noted.append(True)
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            if noted is not None:
+                noted.append(False)
+            return default
+
+    def put(self, key, value, ttl=None):
+        # ttl overrides the cache's time to live for this one entry.
+        expires = self._clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def getOrLoad(self, key, loader):
+        # return the cached value for key, calling loader() to fetch and cache
+        # it on a miss. The loader runs outside the lock so that a slow backend
+        # call never blocks readers of other keys.
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.put(key, value)
+        return value
+
+    def peek(self, key, default=None):
+        # the value cached for key, like get(), but without counting a lookup
+        # or refreshing the entry's place in the eviction order.
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING or entry[0] <= self._clock():
+            return default
+        return entry[1]
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidateWhere(self, predicate):
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
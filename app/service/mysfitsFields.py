@@ -0,0 +1,62 @@
+# Sparse fieldsets for the /mysfits listings.
+#
+# The grid of mysfits on the website only shows each mysfit's name, species,
+# alignment and thumbnail; the rest of a mysfit, most of all its multi-sentence
+# description, is only shown on its profile, which the website reads from
+# /mysfits/<id>. Listings therefore return a summary of each mysfit by
+# default, and a client can choose the fields it wants with
+# /mysfits?fields=<field>,<field>,... instead, or fields=all for whole
+# mysfits. mysfitId is always included. /mysfits/<id> always returns the
+# whole mysfit.
+
+# Every field a mysfit can have, in the order they are serialized.
+FIELDS = (
+    "mysfitId",
+    "name",
+    "species",
+    "age",
+    "description",
+    "goodevil",
+    "lawchaos",
+    "thumbImageUri",
+    "profileImageUri",
+    "likes",
+    "adopted",
+)
+
+SUMMARY_FIELDS = (
+    "mysfitId",
+    "name",
+    "species",
+    "goodevil",
+    "lawchaos",
+    "thumbImageUri",
+)
+
+
+class InvalidFieldsRequest(ValueError):
+    pass
+
+
+def parseFields(text):
+    # the fields a listing should contain, in FIELDS order, or None for whole
+    # mysfits.
+    if not text or text == "summary":
+        return SUMMARY_FIELDS
+    if text == "all":
+        return None
+    names = {name.strip() for name in text.split(",") if name.strip()}
+    unknown = names.difference(FIELDS)
+    if unknown:
+        raise InvalidFieldsRequest(
+            "Unknown fields: {}".format(", ".join(sorted(unknown)))
+        )
+    names.add("mysfitId")
+    fields = tuple(field for field in FIELDS if field in names)
+    return None if fields == FIELDS else fields
+
+
+def project(mysfit, fields):
+    if fields is None:
+        return mysfit
+    return {field: mysfit[field] for field in fields if field in mysfit}
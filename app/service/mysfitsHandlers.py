@@ -0,0 +1,415 @@
+import hmac
+import logging
+import os
+
+import mysfitsAccessLog
+import mysfitsAdmission
+import mysfitsFields
+import mysfitsJson
+import mysfitsLikeBuffer
+import mysfitsMetrics
+import mysfitsPaging
+import mysfitsProfiler
+import mysfitsSnapshot
+import mysfitsTableClient
+
+# The request handling for every route of the Mythical Mysfits service,
+# independent of the web framework serving it. The Flask app in
+# mythicalMysfitsService.py and the ASGI app in mythicalMysfitsAsgi.py both
+# turn a request into a call to one of these handlers and send back the
+# ServiceResponse it returns.
+#
+# Handlers receive the query string arguments and request headers as mappings
+# with a get() method. Header names are always looked up in lower case.
+
+
+# MYSFITS_LOG_LEVEL=INFO logs how each DynamoDB listing was read and the
+# capacity it consumed (see mysfitsTableClient.planListing), and every
+# snapshot reload. Only warnings and errors are logged by default. Logging is
+# set up by whatever runs the service (the apps' __main__ blocks and
+# gunicorn.conf.py), not on import.
+def configureLogging():
+    logging.basicConfig(level=os.environ.get("MYSFITS_LOG_LEVEL", "WARNING").upper())
+
+
+class ServiceResponse(object):
+    # body is either bytes or, for a streamed response, an iterator of bytes.
+    def __init__(self, status, body=b"", headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers if headers is not None else []
+
+
+# Likes are buffered in memory and written to MysfitsTable in batches (see
+# mysfitsLikeBuffer). MYSFITS_LIKE_FLUSH_SECONDS bounds how stale the stored
+# counters may get; setting it to 0 writes every like straight through.
+LIKE_FLUSH_SECONDS = float(os.environ.get("MYSFITS_LIKE_FLUSH_SECONDS", "2"))
+
+likeBuffer = mysfitsLikeBuffer.LikeBuffer(
+    mysfitsTableClient.likeMysfit, flushInterval=LIKE_FLUSH_SECONDS
+)
+
+
+# Access logs are written by a background thread (see mysfitsAccessLog).
+# MYSFITS_ACCESS_LOG_SAMPLE sets the fraction of each route's requests that
+# are logged, as route=rate pairs with * for every other route; health checks
+# and metrics scrapes are not logged by default. MYSFITS_ACCESS_LOG=off turns
+# access logging off.
+accessLog = None
+if os.environ.get("MYSFITS_ACCESS_LOG", "on") != "off":
+    accessLog = mysfitsAccessLog.AccessLog(
+        mysfitsAccessLog.writeStdout,
+        mysfitsAccessLog.parseSampleRates(
+            os.environ.get("MYSFITS_ACCESS_LOG_SAMPLE", "/=0,/metrics=0")
+        ),
+        flushInterval=float(os.environ.get("MYSFITS_ACCESS_LOG_FLUSH_SECONDS", "1")),
+        maxBuffered=int(os.environ.get("MYSFITS_ACCESS_LOG_MAX_BUFFERED", "10000")),
+    )
+    mysfitsMetrics.registerCounter(
+        "mysfits_access_log_dropped_total",
+        "Access log entries dropped because the buffer was full.",
+        lambda: accessLog.dropped,
+    )
+
+
+def flushBuffers():
+    # write any buffered likes and access log entries now; called as the
+    # server shuts down.
+    likeBuffer.stop()
+    if accessLog is not None:
+        accessLog.stop()
+
+
+mysfitsMetrics.registerGauge(
+    "mysfits_like_pending_increments",
+    "Likes accepted but not yet written to MysfitsTable.",
+    lambda: likeBuffer.pendingIncrements,
+)
+
+# At most MYSFITS_MAX_IN_FLIGHT requests are served at once by each worker,
+# fewer while the backend is slow, and a request waits at most
+# MYSFITS_MAX_QUEUE_MS for its turn before it is turned away (see
+# mysfitsAdmission). MYSFITS_ADMISSION=off admits everything.
+admission = mysfitsAdmission.AdmissionController(
+    initialLimit=int(os.environ.get("MYSFITS_INITIAL_IN_FLIGHT", "20")),
+    minLimit=int(os.environ.get("MYSFITS_MIN_IN_FLIGHT", "2")),
+    maxLimit=int(os.environ.get("MYSFITS_MAX_IN_FLIGHT", "200")),
+    maxQueueTime=float(os.environ.get("MYSFITS_MAX_QUEUE_MS", "50")) / 1000,
+    enabled=os.environ.get("MYSFITS_ADMISSION", "on") != "off",
+)
+
+# how long a client turned away should wait before trying again.
+RETRY_AFTER_SECONDS = os.environ.get("MYSFITS_RETRY_AFTER_SECONDS", "1")
+
+mysfitsMetrics.registerGauge(
+    "mysfits_admission_limit",
+    "Requests this worker currently admits at once.",
+    lambda: int(admission.limit),
+)
+mysfitsMetrics.registerGauge(
+    "mysfits_admission_queued",
+    "Requests waiting to be admitted.",
+    lambda: admission.queued,
+)
+mysfitsMetrics.registerCounter(
+    "mysfits_admission_shed_total",
+    "Requests turned away with a 503 because the worker was at its limit.",
+    lambda: admission.shed,
+)
+mysfitsMetrics.registerCounter(
+    "mysfits_dynamodb_listing_capacity_units_total",
+    "Read capacity consumed by the Scans and Queries behind listings.",
+    lambda: mysfitsTableClient.consumedReadCapacity,
+)
+mysfitsMetrics.registerCache("dynamodb", lambda: mysfitsTableClient.cache)
+mysfitsMetrics.registerCache(
+    "like_shard_counts", lambda: mysfitsTableClient.shardCountCache
+)
+
+
+def createSource():
+    # By default the mysfits catalog is loaded into memory once, when the
+    # service starts, and a background watcher reloads it whenever the JSON
+    # file on disk is replaced. Setting MYSFITS_DATA_SOURCE=dynamodb serves it
+    # from MysfitsTable instead, through a short-lived in-process cache.
+    if os.environ.get("MYSFITS_DATA_SOURCE", "snapshot") == "dynamodb":
+        return mysfitsTableClient.TableSource()
+    source = mysfitsSnapshot.SnapshotStore(
+        os.environ.get("MYSFITS_SNAPSHOT_PATH", mysfitsSnapshot.DEFAULT_SNAPSHOT_PATH),
+        pollInterval=float(os.environ.get("MYSFITS_SNAPSHOT_POLL_SECONDS", "2")),
+    )
+    source.startWatcher()
+    mysfitsMetrics.registerCache("snapshot_pages", lambda: source.current().pages)
+    return source
+
+
+def jsonResponse(status, document):
+    return ServiceResponse(
+        status,
+        mysfitsJson.dumps(document),
+        [("Content-Type", "application/json")],
+    )
+
+
+def errorResponse(status, message):
+    return jsonResponse(status, {"message": message})
+
+
+def encodedBodyResponse(encodedBody, headers):
+    # builds the response for a pre-serialized JSON body, choosing the
+    # compressed variant that best matches the client's Accept-Encoding header.
+    coding, body, etag = encodedBody.select(headers.get("accept-encoding"))
+
+    # set the Content-Type header so that the browser is aware that the response
+    # is formatted as JSON and our frontend JavaScript code is able to
+    # appropriately parse the response. The body differs by Accept-Encoding, so
+    # caches between us and the browser must key on it as well.
+    responseHeaders = [
+        ("Content-Type", "application/json"),
+        ("ETag", etag),
+        ("Vary", "Accept-Encoding"),
+    ]
+
+    # a client that already holds the current version of the body only needs
+    # to be told that it is still valid.
+    if mysfitsSnapshot.etagMatches(headers.get("if-none-match"), etag):
+        return ServiceResponse(304, b"", responseHeaders)
+
+    if coding is not None:
+        responseHeaders.append(("Content-Encoding", coding))
+    return ServiceResponse(200, body, responseHeaders)
+
+
+# The response to a request turned away by admission control.
+def overloadedResponse():
+    response = errorResponse(503, "Service is overloaded, try again shortly")
+    response.headers.append(("Retry-After", RETRY_AFTER_SECONDS))
+    return response
+
+
+# The service basepath has a short response just to ensure that healthchecks
+# sent to the service root will receive a healthy response.
+def healthCheck():
+    return jsonResponse(
+        200, {"message": "Nothing here, used for health check. Try /mysfits instead."}
+    )
+
+
+# Request counts, latencies, response sizes and cache statistics for this
+# process, in the Prometheus text format.
+def metrics():
+    return ServiceResponse(
+        200,
+        mysfitsMetrics.render(),
+        [("Content-Type", "text/plain; version=0.0.4; charset=utf-8")],
+    )
+
+
+# Profiles the worker that serves the request (see mysfitsProfiler), with
+# /admin/profile?mode=stacks&seconds=10&interval=0.005 or
+# /admin/profile?mode=requests&seconds=10&rate=0.1. The route is only served
+# when MYSFITS_ADMIN_TOKEN is set, to callers sending it as a bearer token,
+# and is not published through API Gateway. The pid of the profiled worker is
+# in the X-Mysfits-Pid header and the artifact's file name.
+ADMIN_TOKEN = os.environ.get("MYSFITS_ADMIN_TOKEN", "")
+MAX_PROFILE_SECONDS = 60.0
+
+
+def isAdmin(headers):
+    scheme, _, token = (headers.get("authorization") or "").partition(" ")
+    return (
+        bool(ADMIN_TOKEN)
+        and scheme.lower() == "bearer"
+        and hmac.compare_digest(token.strip().encode(), ADMIN_TOKEN.encode())
+    )
+
+
+def profile(args, headers):
+    if not ADMIN_TOKEN:
+        return errorResponse(404, "Not found")
+    if not isAdmin(headers):
+        response = errorResponse(401, "Unauthorized")
+        response.headers.append(("WWW-Authenticate", "Bearer"))
+        return response
+    mode = args.get("mode", "stacks")
+    try:
+        seconds = float(args.get("seconds", "10"))
+        interval = float(args.get("interval", "0.005"))
+        rate = float(args.get("rate", "0.1"))
+    except ValueError:
+        return errorResponse(400, "seconds, interval and rate must be numbers")
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        return errorResponse(
+            400,
+            "seconds must be more than 0 and at most {}".format(MAX_PROFILE_SECONDS),
+        )
+    try:
+        if mode == "stacks":
+            if interval < 0.001:
+                return errorResponse(400, "interval must be at least 0.001 seconds")
+            artifact = mysfitsProfiler.profiler.sampleStacks(seconds, interval)
+            contentType, extension = "text/plain; charset=utf-8", "collapsed"
+        elif mode == "requests":
+            if not 0 < rate <= 1:
+                return errorResponse(400, "rate must be more than 0 and at most 1")
+            artifact = mysfitsProfiler.profiler.profileRequests(seconds, rate)
+            contentType, extension = "application/octet-stream", "pstats"
+        else:
+            return errorResponse(400, "mode must be stacks or requests")
+    except mysfitsProfiler.ProfilerBusy:
+        return errorResponse(409, "A profile is already being taken")
+    pid = str(os.getpid())
+    return ServiceResponse(
+        200,
+        artifact,
+        [
+            ("Content-Type", contentType),
+            (
+                "Content-Disposition",
+                'attachment; filename="mysfits-{}.{}"'.format(pid, extension),
+            ),
+            ("X-Mysfits-Pid", pid),
+        ],
+    )
+
+
+# The website can ask for every mysfit, or only the mysfits matching one
+# alignment with /mysfits?filter=GoodEvil&value=Good or
+# /mysfits?filter=LawChaos&value=Lawful. Either listing can be read a page at
+# a time with limit and cursor, or streamed with stream=true (see
+# mysfitsPaging). Listings hold a summary of each mysfit unless the client
+# asks for other fields with fields= (see mysfitsFields).
+def getMysfits(source, args, headers):
+    filterName = args.get("filter")
+    value = args.get("value", "")
+    try:
+        fields = mysfitsFields.parseFields(args.get("fields"))
+    except mysfitsFields.InvalidFieldsRequest as error:
+        return errorResponse(400, str(error))
+
+    if args.get("limit") or args.get("cursor"):
+        try:
+            limit = mysfitsPaging.parseLimit(args.get("limit"))
+            encodedBody = source.page(
+                filterName, value, args.get("cursor"), limit, fields
+            )
+        except mysfitsPaging.InvalidPageRequest as error:
+            return errorResponse(400, str(error))
+        if encodedBody is None:
+            return errorResponse(400, "Unknown filter: {}".format(filterName))
+        return encodedBodyResponse(encodedBody, headers)
+
+    if args.get("stream", "").lower() in ("1", "true"):
+        chunks = source.stream(filterName, value, fields)
+        if chunks is None:
+            return errorResponse(400, "Unknown filter: {}".format(filterName))
+        return ServiceResponse(200, chunks, [("Content-Type", "application/json")])
+
+    if filterName:
+        encodedBody = source.filter(filterName, value, fields)
+        if encodedBody is None:
+            return errorResponse(400, "Unknown filter: {}".format(filterName))
+        return encodedBodyResponse(encodedBody, headers)
+
+    return encodedBodyResponse(source.listing(fields), headers)
+
+
+def isListingBuilt(source, args):
+    # whether a snapshot source can answer getMysfits with a body it already
+    # holds, or streams as it is sent, rather than having to serialize and
+    # compress one first. Requests getMysfits turns away count as built.
+    filterName = args.get("filter")
+    value = args.get("value", "")
+    try:
+        fields = mysfitsFields.parseFields(args.get("fields"))
+        if args.get("limit") or args.get("cursor"):
+            limit = mysfitsPaging.parseLimit(args.get("limit"))
+            return source.isPageBuilt(
+                filterName, value, args.get("cursor"), limit, fields
+            )
+    except ValueError:
+        return True
+    stream = args.get("stream", "").lower() in ("1", "true")
+    return source.isListingBuilt(filterName, value, fields, stream)
+
+
+# The most ids one /mysfits/batch request may ask for, and the largest request
+# body accepted, which is plenty for that many ids.
+MAX_BATCH_IDS = 1000
+MAX_BODY_SIZE = 64 * 1024
+
+
+def parseBatchIds(text):
+    # the ids of GET /mysfits/batch?ids=<id>,<id>,..., or None if there are
+    # none.
+    ids = [mysfitId.strip() for mysfitId in (text or "").split(",")]
+    return [mysfitId for mysfitId in ids if mysfitId] or None
+
+
+def parseBatchBody(body):
+    # the ids of a POST /mysfits/batch body, {"ids": [<id>, ...]}, or None if
+    # the body is not in that form.
+    try:
+        document = mysfitsJson.loads(body)
+    except ValueError:
+        return None
+    ids = document.get("ids") if isinstance(document, dict) else None
+    if not isinstance(ids, list) or not ids:
+        return None
+    if not all(isinstance(mysfitId, str) and mysfitId for mysfitId in ids):
+        return None
+    return ids
+
+
+# Several mysfits by id in one request, for views such as a list of favorites
+# that would otherwise fetch each mysfit with its own request, as
+# GET /mysfits/batch?ids=<id>,<id> or POST /mysfits/batch with a JSON body of
+# {"ids": [...]}. Each mysfit is whole, as /mysfits/<id> returns it. The
+# mysfits come back in the order they were asked for, each id once, and any
+# ids that do not exist are listed in unknownIds.
+def getMysfitsBatch(source, mysfitIds, headers):
+    if mysfitIds is None:
+        return errorResponse(400, "Expected a list of mysfit ids")
+    mysfitIds = list(dict.fromkeys(mysfitIds))
+    if len(mysfitIds) > MAX_BATCH_IDS:
+        return errorResponse(
+            400, "At most {} mysfits can be read at once".format(MAX_BATCH_IDS)
+        )
+    bodies = source.mysfitBodies(mysfitIds)
+    unknownIds = [mysfitId for mysfitId, body in zip(mysfitIds, bodies) if body is None]
+    body = (
+        b'{"mysfits":['
+        + b",".join(body for body in bodies if body is not None)
+        + b'],"unknownIds":'
+        + mysfitsJson.dumps(unknownIds)
+        + b"}"
+    )
+    return encodedBodyResponse(mysfitsSnapshot.encodeOnRequestPath(body), headers)
+
+
+def getMysfit(source, mysfitId, headers):
+    encodedBody = source.mysfit(mysfitId)
+    if encodedBody is None:
+        return errorResponse(404, "Unknown mysfit: {}".format(mysfitId))
+    return encodedBodyResponse(encodedBody, headers)
+
+
+# Likes and adoptions are always written to MysfitsTable, whichever source the
+# listings are read from. Both routes sit behind the Cognito authorizer in API
+# Gateway (see api-swagger.json).
+def likeMysfit(mysfitId):
+    if not LIKE_FLUSH_SECONDS:
+        if not mysfitsTableClient.likeMysfit(mysfitId):
+            return errorResponse(404, "Unknown mysfit: {}".format(mysfitId))
+        return jsonResponse(200, {"Update": "Success"})
+
+    # a buffered like is only checked against the table when it is flushed,
+    # so likes for an unknown mysfit are accepted here and dropped later.
+    likeBuffer.add(mysfitId)
+    return jsonResponse(200, {"Update": "Success"})
+
+
+def adoptMysfit(mysfitId):
+    if not mysfitsTableClient.adoptMysfit(mysfitId):
+        return errorResponse(404, "Unknown mysfit: {}".format(mysfitId))
+    return jsonResponse(200, {"Update": "Success"})
@@ -0,0 +1,31 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON encoding and decoding for the service. Once the mysfits are served from
+# DynamoDB, serializing them is most of the CPU a request costs, so the
+# service uses orjson, a native encoder, when it is installed and falls back to
+# the standard library otherwise.
+#
+# Both produce exactly the same bytes: compact separators and non-ASCII text
+# written as UTF-8 rather than escaped. A response body, and so its ETag, is
+# the same whichever encoder the worker that built it happened to have.
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def dumps(document):
+    if orjson is not None:
+        return orjson.dumps(document)
+    return _encoder.encode(document).encode("utf-8")
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,85 @@
+import atexit
+import logging
+import threading
+
+# Likes are counted in memory and written to MysfitsTable in batches rather
+# than with one UpdateItem per click. Every flushInterval seconds (or sooner,
+# once maxPending likes are waiting) the buffered counts are swapped out and
+# each mysfit gets a single atomic "ADD Likes :n" for all of its new likes.
+# A like is therefore visible in the table at most about flushInterval seconds
+# after it was made, and a mysfit that goes viral costs one write per flush
+# instead of one per click.
+
+
+class LikeBuffer(object):
+    def __init__(self, write, flushInterval=2.0, maxPending=10000):
+        # write(mysfitId, count) applies count likes to one mysfit, returning
+        # False if the mysfit does not exist and raising if the write failed.
+        self._write = write
+        self.flushInterval = flushInterval
+        self.maxPending = maxPending
+        self._counts = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._flushLock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    @property
+    def pendingIncrements(self):
+        # the number of likes accepted but not yet written to the table.
+        return self._pending
+
+    def add(self, mysfitId, count=1):
+        with self._lock:
+            if self._thread is None:
+                self._start()
+            self._counts[mysfitId] = self._counts.get(mysfitId, 0) + count
+            self._pending += count
+            full = self._pending >= self.maxPending
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        # write every buffered count to the table. Counts whose write fails are
+        # put back so the next flush retries them.
+        with self._flushLock:
+            with self._lock:
+                counts, self._counts = self._counts, {}
+            for mysfitId, count in counts.items():
+                try:
+                    if not self._write(mysfitId, count):
+                        logging.warning(
+                            "dropped %d likes for unknown mysfit %s", count, mysfitId
+                        )
+                except Exception:
+                    logging.exception(
+                        "could not write %d likes for %s", count, mysfitId
+                    )
+                    self.add(mysfitId, count)
+                finally:
+                    with self._lock:
+                        self._pending -= count
+
+    def stop(self):
+        # flush whatever is left. Called when the process shuts down.
+        self._stopped = True
+        self._wake.set()
+        self.flush()
+
+    def _start(self):
+        # started on the first like rather than at import time, so a
+        # preloading prefork master never owns a flusher thread that its
+        # workers would not inherit.
+        self._thread = threading.Thread(
+            target=self._run, name="mysfits-like-flusher", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flushInterval)
+            self._wake.clear()
+            self.flush()
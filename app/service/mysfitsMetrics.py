@@ -0,0 +1,205 @@
+import bisect
+import os
+import re
+import threading
+import time
+
+# Request and cache metrics for the service, exposed on /metrics in the
+# Prometheus text format. Everything is kept in plain in-process counters so
+# recording a request costs a couple of dict lookups and one short lock;
+# formatting only happens when /metrics is scraped.
+#
+# Each process keeps its own metrics. Under the prefork server every sample
+# carries the pid of the worker that answered the scrape, so series from
+# different workers stay apart and can be summed in queries.
+
+# Latency buckets in seconds. p50/p95/p99 come from histogram_quantile() over
+# mysfits_request_duration_seconds_bucket.
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+# Response size buckets in bytes.
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Request paths mapped to the route they were served by, so that per-route
+# series do not multiply with every mysfitId.
+ROUTE_PATTERNS = (
+    (re.compile(r"^/$"), "/"),
+    (re.compile(r"^/mysfits$"), "/mysfits"),
+    (re.compile(r"^/mysfits/batch$"), "/mysfits/batch"),
+    (re.compile(r"^/mysfits/[^/]+$"), "/mysfits/{mysfitId}"),
+    (re.compile(r"^/mysfits/[^/]+/like$"), "/mysfits/{mysfitId}/like"),
+    (re.compile(r"^/mysfits/[^/]+/adopt$"), "/mysfits/{mysfitId}/adopt"),
+    (re.compile(r"^/metrics$"), "/metrics"),
+    (re.compile(r"^/admin/profile$"), "/admin/profile"),
+)
+
+
+def routeLabel(path):
+    for pattern, route in ROUTE_PATTERNS:
+        if pattern.match(path):
+            return route
+    return "other"
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name, labels, lines):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(
+                '{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative)
+            )
+        cumulative += self.counts[-1]
+        lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, cumulative))
+        lines.append("{}_sum{{{}}} {}".format(name, labels, self.sum))
+        lines.append("{}_count{{{}}} {}".format(name, labels, cumulative))
+
+
+class RequestMetrics(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.sizes = {}
+        self.inFlight = {}
+
+    def begin(self, route):
+        # returns the token to hand back to end() when the request completes.
+        with self._lock:
+            self.inFlight[route] = self.inFlight.get(route, 0) + 1
+        return route, time.perf_counter()
+
+    def end(self, token, method, status, size=None):
+        # returns how long the request took, in seconds.
+        route, started = token
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.inFlight[route] -= 1
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            latency = self.latency.get(route)
+            if latency is None:
+                latency = self.latency[route] = Histogram(LATENCY_BUCKETS)
+            latency.observe(elapsed)
+            if size is not None:
+                sizes = self.sizes.get(route)
+                if sizes is None:
+                    sizes = self.sizes[route] = Histogram(SIZE_BUCKETS)
+                sizes.observe(size)
+        return elapsed
+
+
+requestMetrics = RequestMetrics()
+
+# name -> function returning the TtlCache to report, or None.
+_caches = {}
+
+# name -> (help text, function returning the current value).
+_gauges = {}
+
+# name -> (help text, function returning the current count).
+_counters = {}
+
+
+def registerCache(name, getCache):
+    _caches[name] = getCache
+
+
+def registerGauge(name, helpText, getValue):
+    _gauges[name] = (helpText, getValue)
+
+
+def registerCounter(name, helpText, getValue):
+    _counters[name] = (helpText, getValue)
+
+
+def render():
+    pid = 'pid="{}"'.format(os.getpid())
+    lines = []
+    with requestMetrics._lock:
+        lines.append("# HELP mysfits_requests_total Requests served, by route.")
+        lines.append("# TYPE mysfits_requests_total counter")
+        for (route, method, status), count in sorted(requestMetrics.requests.items()):
+            labels = '{},route="{}",method="{}",status="{}"'.format(
+                pid, route, method, status
+            )
+            lines.append("mysfits_requests_total{{{}}} {}".format(labels, count))
+        lines.append("# HELP mysfits_requests_in_flight Requests being served.")
+        lines.append("# TYPE mysfits_requests_in_flight gauge")
+        for route, count in sorted(requestMetrics.inFlight.items()):
+            lines.append(
+                'mysfits_requests_in_flight{{{},route="{}"}} {}'.format(
+                    pid, route, count
+                )
+            )
+        lines.append("# HELP mysfits_request_duration_seconds Request latency.")
+        lines.append("# TYPE mysfits_request_duration_seconds histogram")
+        for route, histogram in sorted(requestMetrics.latency.items()):
+            histogram.render(
+                "mysfits_request_duration_seconds",
+                '{},route="{}"'.format(pid, route),
+                lines,
+            )
+        lines.append("# HELP mysfits_response_size_bytes Response body size.")
+        lines.append("# TYPE mysfits_response_size_bytes histogram")
+        for route, histogram in sorted(requestMetrics.sizes.items()):
+            histogram.render(
+                "mysfits_response_size_bytes", '{},route="{}"'.format(pid, route), lines
+            )
+
+    for metric, attribute, helpText in (
+        ("mysfits_cache_hits_total", "hits", "Cache lookups answered."),
+        ("mysfits_cache_misses_total", "misses", "Cache lookups not answered."),
+        ("mysfits_cache_evictions_total", "evictions", "Entries evicted for space."),
+    ):
+        lines.append("# HELP {} {}".format(metric, helpText))
+        lines.append("# TYPE {} counter".format(metric))
+        for name, getCache in sorted(_caches.items()):
+            cache = getCache()
+            if cache is not None:
+                lines.append(
+                    '{}{{{},cache="{}"}} {}'.format(
+                        metric, pid, name, getattr(cache, attribute)
+                    )
+                )
+    lines.append("# HELP mysfits_cache_entries Entries held in a cache.")
+    lines.append("# TYPE mysfits_cache_entries gauge")
+    for name, getCache in sorted(_caches.items()):
+        cache = getCache()
+        if cache is not None:
+            lines.append(
+                'mysfits_cache_entries{{{},cache="{}"}} {}'.format(
+                    pid, name, len(cache)
+                )
+            )
+
+    for kind, metrics in (("gauge", _gauges), ("counter", _counters)):
+        for name, (helpText, getValue) in sorted(metrics.items()):
+            lines.append("# HELP {} {}".format(name, helpText))
+            lines.append("# TYPE {} {}".format(name, kind))
+            lines.append("{}{{{}}} {}".format(name, pid, getValue()))
+
+    return ("\n".join(lines) + "\n").encode("utf-8")
@@ -0,0 +1,83 @@
+import base64
+import json
+
+# Paginated and streamed /mysfits responses.
+#
+# A client asks for a page with /mysfits?limit=<n>, and for each following page
+# passes the nextCursor of the previous one back as &cursor=<cursor>. The last
+# page has no nextCursor. Cursors are opaque to the client: for the in-memory
+# snapshot they hold an offset into the listing, and for DynamoDB they hold the
+# LastEvaluatedKey of the Scan or Query that produced the page.
+#
+# /mysfits?stream=true instead sends the whole listing with chunked transfer
+# encoding, writing the mysfits out as they are read, so the service never has
+# to hold the full response in memory.
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# the number of mysfits written per chunk of a streamed response.
+STREAM_CHUNK_SIZE = 100
+
+
+class InvalidPageRequest(ValueError):
+    pass
+
+
+def parseLimit(text):
+    if not text:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(text)
+    except ValueError:
+        raise InvalidPageRequest("limit must be a number")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise InvalidPageRequest("limit must be between 1 and {}".format(MAX_PAGE_SIZE))
+    return limit
+
+
+def encodeCursor(position):
+    text = json.dumps(position, separators=(",", ":"), sort_keys=True)
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decodeCursor(cursor):
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except ValueError:
+        raise InvalidPageRequest("invalid cursor")
+
+
+def offsetFromCursor(cursor):
+    position = decodeCursor(cursor)
+    if position is None:
+        return 0
+    offset = position.get("offset") if isinstance(position, dict) else None
+    if not isinstance(offset, int) or offset < 0:
+        raise InvalidPageRequest("invalid cursor")
+    return offset
+
+
+def pageBody(itemBodies, nextCursor):
+    # join already serialized mysfits into the body of one page.
+    body = b'{"mysfits":[' + b",".join(itemBodies) + b"]"
+    if nextCursor is not None:
+        body += b',"nextCursor":' + json.dumps(nextCursor).encode("ascii")
+    return body + b"}"
+
+
+def streamBody(itemBodyChunks):
+    # wrap an iterator over lists of serialized mysfits in the listing
+    # document, yielding one piece of the body per list.
+    yield b'{"mysfits":['
+    first = True
+    for itemBodies in itemBodyChunks:
+        if not itemBodies:
+            continue
+        chunk = b",".join(itemBodies)
+        yield chunk if first else b"," + chunk
+        first = False
+    yield b"]}"
@@ -0,0 +1,131 @@
+import cProfile
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+# On-demand profiling of a running worker, served on /admin/profile (see
+# mysfitsHandlers.profile). Two kinds of profile can be taken:
+#
+#   stacks    every `interval` seconds for `seconds` seconds, the stack of
+#             every thread in the process is sampled. The result is in the
+#             collapsed-stack format flamegraph.pl and speedscope read, one
+#             "thread;outer;...;inner count" line per distinct stack. It is a
+#             wall-clock profile: threads waiting on DynamoDB show up waiting.
+#   requests  for `seconds` seconds, a `rate` fraction of requests are run
+#             under cProfile. The result is the same marshalled pstats data
+#             cProfile writes to a file, for pstats, snakeviz or flameprof.
+#
+# Nothing is hooked into the interpreter while no profile is being taken:
+# stacks are sampled by the thread serving the admin request, and requests
+# only check a float to see whether they should be profiled.
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _frameName(code):
+    return "{}:{}".format(os.path.basename(code.co_filename), code.co_name)
+
+
+class Profiler(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = False
+        self._requestRate = 0.0
+        self._profiles = []
+
+    def sampleStacks(self, seconds, interval=0.005):
+        # blocks the calling thread for `seconds`, returning collapsed stacks
+        # as bytes. The calling thread itself is left out of the samples.
+        self._begin()
+        try:
+            own = threading.get_ident()
+            stacks = Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                threadNames = {
+                    thread.ident: thread.name for thread in threading.enumerate()
+                }
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frameName(frame.f_code))
+                        frame = frame.f_back
+                    stack.append(threadNames.get(ident, "thread-{}".format(ident)))
+                    stacks[";".join(reversed(stack))] += 1
+                time.sleep(interval)
+        finally:
+            self._end()
+        lines = ["{} {}\n".format(stack, count) for stack, count in stacks.items()]
+        return "".join(sorted(lines)).encode("utf-8")
+
+    def profileRequests(self, seconds, rate):
+        # blocks the calling thread for `seconds` while `rate` of the requests
+        # served meanwhile are profiled, returning their combined pstats data.
+        self._begin()
+        try:
+            self._profiles = []
+            self._requestRate = rate
+            time.sleep(seconds)
+        finally:
+            with self._lock:
+                self._requestRate = 0.0
+                profiles, self._profiles = self._profiles, []
+            self._end()
+        if not profiles:
+            return marshal.dumps({})
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return marshal.dumps(stats.stats)
+
+    def startRequest(self):
+        # returns the running cProfile.Profile for a request chosen to be
+        # profiled, to hand to finishRequest once it is done, or None.
+        rate = self._requestRate
+        if not rate or random.random() >= rate:
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finishRequest(self, profile):
+        if profile is None:
+            return
+        profile.disable()
+        with self._lock:
+            if self._requestRate:
+                self._profiles.append(profile)
+
+    def call(self, function, *args):
+        # function(*args), profiled if it is chosen to be. For servers that
+        # run a request's work on some other thread than the one it arrived
+        # on, such as the ASGI app.
+        profile = self.startRequest()
+        if profile is None:
+            return function(*args)
+        try:
+            return function(*args)
+        finally:
+            self.finishRequest(profile)
+
+    def _begin(self):
+        with self._lock:
+            if self._running:
+                raise ProfilerBusy()
+            self._running = True
+
+    def _end(self):
+        with self._lock:
+            self._running = False
+
+
+profiler = Profiler()
@@ -0,0 +1,487 @@
+import gzip
+import hashlib
+import logging
+import os
+import threading
+
+import mysfitsCache
+import mysfitsFields
+import mysfitsJson
+import mysfitsPaging
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# The mysfits catalog is served from a static JSON file, or from the binary
+# form of it described in mysfitsBinarySnapshot. Rather than reading
+# that file from disk on every request, it is loaded once into an immutable
+# snapshot that holds the response body as pre-encoded bytes along with a
+# strong ETag computed from those bytes. Request handlers only ever read the
+# current snapshot, and a background watcher swaps in a new one whenever the
+# file on disk changes, so the catalog can be refreshed without a restart.
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "mysfits-response.json"
+)
+
+# Bodies smaller than this are not worth compressing; the framing overhead
+# eats most of the saving.
+MIN_COMPRESS_SIZE = 256
+
+# The filters accepted by /mysfits?filter=<name>&value=<value>, mapped to the
+# mysfit attribute they select on. These mirror the LawChaosIndex and
+# GoodEvilIndex global secondary indexes on MysfitsTable (see DynamoDbStack),
+# so filtering a snapshot gives the same answer as querying the table. Adding
+# an attribute here is all it takes to make it filterable.
+FILTER_ATTRIBUTES = {
+    "GoodEvil": "goodevil",
+    "LawChaos": "lawchaos",
+}
+
+# Bodies built when a snapshot is loaded are compressed at moderate settings.
+# Brotli's top quality makes a listing about a quarter smaller again, but
+# takes nearly a hundred times as long, which over a large catalog means
+# minutes of startup and of every reload. A binary snapshot carries its
+# listings compressed at high settings when it was built instead (see
+# tools.buildSnapshot).
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Bodies built on the request path, such as pages of a paginated listing, are
+# compressed with cheaper settings still.
+REQUEST_PATH_GZIP_LEVEL = 4
+REQUEST_PATH_BROTLI_QUALITY = 4
+
+# Content-codings in the order the service prefers them when a client accepts
+# more than one with the same weight.
+PREFERRED_ENCODINGS = ("br", "gzip")
+
+# The number of sets of fields, besides whole mysfits and the summary, that a
+# snapshot keeps serialized listings for.
+MAX_VIEWS = 16
+
+
+class EncodedBody(object):
+    # A response body together with its pre-compressed variants. The variants
+    # are built once, with the body, and kept with it, so serving the body
+    # again costs no compression work. Each variant carries its own strong
+    # ETag, since a strong validator has to change with the content coding.
+    # Bodies built on the request path, rather than at load time, ask for
+    # cheaper compression settings (see encodeOnRequestPath).
+    def __init__(self, body, gzipLevel=GZIP_LEVEL, brotliQuality=BROTLI_QUALITY):
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.body = body
+        self.etag = '"{}"'.format(digest)
+        self.variants = {}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.variants["gzip"] = (
+                gzip.compress(body, compresslevel=gzipLevel, mtime=0),
+                '"{}-gzip"'.format(digest),
+            )
+            if brotli is not None:
+                self.variants["br"] = (
+                    brotli.compress(body, mode=brotli.MODE_TEXT, quality=brotliQuality),
+                    '"{}-br"'.format(digest),
+                )
+
+    def select(self, acceptEncoding):
+        # returns (content coding or None, body bytes, etag) for the best
+        # variant the client is willing to accept.
+        coding = negotiateEncoding(acceptEncoding, self.variants)
+        if coding is None:
+            return None, self.body, self.etag
+        body, etag = self.variants[coding]
+        return coding, body, etag
+
+
+def encodeOnRequestPath(body):
+    return EncodedBody(
+        body,
+        gzipLevel=REQUEST_PATH_GZIP_LEVEL,
+        brotliQuality=REQUEST_PATH_BROTLI_QUALITY,
+    )
+
+
+def negotiateEncoding(acceptEncoding, available):
+    # pick the highest weighted coding from an Accept-Encoding header that we
+    # have a variant for, or None to send the identity body.
+    if not acceptEncoding or not available:
+        return None
+    weights = {}
+    for entry in acceptEncoding.split(","):
+        parts = entry.strip().split(";")
+        coding = parts[0].strip().lower()
+        weight = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+    best, bestWeight = None, 0.0
+    for coding in PREFERRED_ENCODINGS:
+        if coding not in available:
+            continue
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > bestWeight:
+            best, bestWeight = coding, weight
+    return best
+
+
+class SnapshotView(object):
+    # The listings of one snapshot with every mysfit cut down to the same set
+    # of fields (see mysfitsFields), each mysfit serialized on its own. The
+    # views of whole mysfits and of the summary serialize and compress their
+    # whole and filtered listings when the snapshot is loaded. A view of any
+    # other fields builds each listing the first time it is asked for, with
+    # the cheaper request-path compression, and keeps it.
+    def __init__(self, snapshot, fields, prebuild=False):
+        self.fields = fields
+        self._snapshot = snapshot
+        if fields is None:
+            self.itemBodies = snapshot.itemBodies
+        else:
+            self.itemBodies = [
+                serializeMysfit(mysfitsFields.project(mysfit, fields))
+                for mysfit in snapshot.mysfits
+            ]
+        self._encode = EncodedBody if prebuild else encodeOnRequestPath
+        # (filterName, value) -> EncodedBody, with (None, None) for the whole
+        # listing. Two threads may build the same listing at once; both
+        # results are identical, so whichever is stored last is as good as
+        # the other.
+        self._listings = {}
+        if prebuild:
+            self.encodedListing(None, None)
+            for filterName, buckets in snapshot.filterMembers.items():
+                for value in buckets:
+                    self.encodedListing(filterName, value)
+
+    @property
+    def listing(self):
+        return self.encodedListing(None, None)
+
+    def encodedListing(self, filterName, value):
+        # the listing of every mysfit in the snapshot, or in one bucket of a
+        # filter, which must be a known filter and value.
+        encodedBody = self._listings.get((filterName, value))
+        if encodedBody is None:
+            positions = self._snapshot.members(filterName, value)
+            encodedBody = self._encode(self.joinItems(positions, None))
+            self._listings[(filterName, value)] = encodedBody
+        return encodedBody
+
+    def isBuilt(self, filterName, value):
+        return (filterName, value) in self._listings
+
+    def joinItems(self, positions, nextCursor):
+        return mysfitsPaging.pageBody(
+            [self.itemBodies[position] for position in positions], nextCursor
+        )
+
+
+class MysfitsSnapshot(object):
+    # A single, immutable version of the mysfits catalog. Nothing on a
+    # snapshot is modified after it has been constructed, which is what makes
+    # it safe to share between request threads without any locking. (Its page
+    # and view caches are the one exception; they are thread safe in their own
+    # right.)
+    def __init__(self, body, version=None):
+        # parse the body up front so that a malformed file is rejected before
+        # it can ever replace a good snapshot.
+        self.mysfits = mysfitsJson.loads(body)["mysfits"]
+        self.version = version
+        self.itemBodies = [serializeMysfit(mysfit) for mysfit in self.mysfits]
+        self.positions = {
+            mysfit["mysfitId"]: position for position, mysfit in enumerate(self.mysfits)
+        }
+        # the encoded body of each single mysfit, with its own ETag, built the
+        # first time that mysfit is requested.
+        self.itemEncoded = {}
+        self.emptyListing = EncodedBody(serializeMysfits([]))
+        self.filterMembers = buildFilterIndex(self.mysfits)
+        # the listings of whole mysfits and of the summary every listing
+        # returns by default are built with the snapshot. Whole mysfits are
+        # listed as they are serialized rather than as the file has them, so
+        # the listing, and its ETag, are the same byte for byte as those of a
+        # binary snapshot of the same catalog. Any other set of fields is
+        # built when first requested and kept, up to a limit, for as long as
+        # this version of the catalog is being served.
+        self.full = SnapshotView(self, None, prebuild=True)
+        self.summary = SnapshotView(self, mysfitsFields.SUMMARY_FIELDS, prebuild=True)
+        self.views = mysfitsCache.TtlCache(maxSize=MAX_VIEWS, ttl=float("inf"))
+        self.listing = self.full.listing
+        # pages are built when first requested, then kept the same way.
+        self.pages = mysfitsCache.TtlCache(maxSize=1024, ttl=float("inf"))
+
+    def view(self, fields):
+        if fields is None:
+            return self.full
+        if fields == mysfitsFields.SUMMARY_FIELDS:
+            return self.summary
+        return self.views.getOrLoad(fields, lambda: SnapshotView(self, fields))
+
+    def isListingBuilt(self, filterName, value, fields, stream=False):
+        # whether the listing, or for a stream the serialized mysfits it is
+        # made of, is already built.
+        if filterName and value not in self.filterMembers.get(filterName, ()):
+            # an unknown filter or value is answered without building anything.
+            return True
+        if fields is None or fields == mysfitsFields.SUMMARY_FIELDS:
+            view = self.view(fields)
+        else:
+            view = self.views.peek(fields)
+        if view is None:
+            return False
+        if stream:
+            return True
+        if filterName:
+            return view.isBuilt(filterName, value)
+        return view.isBuilt(None, None)
+
+    def isPageBuilt(self, filterName, value, cursor, limit, fields):
+        return isSnapshotPageBuilt(self, filterName, value, cursor, limit, fields)
+
+    def filter(self, filterName, value, fields=None):
+        # returns the pre-serialized listing of every mysfit whose attribute
+        # equals value, or None if filterName is not a known filter.
+        buckets = self.filterMembers.get(filterName)
+        if buckets is None:
+            return None
+        if value not in buckets:
+            return self.emptyListing
+        return self.view(fields).encodedListing(filterName, value)
+
+    def mysfit(self, mysfitId):
+        # the encoded body of one mysfit, or None if there is no mysfit with
+        # that id. Two threads may build the same body at once; both results
+        # are identical, so whichever is stored last is as good as the other.
+        encodedBody = self.itemEncoded.get(mysfitId)
+        if encodedBody is None:
+            position = self.positions.get(mysfitId)
+            if position is None:
+                return None
+            encodedBody = encodeOnRequestPath(self.itemBodies[position])
+            self.itemEncoded[mysfitId] = encodedBody
+        return encodedBody
+
+    def members(self, filterName, value):
+        # the positions in self.mysfits of the mysfits a listing contains, or
+        # None if filterName is not a known filter.
+        if not filterName:
+            return range(len(self.mysfits))
+        buckets = self.filterMembers.get(filterName)
+        if buckets is None:
+            return None
+        return buckets.get(value, ())
+
+    def page(self, filterName, value, cursor, limit, fields=None):
+        return snapshotPage(self, filterName, value, cursor, limit, fields)
+
+
+def snapshotPage(snapshot, filterName, value, cursor, limit, fields):
+    # one page of a listing of a MysfitsSnapshot or a binary snapshot (see
+    # mysfitsBinarySnapshot), or None if filterName is not a known filter.
+    positions = snapshot.members(filterName, value)
+    if positions is None:
+        return None
+    offset = mysfitsPaging.offsetFromCursor(cursor)
+
+    def buildPage():
+        end = offset + limit
+        nextCursor = None
+        if end < len(positions):
+            nextCursor = mysfitsPaging.encodeCursor({"offset": end})
+        return encodeOnRequestPath(
+            snapshot.view(fields).joinItems(positions[offset:end], nextCursor)
+        )
+
+    return snapshot.pages.getOrLoad(
+        (filterName, value, offset, limit, fields), buildPage
+    )
+
+
+def isSnapshotPageBuilt(snapshot, filterName, value, cursor, limit, fields):
+    # whether snapshotPage would find the page already built. A page asked for
+    # with an invalid cursor is answered without building anything.
+    try:
+        offset = mysfitsPaging.offsetFromCursor(cursor)
+    except mysfitsPaging.InvalidPageRequest:
+        return True
+    return snapshot.pages.peek((filterName, value, offset, limit, fields)) is not None
+
+
+def serializeMysfits(mysfits):
+    return mysfitsJson.dumps({"mysfits": mysfits})
+
+
+def serializeMysfit(mysfit):
+    return mysfitsJson.dumps(mysfit)
+
+
+def buildFilterIndex(mysfits):
+    # an inverted index from filter name and attribute value to the positions
+    # of the matching mysfits. Like the GSIs it mirrors, each bucket is ordered
+    # by mysfitId, the indexes' sort key. The snapshot serializes and
+    # compresses every bucket of its default views up front, so answering a
+    # filtered request for them is a couple of dict lookups.
+    index = {}
+    for filterName, attribute in FILTER_ATTRIBUTES.items():
+        buckets = {}
+        for position, mysfit in enumerate(mysfits):
+            value = mysfit.get(attribute)
+            if value is not None:
+                buckets.setdefault(value, []).append(position)
+        for positions in buckets.values():
+            positions.sort(key=lambda position: mysfits[position]["mysfitId"])
+        index[filterName] = buckets
+    return index
+
+
+def loadSnapshot(path):
+    # a binary snapshot is mapped into memory rather than read (see
+    # mysfitsBinarySnapshot, which imports this module).
+    import mysfitsBinarySnapshot
+
+    if mysfitsBinarySnapshot.isBinarySnapshot(path):
+        return mysfitsBinarySnapshot.MappedSnapshot(path)
+    # read the whole file in one go, closing the handle straight away.
+    with open(path, "rb") as snapshotFile:
+        stat = os.fstat(snapshotFile.fileno())
+        body = snapshotFile.read()
+    return MysfitsSnapshot(body, version=(stat.st_mtime_ns, stat.st_size))
+
+
+def etagMatches(ifNoneMatch, etag):
+    # If-None-Match uses the weak comparison function (RFC 7232 section 3.2),
+    # so a W/ prefix on any of the listed tags is ignored.
+    if not ifNoneMatch:
+        return False
+    for candidate in ifNoneMatch.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class SnapshotStore(object):
+    # Holds the current snapshot and replaces it when the underlying file
+    # changes. Replacing the snapshot is a single reference assignment, so
+    # readers always see either the old version or the new one in full.
+
+    # answering a request never waits on I/O, so async servers can call the
+    # store directly from their event loop.
+    blocking = False
+
+    def __init__(self, path=DEFAULT_SNAPSHOT_PATH, pollInterval=2.0):
+        self.path = path
+        self.pollInterval = pollInterval
+        self._snapshot = loadSnapshot(path)
+        self._reloadLock = threading.Lock()
+        self._stopped = threading.Event()
+        self._watcher = None
+
+    def current(self):
+        return self._snapshot
+
+    def listing(self, fields=None):
+        return self._snapshot.view(fields).listing
+
+    def filter(self, filterName, value, fields=None):
+        return self._snapshot.filter(filterName, value, fields)
+
+    def page(self, filterName, value, cursor, limit, fields=None):
+        return self._snapshot.page(filterName, value, cursor, limit, fields)
+
+    # whether answering a listing, or a page of one, means no more than
+    # sending a body the current snapshot already holds, or one it streams
+    # as it is sent, rather than building one first.
+    def isListingBuilt(self, filterName, value, fields=None, stream=False):
+        return self._snapshot.isListingBuilt(filterName, value, fields, stream)
+
+    def isPageBuilt(self, filterName, value, cursor, limit, fields=None):
+        return self._snapshot.isPageBuilt(filterName, value, cursor, limit, fields)
+
+    def stream(self, filterName, value, fields=None):
+        # the listing as an iterator of body chunks, or None if filterName is
+        # not a known filter. Every chunk is made of the snapshot's
+        # pre-serialized mysfits, so streaming costs no extra memory.
+        snapshot = self._snapshot
+        positions = snapshot.members(filterName, value)
+        if positions is None:
+            return None
+        itemBodies = snapshot.view(fields).itemBodies
+        size = mysfitsPaging.STREAM_CHUNK_SIZE
+        return mysfitsPaging.streamBody(
+            [itemBodies[position] for position in positions[start : start + size]]
+            for start in range(0, len(positions), size)
+        )
+
+    def mysfit(self, mysfitId):
+        return self._snapshot.mysfit(mysfitId)
+
+    def mysfitBodies(self, mysfitIds):
+        # the serialized mysfit for each id, or None for unknown ids.
+        snapshot = self._snapshot
+        positions = [snapshot.positions.get(mysfitId) for mysfitId in mysfitIds]
+        return [
+            None if position is None else snapshot.itemBodies[position]
+            for position in positions
+        ]
+
+    def reload(self):
+        # re-read the file if its modification time or size has changed since
+        # the current snapshot was taken. Returns True if a new snapshot was
+        # swapped in.
+        with self._reloadLock:
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                logging.exception("mysfits snapshot %s is not readable", self.path)
+                return False
+            if (stat.st_mtime_ns, stat.st_size) == self._snapshot.version:
+                return False
+            try:
+                snapshot = loadSnapshot(self.path)
+            except (OSError, ValueError, KeyError):
+                # keep serving the previous version rather than an error.
+                logging.exception("could not reload mysfits snapshot %s", self.path)
+                return False
+            self._snapshot = snapshot
+            logging.info(
+                "loaded mysfits snapshot %s (%s)", self.path, snapshot.listing.etag
+            )
+            return True
+
+    def startWatcher(self):
+        # poll the file from a daemon thread. Polling a single stat() every
+        # couple of seconds is far cheaper than the per-request read it
+        # replaces, and works on every filesystem the container may mount.
+        if self._watcher is not None or not self.pollInterval:
+            return
+        self._watcher = threading.Thread(
+            target=self._watch, name="mysfits-snapshot-watcher", daemon=True
+        )
+        self._watcher.start()
+
+    def restartWatcherAfterFork(self):
+        # a forked child inherits the watcher's Thread object but not the
+        # thread itself, nor a usable lock if the watcher held it mid-reload.
+        self._reloadLock = threading.Lock()
+        self._watcher = None
+        self.startWatcher()
+
+    def stopWatcher(self):
+        self._stopped.set()
+
+    def _watch(self):
+        while not self._stopped.wait(self.pollInterval):
+            self.reload()
@@ -0,0 +1,713 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import mysfitsCache
+import mysfitsJson
+import mysfitsPaging
+import mysfitsSnapshot
+
+# The data layer for mysfits stored in the MysfitsTable DynamoDB table created
+# by DynamoDbStack. The boto3 library will automatically use the credentials
+# associated with our ECS task role to communicate with DynamoDB, so no
+# credentials need to be stored/managed at all by our code!
+#
+# Reads go through a short-lived in-process cache so that a page load does not
+# cost a DynamoDB round trip, and writes (likes and adoptions) invalidate the
+# cache entries they affect.
+
+TABLE_NAME = os.environ.get("MYSFITS_TABLE_NAME", "MysfitsTable")
+
+# Like counters of popular mysfits can be split over several shard items in
+# this table, each keyed "<MysfitId>#<shard>" so that every shard lands on its
+# own partition. A mysfit's LikeShards attribute says how many shards it has
+# (one, meaning just the Likes attribute on the mysfit item, if absent). Its
+# total likes are the Likes on its own item plus the Likes on every shard.
+# tools/shardLikeCounters.py moves a mysfit onto shards.
+LIKES_TABLE_NAME = os.environ.get("MYSFITS_LIKES_TABLE_NAME", "MysfitsLikesTable")
+
+# Points the client at a DynamoDB stand-in, such as DynamoDB Local, for local
+# development and benchmarks. Unset in production.
+ENDPOINT_URL = os.environ.get("MYSFITS_DYNAMODB_ENDPOINT_URL") or None
+
+# The number of HTTPS connections to DynamoDB kept open by the shared client.
+# It should be at least the number of threads that can call DynamoDB at once,
+# otherwise requests queue for a free connection.
+MAX_POOL_CONNECTIONS = int(
+    os.environ.get("MYSFITS_DYNAMODB_MAX_POOL_CONNECTIONS", "50")
+)
+
+# Each response field of a mysfit, the table attribute it is stored in, and
+# that attribute's DynamoDB type.
+ATTRIBUTES = (
+    ("mysfitId", "MysfitId", "S"),
+    ("name", "Name", "S"),
+    ("species", "Species", "S"),
+    ("age", "Age", "N"),
+    ("description", "Description", "S"),
+    ("goodevil", "GoodEvil", "S"),
+    ("lawchaos", "LawChaos", "S"),
+    ("thumbImageUri", "ThumbImageUri", "S"),
+    ("profileImageUri", "ProfileImageUri", "S"),
+    ("likes", "Likes", "N"),
+    ("adopted", "Adopted", "BOOL"),
+)
+
+cache = mysfitsCache.TtlCache(
+    maxSize=int(os.environ.get("MYSFITS_CACHE_MAX_ENTRIES", "1024")),
+    ttl=float(os.environ.get("MYSFITS_CACHE_TTL_SECONDS", "5")),
+)
+
+# How long an id that is not in the table is remembered as missing.
+NEGATIVE_CACHE_TTL = float(os.environ.get("MYSFITS_NEGATIVE_CACHE_TTL_SECONDS", "10"))
+NOT_FOUND = object()
+
+# Shard counts only ever change when an operator runs the migration tool, so
+# they can be cached much longer than the mysfits themselves.
+shardCountCache = mysfitsCache.TtlCache(maxSize=4096, ttl=60.0)
+
+# BatchGetItem accepts at most this many keys per call.
+BATCH_GET_LIMIT = 100
+
+# A listing of every mysfit is read with a parallel Scan (see planListing),
+# in one segment for every SCAN_SEGMENT_BYTES of table data and at most
+# MYSFITS_MAX_SCAN_SEGMENTS, each read by its own thread. A Scan returns at
+# most 1 MB per call, so the listing takes about size / segments / 1 MB
+# round trips rather than size / 1 MB.
+MAX_SCAN_SEGMENTS = int(os.environ.get("MYSFITS_MAX_SCAN_SEGMENTS", "8"))
+SCAN_SEGMENT_BYTES = int(os.environ.get("MYSFITS_SCAN_SEGMENT_BYTES", str(1024 * 1024)))
+TABLE_SIZE_TTL = 300.0
+
+# The read capacity consumed by listings since the process started.
+consumedReadCapacity = 0.0
+_capacityLock = threading.Lock()
+
+_client = None
+_clientLock = threading.Lock()
+_scanExecutor = None
+_tableSize = (0.0, 0)
+
+
+def getClient():
+    # one DynamoDB client is shared by every thread in the process. boto3
+    # clients are thread safe, and sharing one means sharing its pool of
+    # keep-alive HTTPS connections instead of opening a new one per request.
+    #
+    # boto3 is imported here, on first use, rather than with this module: it
+    # is the slowest import in the service by far, and a service serving the
+    # snapshot does not need it until the first like or adoption.
+    global _client
+    if _client is None:
+        with _clientLock:
+            if _client is None:
+                import boto3
+                from botocore.config import Config
+
+                _client = boto3.client(
+                    "dynamodb",
+                    endpoint_url=ENDPOINT_URL,
+                    config=Config(
+                        max_pool_connections=MAX_POOL_CONNECTIONS,
+                        tcp_keepalive=True,
+                        retries={"max_attempts": 3, "mode": "standard"},
+                    ),
+                )
+    return _client
+
+
+def resetAfterFork():
+    # a client created before fork would share its open connections with the
+    # parent process, so a forked worker starts over with a client of its own,
+    # and with a scan thread pool of its own, as threads do not survive fork.
+    global _client, _clientLock, _scanExecutor
+    _client = None
+    _clientLock = threading.Lock()
+    _scanExecutor = None
+
+
+def itemToMysfit(item):
+    # convert a DynamoDB item into the JSON structure expected by the frontend.
+    mysfit = {}
+    for field, attribute, attributeType in ATTRIBUTES:
+        value = item.get(attribute)
+        if value is None:
+            continue
+        value = value[attributeType]
+        if attributeType == "N":
+            value = int(value)
+        mysfit[field] = value
+    return mysfit
+
+
+def mysfitToItem(mysfit):
+    # the DynamoDB item for a mysfit, the reverse of itemToMysfit.
+    item = {}
+    for field, attribute, attributeType in ATTRIBUTES:
+        value = mysfit.get(field)
+        if value is None:
+            continue
+        if attributeType == "N":
+            value = str(value)
+        item[attribute] = {attributeType: value}
+    return item
+
+
+def itemsToMysfits(items):
+    # convert a page of DynamoDB items, adding the likes held on shard items
+    # to the mysfits whose counters are sharded.
+    mysfits = [itemToMysfit(item) for item in items]
+    shardLikes = shardedLikesOf(items)
+    if shardLikes:
+        for mysfit in mysfits:
+            extraLikes = shardLikes.get(mysfit["mysfitId"])
+            if extraLikes is not None:
+                mysfit["likes"] = mysfit.get("likes", 0) + extraLikes
+    return mysfits
+
+
+def itemsToJson(items):
+    # the JSON bytes of each mysfit in a page of DynamoDB items, likes held on
+    # shard items included. With orjson, converting each item to a dict and
+    # encoding that is faster than any encoder written in Python could be
+    # (see benchmark/serializers.py).
+    return [mysfitsJson.dumps(mysfit) for mysfit in itemsToMysfits(items)]
+
+
+def shardedLikesOf(items):
+    # the likes held on shard items for each of items whose counter is
+    # sharded, by mysfitId.
+    sharded = {}
+    for item in items:
+        shards = likeShardCount(item)
+        if shards > 1:
+            sharded[item["MysfitId"]["S"]] = shards
+    return getShardedLikes(sharded) if sharded else {}
+
+
+def likeShardCount(item):
+    return int(item.get("LikeShards", {"N": "1"})["N"])
+
+
+def shardId(mysfitId, shard):
+    return "{}#{}".format(mysfitId, shard)
+
+
+def getShardedLikes(shardCounts):
+    # sum the shard items of each mysfit in shardCounts, a dict of mysfitId to
+    # its number of shards. Sums are cached like any other read.
+    totals = {}
+    missing = {}
+    for mysfitId, shards in shardCounts.items():
+        total = cache.get(("likes", mysfitId))
+        if total is None:
+            missing[mysfitId] = shards
+        else:
+            totals[mysfitId] = total
+    if missing:
+        loaded = dict.fromkeys(missing, 0)
+        keys = [
+            {"ShardId": {"S": shardId(mysfitId, shard)}}
+            for mysfitId, shards in missing.items()
+            for shard in range(shards)
+        ]
+        for item in batchGetItems(LIKES_TABLE_NAME, keys, "ShardId, Likes"):
+            mysfitId = item["ShardId"]["S"].rpartition("#")[0]
+            loaded[mysfitId] += int(item.get("Likes", {"N": "0"})["N"])
+        for mysfitId, total in loaded.items():
+            cache.put(("likes", mysfitId), total)
+        totals.update(loaded)
+    return totals
+
+
+def batchGetItems(tableName, keys, projection=None, maxAttempts=6):
+    # fetch every key from tableName with BatchGetItem, BATCH_GET_LIMIT keys per
+    # call. Keys DynamoDB leaves unprocessed (usually because of throttling)
+    # are retried with exponential backoff and full jitter.
+    items = []
+    for start in range(0, len(keys), BATCH_GET_LIMIT):
+        request = {"Keys": keys[start : start + BATCH_GET_LIMIT]}
+        if projection is not None:
+            request["ProjectionExpression"] = projection
+        requestItems = {tableName: request}
+        for attempt in range(maxAttempts):
+            response = getClient().batch_get_item(RequestItems=requestItems)
+            items.extend(response["Responses"].get(tableName, []))
+            requestItems = response.get("UnprocessedKeys") or {}
+            if not requestItems:
+                break
+            time.sleep(random.uniform(0, 0.05 * 2**attempt))
+        else:
+            raise RuntimeError(
+                "BatchGetItem left keys unprocessed after {} attempts".format(
+                    maxAttempts
+                )
+            )
+    return items
+
+
+def projectionExpression(fields):
+    # the ProjectionExpression, and its attribute names, that reads only the
+    # attributes behind the given response fields (see mysfitsFields). Every
+    # name goes through a placeholder, since Name is a reserved word.
+    attributes = [attribute for field, attribute, _ in ATTRIBUTES if field in fields]
+    if "likes" in fields:
+        attributes.append("LikeShards")
+    names = {"#p{}".format(index): name for index, name in enumerate(attributes)}
+    return ", ".join(names), names
+
+
+_PROJECTIONS = {
+    "all": "all attributes",
+    "keys": "key attributes only",
+    "projected": "projected attributes",
+}
+
+
+class ListingPlan(object):
+    # How a listing is read from MysfitsTable: a "query" of one of its global
+    # secondary indexes or a "scan" of the table, split into `segments`
+    # segments read in parallel, and whether it reads "all" attributes, only
+    # the "keys" of the index or table, or the "projected" attributes behind
+    # the requested fields.
+    def __init__(self, operation, request, segments=1, projection="all"):
+        self.operation = operation
+        self.request = request
+        self.segments = segments
+        self.projection = projection
+
+    def describe(self):
+        if self.operation == "query":
+            target = "query of {}".format(self.request["IndexName"])
+        else:
+            target = "scan in {} segment{}".format(
+                self.segments, "" if self.segments == 1 else "s"
+            )
+        return "{} reading {}".format(target, _PROJECTIONS[self.projection])
+
+
+def planListing(filterName=None, value=None, fields=None, paged=False):
+    # the cheapest way to read a listing. The mysfits with a given alignment
+    # are a Query of the global secondary index for that attribute
+    # (LawChaosIndex or GoodEvilIndex), which only reads the matching items,
+    # in MysfitId order. Every mysfit is a Scan of the table, split into
+    # segments read in parallel (see scanSegments) unless the listing is read
+    # a page at a time (paged), where the cursor has to follow a single Scan.
+    #
+    # When fields are given, only the attributes they need are read;
+    # DynamoDB charges the same read capacity either way, but returns, and
+    # boto3 parses, far less.
+    request = {"TableName": TABLE_NAME, "ReturnConsumedCapacity": "TOTAL"}
+    if not filterName:
+        operation, segments = "scan", 1 if paged else scanSegments()
+        keys = {"mysfitId"}
+    else:
+        operation, segments = "query", 1
+        keys = {"mysfitId", mysfitsSnapshot.FILTER_ATTRIBUTES[filterName]}
+        request.update(
+            IndexName=filterName + "Index",
+            KeyConditionExpression="#attribute = :value",
+            ExpressionAttributeNames={"#attribute": filterName},
+            ExpressionAttributeValues={":value": {"S": value}},
+        )
+    projection = "all"
+    if fields is not None:
+        expression, names = projectionExpression(fields)
+        request["ProjectionExpression"] = expression
+        request.setdefault("ExpressionAttributeNames", {}).update(names)
+        projection = "keys" if keys.issuperset(fields) else "projected"
+    return ListingPlan(operation, request, segments, projection)
+
+
+def scanSegments():
+    # one segment for every SCAN_SEGMENT_BYTES of data in the table, as last
+    # reported by DescribeTable, and at most MAX_SCAN_SEGMENTS. DynamoDB only
+    # refreshes the size it reports every few hours, so it is looked up again
+    # every TABLE_SIZE_TTL seconds at most.
+    global _tableSize
+    expires, size = _tableSize
+    if expires <= time.monotonic():
+        client = getClient()
+        try:
+            table = client.describe_table(TableName=TABLE_NAME)["Table"]
+            size = table.get("TableSizeBytes", 0)
+        except client.exceptions.ClientError:
+            # without the size, every segment is used; the ones that turn out
+            # to be empty only cost a round trip each.
+            logging.exception("could not describe %s", TABLE_NAME)
+            size = MAX_SCAN_SEGMENTS * SCAN_SEGMENT_BYTES
+        _tableSize = (time.monotonic() + TABLE_SIZE_TTL, size)
+    return max(1, min(MAX_SCAN_SEGMENTS, -(-size // SCAN_SEGMENT_BYTES)))
+
+
+def getScanExecutor():
+    global _scanExecutor
+    if _scanExecutor is None:
+        with _clientLock:
+            if _scanExecutor is None:
+                _scanExecutor = ThreadPoolExecutor(
+                    max_workers=MAX_SCAN_SEGMENTS,
+                    thread_name_prefix="mysfits-scan",
+                )
+    return _scanExecutor
+
+
+class _PlanCost(object):
+    # the calls made, items read and read capacity consumed while running a
+    # plan, logged once it is done.
+    def __init__(self, plan):
+        self.plan = plan
+        self.calls = 0
+        self.items = 0
+        self.capacityUnits = 0.0
+        self.started = time.monotonic()
+
+    def add(self, response):
+        self.calls += 1
+        self.items += response["Count"]
+        consumed = response.get("ConsumedCapacity") or {}
+        self.capacityUnits += consumed.get("CapacityUnits", 0.0)
+
+    def log(self):
+        global consumedReadCapacity
+        with _capacityLock:
+            consumedReadCapacity += self.capacityUnits
+        logging.info(
+            "listed %d mysfits with a %s: %d calls, %.1f read capacity units, "
+            "%.1f ms",
+            self.items,
+            self.plan.describe(),
+            self.calls,
+            self.capacityUnits,
+            (time.monotonic() - self.started) * 1000,
+        )
+
+
+def runPlan(plan, startKey=None, limit=None, ordered=True, withSegments=False):
+    # yield (items, LastEvaluatedKey) for each page DynamoDB returns,
+    # following LastEvaluatedKey until the listing is exhausted, or for just
+    # the first page when a limit is given.
+    #
+    # The segments of a parallel Scan are read at the same time, one page of
+    # each in flight at once, and their pages have no LastEvaluatedKey to
+    # resume from. They are yielded segment by segment when ordered, so that
+    # the same table always gives the same listing, or as they arrive. With
+    # withSegments, (segment, items) is yielded for each page instead.
+    cost = _PlanCost(plan)
+    try:
+        if plan.segments > 1:
+            for segment, items in _runSegments(plan, cost, ordered):
+                yield (segment, items) if withSegments else (items, None)
+            return
+        request = dict(plan.request)
+        if startKey is not None:
+            request["ExclusiveStartKey"] = startKey
+        if limit is not None:
+            request["Limit"] = limit
+        operation = getattr(getClient(), plan.operation)
+        while True:
+            response = operation(**request)
+            cost.add(response)
+            lastKey = response.get("LastEvaluatedKey")
+            if withSegments:
+                yield 0, response["Items"]
+            else:
+                yield response["Items"], lastKey
+            if lastKey is None or limit is not None:
+                return
+            request["ExclusiveStartKey"] = lastKey
+    finally:
+        cost.log()
+
+
+def _runSegments(plan, cost, ordered):
+    client = getClient()
+    executor = getScanExecutor()
+
+    def readPage(segment, startKey):
+        request = dict(plan.request, Segment=segment, TotalSegments=plan.segments)
+        if startKey is not None:
+            request["ExclusiveStartKey"] = startKey
+        return segment, client.scan(**request)
+
+    segmentPages = [[] for _ in range(plan.segments)]
+    pending = {
+        executor.submit(readPage, segment, None) for segment in range(plan.segments)
+    }
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                segment, response = future.result()
+                cost.add(response)
+                lastKey = response.get("LastEvaluatedKey")
+                if lastKey is not None:
+                    pending.add(executor.submit(readPage, segment, lastKey))
+                if ordered:
+                    segmentPages[segment].append(response["Items"])
+                else:
+                    yield segment, response["Items"]
+    finally:
+        # a listing abandoned part way through, such as a stream whose client
+        # went away, reads no further pages.
+        for future in pending:
+            future.cancel()
+    for segment, pages in enumerate(segmentPages):
+        for items in pages:
+            yield segment, items
+
+
+def iterItemPages(
+    filterName=None, value=None, startKey=None, limit=None, fields=None, ordered=True
+):
+    # the pages of a listing, read as planListing plans it (see runPlan).
+    plan = planListing(
+        filterName, value, fields, paged=startKey is not None or limit is not None
+    )
+    return runPlan(plan, startKey, limit, ordered)
+
+
+def iterMysfitPages(
+    filterName=None, value=None, startKey=None, limit=None, fields=None
+):
+    # as iterItemPages, with each page converted to mysfits.
+    for items, lastKey in iterItemPages(filterName, value, startKey, limit, fields):
+        yield itemsToMysfits(items), lastKey
+
+
+def iterJsonPages(
+    filterName=None, value=None, startKey=None, limit=None, fields=None, ordered=True
+):
+    # as iterItemPages, with each page serialized to the JSON of its mysfits.
+    pages = iterItemPages(filterName, value, startKey, limit, fields, ordered)
+    for items, lastKey in pages:
+        yield itemsToJson(items), lastKey
+
+
+def getAllMysfits(fields=None):
+    # retrieve all Mysfits from DynamoDB using a (parallel) scan.
+    return [
+        mysfit for mysfits, _ in iterMysfitPages(fields=fields) for mysfit in mysfits
+    ]
+
+
+def queryMysfits(filterName, value, fields=None):
+    return [
+        mysfit
+        for mysfits, _ in iterMysfitPages(filterName, value, fields=fields)
+        for mysfit in mysfits
+    ]
+
+
+def getItem(mysfitId):
+    response = getClient().get_item(
+        TableName=TABLE_NAME, Key={"MysfitId": {"S": mysfitId}}
+    )
+    return response.get("Item")
+
+
+def getMysfit(mysfitId):
+    item = getItem(mysfitId)
+    return itemsToMysfits([item])[0] if item is not None else None
+
+
+def getLikeShardCount(mysfitId):
+    # the number of like shards of a mysfit, or None if there is no mysfit
+    # with that id. Unknown ids are not cached, so a newly added mysfit can be
+    # liked straight away.
+    shards = shardCountCache.get(mysfitId)
+    if shards is None:
+        response = getClient().get_item(
+            TableName=TABLE_NAME,
+            Key={"MysfitId": {"S": mysfitId}},
+            ProjectionExpression="MysfitId, LikeShards",
+        )
+        item = response.get("Item")
+        if item is None:
+            return None
+        shards = likeShardCount(item)
+        shardCountCache.put(mysfitId, shards)
+    return shards
+
+
+def likeMysfit(mysfitId, count=1):
+    # add count likes to the like counter of a mysfit in one atomic update.
+    # Returns False if there is no mysfit with that id.
+    shards = getLikeShardCount(mysfitId)
+    if shards is None:
+        return False
+    if shards == 1:
+        return _updateMysfit(mysfitId, "ADD Likes :n", {":n": {"N": str(count)}})
+
+    # a sharded counter takes the likes on a random shard, spreading the
+    # writes for one mysfit evenly over its partitions.
+    try:
+        getClient().update_item(
+            TableName=LIKES_TABLE_NAME,
+            Key={"ShardId": {"S": shardId(mysfitId, random.randrange(shards))}},
+            UpdateExpression="ADD Likes :n",
+            ExpressionAttributeValues={":n": {"N": str(count)}},
+        )
+    finally:
+        invalidateMysfit(mysfitId)
+    return True
+
+
+def adoptMysfit(mysfitId):
+    # mark a mysfit as adopted. Returns False if there is no mysfit with that
+    # id.
+    return _updateMysfit(mysfitId, "SET Adopted = :b", {":b": {"BOOL": True}})
+
+
+def _updateMysfit(mysfitId, updateExpression, values):
+    client = getClient()
+    try:
+        client.update_item(
+            TableName=TABLE_NAME,
+            Key={"MysfitId": {"S": mysfitId}},
+            UpdateExpression=updateExpression,
+            ConditionExpression="attribute_exists(MysfitId)",
+            ExpressionAttributeValues=values,
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        return False
+    finally:
+        invalidateMysfit(mysfitId)
+    return True
+
+
+def invalidateMysfit(mysfitId):
+    # a write to one mysfit changes its own entries and every listing that
+    # could contain it.
+    cache.invalidateWhere(
+        lambda key: key[0] in ("list", "filter") or key[1:2] == (mysfitId,)
+    )
+
+
+class TableSource(object):
+    # Serves the /mysfits responses from DynamoDB, through the cache. It
+    # answers the same calls as mysfitsSnapshot.SnapshotStore, so the service
+    # can use either one as its source of mysfits.
+
+    # a cache miss makes a DynamoDB call, so async servers have to run these
+    # methods off their event loop.
+    blocking = True
+
+    def listing(self, fields=None):
+        return cache.getOrLoad(
+            ("list", fields), lambda: _encode(iterJsonPages(fields=fields))
+        )
+
+    def filter(self, filterName, value, fields=None):
+        if filterName not in mysfitsSnapshot.FILTER_ATTRIBUTES:
+            return None
+        # the index returns its items ordered by MysfitId, its sort key, which
+        # is the same order the snapshot uses for filtered listings.
+        return cache.getOrLoad(
+            ("filter", filterName, value, fields),
+            lambda: _encode(iterJsonPages(filterName, value, fields=fields)),
+        )
+
+    def page(self, filterName, value, cursor, limit, fields=None):
+        # one page of a listing, read with Limit and ExclusiveStartKey so that
+        # DynamoDB only returns the items the page needs.
+        if filterName and filterName not in mysfitsSnapshot.FILTER_ATTRIBUTES:
+            return None
+        startKey = decodeStartKey(cursor)
+
+        def loadPage():
+            pages = iterJsonPages(filterName, value, startKey, limit, fields)
+            itemBodies, lastKey = next(pages)
+            nextCursor = mysfitsPaging.encodeCursor(lastKey) if lastKey else None
+            return mysfitsSnapshot.encodeOnRequestPath(
+                mysfitsPaging.pageBody(itemBodies, nextCursor)
+            )
+
+        if filterName:
+            key = ("filter", filterName, value, cursor, limit, fields)
+        else:
+            key = ("list", cursor, limit, fields)
+        return cache.getOrLoad(key, loadPage)
+
+    def stream(self, filterName, value, fields=None):
+        # the listing as an iterator of body chunks, one per DynamoDB page, so
+        # only a page per Scan segment is ever held in memory.
+        if filterName and filterName not in mysfitsSnapshot.FILTER_ATTRIBUTES:
+            return None
+        return mysfitsPaging.streamBody(
+            itemBodies
+            for itemBodies, _ in iterJsonPages(
+                filterName, value, fields=fields, ordered=False
+            )
+        )
+
+    def mysfit(self, mysfitId):
+        # a cached GetItem. Ids that are not in the table are cached too, for
+        # a shorter time, so repeated requests for an unknown mysfit do not
+        # each cost a read.
+        key = ("mysfit", mysfitId)
+        encodedBody = cache.get(key)
+        if encodedBody is None:
+            item = getItem(mysfitId)
+            if item is None:
+                cache.put(key, NOT_FOUND, ttl=NEGATIVE_CACHE_TTL)
+                return None
+            encodedBody = mysfitsSnapshot.encodeOnRequestPath(itemsToJson([item])[0])
+            cache.put(key, encodedBody)
+        return None if encodedBody is NOT_FOUND else encodedBody
+
+    def mysfitBodies(self, mysfitIds):
+        # the serialized mysfit for each id, or None for ids that are not in
+        # the table. Ids the cache has answers for cost nothing; the rest are
+        # read together with BatchGetItem, and cached as mysfit() caches them.
+        bodies = {}
+        missing = []
+        for mysfitId in mysfitIds:
+            encodedBody = cache.get(("mysfit", mysfitId))
+            if encodedBody is None:
+                missing.append(mysfitId)
+            else:
+                bodies[mysfitId] = (
+                    None if encodedBody is NOT_FOUND else encodedBody.body
+                )
+        if missing:
+            items = batchGetItems(
+                TABLE_NAME, [{"MysfitId": {"S": mysfitId}} for mysfitId in missing]
+            )
+            for item, itemBody in zip(items, itemsToJson(items)):
+                mysfitId = item["MysfitId"]["S"]
+                bodies[mysfitId] = itemBody
+                cache.put(
+                    ("mysfit", mysfitId), mysfitsSnapshot.encodeOnRequestPath(itemBody)
+                )
+            for mysfitId in missing:
+                if mysfitId not in bodies:
+                    bodies[mysfitId] = None
+                    cache.put(("mysfit", mysfitId), NOT_FOUND, ttl=NEGATIVE_CACHE_TTL)
+        return [bodies[mysfitId] for mysfitId in mysfitIds]
+
+
+def decodeStartKey(cursor):
+    # a cursor holds the LastEvaluatedKey of the previous page. Only string
+    # key attributes are accepted, which is all MysfitsTable and its indexes
+    # use, so a forged cursor cannot smuggle anything else into a request.
+    startKey = mysfitsPaging.decodeCursor(cursor)
+    if startKey is None:
+        return None
+    if not isinstance(startKey, dict) or not all(
+        isinstance(value, dict) and list(value) == ["S"] and isinstance(value["S"], str)
+        for value in startKey.values()
+    ):
+        raise mysfitsPaging.InvalidPageRequest("invalid cursor")
+    return startKey
+
+
+def _encode(jsonPages):
+    return mysfitsSnapshot.encodeOnRequestPath(
+        mysfitsPaging.pageBody(
+            [itemBody for itemBodies, _ in jsonPages for itemBody in itemBodies],
+            None,
+        )
+    )
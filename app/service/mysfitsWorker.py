@@ -0,0 +1,47 @@
+import threading
+import time
+
+from gunicorn.workers.gthread import ThreadWorker
+
+import mysfitsAdmission
+
+# The gunicorn worker for the Flask service (see gunicorn.conf.py): gunicorn's
+# gthread worker, which also notes when each request was queued for one of its
+# threads.
+#
+# A gthread worker reads requests off its connections as they arrive and
+# queues them for its threads. When every thread is busy, a request can spend
+# longer in that queue than it would ever have been allowed to wait for
+# admission (see mysfitsAdmission), and by the time the service sees it the
+# wait so far is invisible. The time it was queued is therefore passed on in
+# the WSGI environ under mysfitsAdmission.ENQUEUED_AT, and admission counts
+# the wait against the request's queue budget.
+
+# the request each thread is handling, set before gunicorn creates its environ.
+_handling = threading.local()
+
+
+class QueueTimedWorker(ThreadWorker):
+    def enqueue_req(self, conn):
+        # a kept-alive connection is queued again for each request it sends.
+        conn.enqueuedAt = time.perf_counter()
+        super().enqueue_req(conn)
+
+    def handle(self, conn):
+        _handling.enqueuedAt = getattr(conn, "enqueuedAt", None)
+        try:
+            return super().handle(conn)
+        finally:
+            _handling.enqueuedAt = None
+
+    def load_wsgi(self):
+        super().load_wsgi()
+        app = self.wsgi
+
+        def timedApp(environ, startResponse):
+            environ[mysfitsAdmission.ENQUEUED_AT] = getattr(
+                _handling, "enqueuedAt", None
+            )
+            return app(environ, startResponse)
+
+        self.wsgi = timedApp
@@ -0,0 +1,282 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+import mysfitsAccessLog
+import mysfitsAdmission
+import mysfitsCache
+import mysfitsHandlers
+import mysfitsMetrics
+import mysfitsProfiler
+import mysfitsTableClient
+
+# An asynchronous version of the Mythical Mysfits service, for any ASGI server
+# (uvicorn is used when this file is run directly). It exposes the same routes
+# as the Flask app in mythicalMysfitsService.py, which remains available, and
+# shares all of its request handling through mysfitsHandlers.
+#
+# Requests that can be answered from bodies already in memory are served
+# directly on the event loop. Anything that may call DynamoDB, or has to
+# serialize and compress a body first, runs on a thread pool sized to the
+# shared boto3 client's connection pool, so a slow backend call or a large
+# listing only holds a pool thread while the event loop keeps accepting and
+# serving other requests.
+
+mysfitsSource = mysfitsHandlers.createSource()
+
+executor = ThreadPoolExecutor(
+    max_workers=mysfitsTableClient.MAX_POOL_CONNECTIONS,
+    thread_name_prefix="mysfits-dynamodb",
+)
+
+# The same permissive CORS policy flask_cors applies to the Flask app.
+CORS_HEADERS = [(b"access-control-allow-origin", b"*")]
+PREFLIGHT_HEADERS = CORS_HEADERS + [
+    (b"access-control-allow-methods", b"GET, HEAD, POST, OPTIONS"),
+    (b"access-control-allow-headers", b"Content-Type, Authorization"),
+]
+
+MYSFIT_ROUTE = re.compile(r"^/mysfits/([^/]+)(?:/(like|adopt))?$")
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+async def readBody(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > mysfitsHandlers.MAX_BODY_SIZE:
+            raise BodyTooLarge()
+        if not message.get("more_body", False):
+            return body
+
+
+async def runBlocking(handler, *args):
+    # the handler runs in this request's context, so the cache lookups it
+    # makes are noted for the request's access log entry. While /admin/profile
+    # is profiling requests, some calls are run under cProfile.
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor,
+        functools.partial(
+            contextvars.copy_context().run,
+            mysfitsProfiler.profiler.call,
+            handler,
+            *args,
+        ),
+    )
+
+
+async def readSource(handler, *args, builds=False):
+    # the snapshot source never waits on I/O, so there is no point paying for
+    # a thread hop to call it, unless the call builds a body first. Building
+    # a listing of a large catalog can take long enough to stall every other
+    # connection on the loop.
+    if mysfitsSource.blocking or builds:
+        return await runBlocking(handler, mysfitsSource, *args)
+    return mysfitsProfiler.profiler.call(handler, mysfitsSource, *args)
+
+
+async def dispatch(method, path, args, headers, receive):
+    if path == "/" and method == "GET":
+        return mysfitsHandlers.healthCheck()
+
+    if path == "/mysfits" and method == "GET":
+        builds = not mysfitsSource.blocking and not mysfitsHandlers.isListingBuilt(
+            mysfitsSource, args
+        )
+        return await readSource(
+            mysfitsHandlers.getMysfits, args, headers, builds=builds
+        )
+
+    if path == "/metrics" and method == "GET":
+        return mysfitsHandlers.metrics()
+
+    # runs on the thread pool, as the profile holds the thread taking it.
+    if path == "/admin/profile" and method == "POST":
+        return await runBlocking(mysfitsHandlers.profile, args, headers)
+
+    # checked before MYSFIT_ROUTE, which would take "batch" for a mysfitId.
+    if path == "/mysfits/batch":
+        if method == "POST":
+            try:
+                mysfitIds = mysfitsHandlers.parseBatchBody(await readBody(receive))
+            except BodyTooLarge:
+                return mysfitsHandlers.errorResponse(413, "Request body too large")
+        elif method == "GET":
+            mysfitIds = mysfitsHandlers.parseBatchIds(args.get("ids"))
+        else:
+            return mysfitsHandlers.errorResponse(405, "Method not allowed")
+        # a batch is always joined and compressed for the request.
+        return await readSource(
+            mysfitsHandlers.getMysfitsBatch, mysfitIds, headers, builds=True
+        )
+
+    match = MYSFIT_ROUTE.match(path)
+    if match is not None:
+        mysfitId, action = match.groups()
+        # a single mysfit is encoded the first time it is asked for, which
+        # costs too little to be worth the hop.
+        if action is None and method == "GET":
+            return await readSource(mysfitsHandlers.getMysfit, mysfitId, headers)
+        if action == "like" and method == "POST":
+            return await runBlocking(mysfitsHandlers.likeMysfit, mysfitId)
+        if action == "adopt" and method == "POST":
+            return await runBlocking(mysfitsHandlers.adoptMysfit, mysfitId)
+        return mysfitsHandlers.errorResponse(405, "Method not allowed")
+
+    if path in ("/", "/mysfits", "/metrics", "/admin/profile"):
+        return mysfitsHandlers.errorResponse(405, "Method not allowed")
+    return mysfitsHandlers.errorResponse(404, "Not found")
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    method = scope["method"]
+    if method == "OPTIONS":
+        await send(
+            {"type": "http.response.start", "status": 200, "headers": PREFLIGHT_HEADERS}
+        )
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    # query string arguments and headers are handed to the handlers as plain
+    # dicts. As with Flask, the first value of a repeated argument wins.
+    args = {}
+    for name, value in parse_qsl(scope["query_string"].decode("latin-1")):
+        args.setdefault(name, value)
+    headers = {}
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").lower()
+        value = value.decode("latin-1")
+        headers[name] = headers[name] + ", " + value if name in headers else value
+
+    route = mysfitsMetrics.routeLabel(scope["path"])
+    metricsToken = mysfitsMetrics.requestMetrics.begin(route)
+    # every request runs in its own task, and so its own context.
+    cacheLookups = []
+    mysfitsCache.lookups.set(cacheLookups)
+    response = None
+    size = None
+    try:
+        # requests other than health checks are admitted first, and hold their
+        # slot until the whole response, streamed or not, has been sent.
+        if route in mysfitsAdmission.PRIORITY_ROUTES:
+            ticket = None
+        else:
+            ticket = await mysfitsHandlers.admission.admitAsync()
+            if ticket is None:
+                response = mysfitsHandlers.overloadedResponse()
+                size = await sendResponse(send, response, method == "HEAD")
+                return
+        try:
+            try:
+                response = await dispatch(
+                    "GET" if method == "HEAD" else method,
+                    scope["path"],
+                    args,
+                    headers,
+                    receive,
+                )
+            except Exception:
+                logging.exception("error serving %s %s", method, scope["path"])
+                response = mysfitsHandlers.errorResponse(500, "Internal server error")
+            size = await sendResponse(send, response, method == "HEAD")
+        finally:
+            if ticket is not None:
+                mysfitsHandlers.admission.release(
+                    ticket, response is not None and response.status < 500
+                )
+    finally:
+        status = response.status if response is not None else 500
+        elapsed = mysfitsMetrics.requestMetrics.end(metricsToken, method, status, size)
+        if mysfitsHandlers.accessLog is not None:
+            mysfitsHandlers.accessLog.record(
+                method,
+                scope["path"],
+                route,
+                status,
+                elapsed,
+                size,
+                mysfitsAccessLog.cacheOutcome(cacheLookups),
+            )
+
+
+# Sends the response, returning the size of its body as for metrics: the
+# content-length, or what was streamed of it.
+async def sendResponse(send, response, headOnly):
+    headers = [
+        (name.lower().encode("latin-1"), value.encode("latin-1"))
+        for name, value in response.headers
+    ]
+    streamed = not isinstance(response.body, bytes)
+    if not streamed:
+        headers.append((b"content-length", str(len(response.body)).encode("latin-1")))
+    await send(
+        {
+            "type": "http.response.start",
+            "status": response.status,
+            "headers": headers + CORS_HEADERS,
+        }
+    )
+    if not streamed or headOnly:
+        await send(
+            {"type": "http.response.body", "body": b"" if headOnly else response.body}
+        )
+        return None if streamed else len(response.body)
+
+    # without a content-length the server sends the chunks with chunked
+    # transfer encoding. Producing the next chunk may mean a DynamoDB call, so
+    # for a blocking source it happens on the thread pool.
+    chunks = iter(response.body)
+    size = 0
+    while True:
+        if mysfitsSource.blocking:
+            chunk = await runBlocking(next, chunks, None)
+        else:
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+        size += len(chunk)
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+    return size
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await runBlocking(mysfitsHandlers.flushBuffers)
+            executor.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+# Run the service with uvicorn, listening on port 8080 like the Flask app.
+if __name__ == "__main__":
+    import uvicorn
+
+    mysfitsHandlers.configureLogging()
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", "8080")),
+        lifespan="on",
+        access_log=False,
+    )
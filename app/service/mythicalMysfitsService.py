@@ -1,40 +1,196 @@
-from flask import Flask, jsonify, json, Response, request
+import logging
+import os
+import signal
+import sys
+
+from flask import Flask, Response, g, request, stream_with_context
 from flask_cors import CORS
 
-# A very basic API created using Flask that has two possible routes for requests.
+import mysfitsAccessLog
+import mysfitsAdmission
+import mysfitsCache
+import mysfitsHandlers
+import mysfitsMetrics
+import mysfitsProfiler
+
+# A very basic API created using Flask. The request handling itself lives in
+# mysfitsHandlers, which is shared with the asynchronous ASGI version of this
+# service in mythicalMysfitsAsgi.py.
 
 app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = mysfitsHandlers.MAX_BODY_SIZE
 CORS(app)
 
+# Where the mysfits are read from: the static JSON file held in memory, or
+# MysfitsTable in DynamoDB. See mysfitsHandlers.createSource.
+mysfitsSource = mysfitsHandlers.createSource()
+
+
+# Every request is timed and counted for /metrics, and access logged. The
+# request is recorded once Flask is done with it, whether or not a handler
+# raised; for a streamed response that is after its last chunk has been sent
+# (see flaskResponse).
+@app.before_request
+def startRequestMetrics():
+    g.route = mysfitsMetrics.routeLabel(request.path)
+    g.metricsToken = mysfitsMetrics.requestMetrics.begin(g.route)
+    g.cacheLookups = []
+    mysfitsCache.lookups.set(g.cacheLookups)
+
+
+# Requests other than health checks are admitted by mysfitsHandlers.admission
+# first; one that is shed gets its 503 without reaching a handler. Under
+# gunicorn, time spent queued for a worker thread counts as time waited.
+@app.before_request
+def admitRequest():
+    if request.method == "OPTIONS" or g.route in mysfitsAdmission.PRIORITY_ROUTES:
+        return None
+    g.admissionTicket = mysfitsHandlers.admission.admit(
+        request.environ.get(mysfitsAdmission.ENQUEUED_AT)
+    )
+    if g.admissionTicket is None:
+        return flaskResponse(mysfitsHandlers.overloadedResponse())
+    return None
+
+
+# While /admin/profile is profiling requests, some of them are run under
+# cProfile from here until teardown.
+@app.before_request
+def startRequestProfile():
+    g.profile = mysfitsProfiler.profiler.startRequest()
+
+
+@app.after_request
+def noteResponseForMetrics(response):
+    g.metricsStatus = response.status_code
+    g.setdefault("metricsSize", response.content_length)
+    return response
+
+
+@app.teardown_request
+def recordRequestMetrics(error):
+    token = g.pop("metricsToken", None)
+    if token is not None:
+        status = g.pop("metricsStatus", 500)
+        size = g.pop("metricsSize", None)
+        elapsed = mysfitsMetrics.requestMetrics.end(token, request.method, status, size)
+        if mysfitsHandlers.accessLog is not None:
+            mysfitsHandlers.accessLog.record(
+                request.method,
+                request.path,
+                g.route,
+                status,
+                elapsed,
+                size,
+                mysfitsAccessLog.cacheOutcome(g.pop("cacheLookups", None)),
+            )
+
+
+# Flask calls teardown functions in the reverse of the order they were
+# registered in, so this runs before recordRequestMetrics has taken the status.
+@app.teardown_request
+def releaseAdmission(error):
+    ticket = g.pop("admissionTicket", None)
+    if ticket is not None:
+        mysfitsHandlers.admission.release(ticket, g.get("metricsStatus", 500) < 500)
+
+
+@app.teardown_request
+def finishRequestProfile(error):
+    mysfitsProfiler.profiler.finishRequest(g.pop("profile", None))
+
+
+# Converts a framework-independent ServiceResponse into a Flask response.
+# A streamed body keeps the request context, and so the admission slot, the
+# request timer and the profile, until its last chunk has been sent; Flask
+# only tears the request down after that.
+def flaskResponse(serviceResponse):
+    body = serviceResponse.body
+    if not isinstance(body, bytes):
+        body = stream_with_context(countedChunks(body))
+    response = Response(body, status=serviceResponse.status)
+    for name, value in serviceResponse.headers:
+        response.headers[name] = value
+    return response
+
+
+def countedChunks(chunks):
+    g.metricsSize = 0
+    for chunk in chunks:
+        g.metricsSize += len(chunk)
+        yield chunk
+
+
 # The service basepath has a short response just to ensure that healthchecks
 # sent to the service root will receive a healthy response.
 @app.route("/")
 def healthCheckResponse():
-    return jsonify(
-        {"message": "Nothing here, used for health check. Try /mysfits instead."}
-    )
+    return flaskResponse(mysfitsHandlers.healthCheck())
+
+
+@app.route("/metrics")
+def getMetrics():
+    return flaskResponse(mysfitsHandlers.metrics())
+
+
+# Holds one of the worker's threads for as long as the profile takes.
+@app.route("/admin/profile", methods=["POST"])
+def profile():
+    return flaskResponse(mysfitsHandlers.profile(request.args, request.headers))
 
 
 # The main API resource that the next version of the Mythical Mysfits website
 # will utilize. It returns the data for all of the Mysfits to be displayed on
-# the website.  Because we do not yet have any persistent storage available for
-# our application, the mysfits are simply stored in a static JSON file. Which is
-# read from the the filesystem, and directly used as the service response.
+# the website, optionally filtered to a single alignment.
 @app.route("/mysfits")
 def getMysfits():
+    return flaskResponse(
+        mysfitsHandlers.getMysfits(mysfitsSource, request.args, request.headers)
+    )
 
-    # read the mysfits JSON from the listed file.
-    response = Response(open("mysfits-response.json").read())
 
-    # set the Content-Type header so that the browser is aware that the response
-    # is formatted as JSON and our frontend JavaScript code is able to
-    # appropriately parse the response.
-    response.headers["Content-Type"] = "application/json"
+# Returns several mysfits by id in one request. Werkzeug matches static rules
+# before rules with variables, so this is never taken for a mysfitId.
+@app.route("/mysfits/batch", methods=["GET", "POST"])
+def getMysfitsBatch():
+    if request.method == "POST":
+        mysfitIds = mysfitsHandlers.parseBatchBody(request.get_data())
+    else:
+        mysfitIds = mysfitsHandlers.parseBatchIds(request.args.get("ids"))
+    return flaskResponse(
+        mysfitsHandlers.getMysfitsBatch(mysfitsSource, mysfitIds, request.headers)
+    )
 
-    return response
+
+# Returns the data for a single mysfit, shown in its profile.
+@app.route("/mysfits/<mysfitId>")
+def getMysfit(mysfitId):
+    return flaskResponse(
+        mysfitsHandlers.getMysfit(mysfitsSource, mysfitId, request.headers)
+    )
+
+
+@app.route("/mysfits/<mysfitId>/like", methods=["POST"])
+def likeMysfit(mysfitId):
+    return flaskResponse(mysfitsHandlers.likeMysfit(mysfitId))
+
+
+@app.route("/mysfits/<mysfitId>/adopt", methods=["POST"])
+def adoptMysfit(mysfitId):
+    return flaskResponse(mysfitsHandlers.adoptMysfit(mysfitId))
 
 
 # Run the service on the local server it has been deployed to,
-# listening on port 8080.
+# listening on port 8080 unless the PORT environment variable says otherwise.
+# ECS stops the task with SIGTERM; turning that into a normal exit gives the
+# service the chance to write out any buffered likes and access logs first.
+# Requests are logged by mysfitsAccessLog, so the development server's own
+# line per request on stderr is turned off.
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8080)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    mysfitsHandlers.configureLogging()
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    try:
+        app.run(host="0.0.0.0", port=int(os.environ.get("PORT", "8080")))
+    finally:
+        mysfitsHandlers.flushBuffers()
@@ -0,0 +1,12 @@
+import os
+import sys
+
+# Operational tools for the Mythical Mysfits data, run from the app directory
+# as "python -m tools.<name>". The service modules are plain scripts in
+# app/service rather than a package, so they are made importable here.
+
+SERVICE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "service"
+)
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
@@ -0,0 +1,78 @@
+import argparse
+import sys
+import time
+
+from tools import catalogFiles
+
+import mysfitsBinarySnapshot
+
+# Converts a mysfits catalog into the binary snapshot format the snapshot
+# source can serve from a memory map (see mysfitsBinarySnapshot):
+#
+#   python -m tools.buildSnapshot data/populate-dynamodb.json \
+#       --output /data/mysfits.snapshot
+#
+# The input can be either format the repository keeps its data in, the
+# service response document or the batch-write-item requests for MysfitsTable.
+# The output replaces any snapshot already at that path in one rename, so a
+# service watching it (MYSFITS_SNAPSHOT_PATH) picks up the new catalog whole.
+#
+# The listings of whole mysfits and of the summary are compressed when the
+# snapshot is built. Brotli's top quality, 11, makes them about a tenth
+# smaller again than the default, 9, but takes some fifteen times as long.
+# --gzip-level and --brotli-quality trade file size for build time, and
+# --no-compress leaves the listings to be sent uncompressed.
+#
+# The report written at the end includes the snapshot's size against that of
+# the catalog as JSON. A snapshot more than
+# mysfitsBinarySnapshot.MAX_SIZE_RATIO times as large is still written, but
+# the tool exits with status 1 (see checkSize).
+
+
+def checkSize(report, out=sys.stderr):
+    # the exit status for a snapshot of the size in report, a
+    # mysfitsBinarySnapshot.BuildReport, warning on out if it is too large.
+    out.write(
+        "{} bytes, {:.2f} times the {} bytes of the catalog as JSON\n".format(
+            report.size, report.ratio, report.jsonSize
+        )
+    )
+    if not report.isTooLarge():
+        return 0
+    out.write(
+        "snapshot is larger than {} times the catalog as JSON\n".format(
+            mysfitsBinarySnapshot.MAX_SIZE_RATIO
+        )
+    )
+    return 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build a binary mysfits snapshot from a catalog file."
+    )
+    parser.add_argument("input", help="mysfits-response.json or populate-dynamodb.json")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--no-compress", action="store_true")
+    parser.add_argument("--gzip-level", type=int, default=9)
+    parser.add_argument("--brotli-quality", type=int, default=9)
+    options = parser.parse_args(argv)
+
+    started = time.monotonic()
+    report = mysfitsBinarySnapshot.writeSnapshot(
+        catalogFiles.iterMysfits(options.input),
+        options.output,
+        compress=not options.no_compress,
+        gzipLevel=options.gzip_level,
+        brotliQuality=options.brotli_quality,
+    )
+    sys.stderr.write(
+        "wrote {} mysfits to {} in {:.1f}s\n".format(
+            report.count, options.output, time.monotonic() - started
+        )
+    )
+    return checkSize(report)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
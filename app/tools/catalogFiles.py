@@ -0,0 +1,110 @@
+import json
+
+import tools  # noqa: F401  (makes the service modules importable)
+
+import mysfitsTableClient
+
+# Reads the mysfits out of either of the formats the repository keeps its data
+# in (see tools.generateCatalog):
+#
+#   mysfits-response.json   {"mysfits": [<mysfit>, ...]}
+#   populate-dynamodb.json  {"MysfitsTable": [{"PutRequest": {"Item": ...}}]}
+#
+# Both are read incrementally, one array element at a time, so a catalog of a
+# million mysfits never has to fit in memory as one parsed document.
+
+READ_SIZE = 1024 * 1024
+
+_decoder = json.JSONDecoder()
+
+
+class CatalogFormatError(ValueError):
+    pass
+
+
+def iterArray(textFile):
+    # yields the key of the top-level object's one array, then each element
+    # of it, parsed. The elements are JSON objects, so one that decodes is
+    # known to be complete even when it ends exactly where the buffer does.
+    buffer, position = _expect(textFile, "", 0, "{")
+    key, buffer, position = _decode(textFile, buffer, position)
+    buffer, position = _expect(textFile, buffer, position, ":")
+    buffer, position = _expect(textFile, buffer, position, "[")
+    yield key
+    buffer, position = _fill(textFile, buffer, position)
+    if buffer[position] == "]":
+        return
+    while True:
+        element, buffer, position = _decode(textFile, buffer, position)
+        yield element
+        buffer, position = _fill(textFile, buffer, position)
+        if buffer[position] == "]":
+            return
+        buffer, position = _expect(textFile, buffer, position, ",")
+
+
+def _fill(textFile, buffer, position):
+    # skip whitespace, reading more of the file when the buffer runs out.
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n":
+            position += 1
+        if position < len(buffer):
+            return buffer, position
+        more = textFile.read(READ_SIZE)
+        if not more:
+            raise CatalogFormatError("the catalog ends too early")
+        buffer, position = more, 0
+
+
+def _expect(textFile, buffer, position, character):
+    buffer, position = _fill(textFile, buffer, position)
+    if buffer[position] != character:
+        raise CatalogFormatError(
+            "expected {!r} at {!r}".format(character, buffer[position : position + 20])
+        )
+    return buffer, position + 1
+
+
+def _decode(textFile, buffer, position):
+    # decode the value starting at position, reading more of the file for as
+    # long as it is cut off by the end of the buffer.
+    buffer, position = _fill(textFile, buffer, position)
+    while True:
+        try:
+            value, end = _decoder.raw_decode(buffer, position)
+            return value, buffer, end
+        except json.JSONDecodeError:
+            more = textFile.read(READ_SIZE)
+            if not more:
+                raise
+            buffer, position = buffer[position:] + more, 0
+
+
+def iterMysfits(path):
+    # the mysfits of a catalog file in either format, as the service returns
+    # them.
+    with open(path, encoding="utf-8") as catalogFile:
+        elements = iterArray(catalogFile)
+        key = next(elements)
+        if key == "mysfits":
+            yield from elements
+        elif key == mysfitsTableClient.TABLE_NAME:
+            for write in elements:
+                yield mysfitsTableClient.itemToMysfit(write["PutRequest"]["Item"])
+        else:
+            raise CatalogFormatError("{} holds no mysfits".format(path))
+
+
+def iterItems(path):
+    # the MysfitsTable items of a catalog file in either format.
+    with open(path, encoding="utf-8") as catalogFile:
+        elements = iterArray(catalogFile)
+        key = next(elements)
+        if key == "mysfits":
+            for mysfit in elements:
+                yield mysfitsTableClient.mysfitToItem(mysfit)
+        elif key == mysfitsTableClient.TABLE_NAME:
+            for write in elements:
+                yield write["PutRequest"]["Item"]
+        else:
+            raise CatalogFormatError("{} holds no mysfits".format(path))
@@ -0,0 +1,137 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from tools import buildSnapshot
+
+import mysfitsBinarySnapshot
+import mysfitsJson
+import mysfitsTableClient
+
+# Regenerates the service's snapshot of the mysfits catalog from MysfitsTable,
+# so that reads can be served from a precomputed snapshot while the table
+# keeps taking the likes and adoptions:
+#
+#   python -m tools.exportSnapshot --output /data/mysfits.snapshot
+#   python -m tools.exportSnapshot --format json \
+#       --output service/mysfits-response.json
+#
+# The table is read with the same parallel Scan the dynamodb source lists it
+# with (see mysfitsTableClient.planListing), and each mysfit comes out exactly
+# as that source would serve it, sharded likes included.
+#
+# The binary format (see mysfitsBinarySnapshot) holds the serialized
+# mysfits, the filter bitmaps and the compressed default listings, all built
+# in this one run, and its size is checked like tools.buildSnapshot checks
+# it. The JSON format is the service response document, from which the
+# service builds its listings itself when it loads it.
+#
+# Either way the snapshot is written to a temporary file and renamed over the
+# output, so a service watching the output (MYSFITS_SNAPSHOT_PATH) swaps to
+# the new version whole the next time it polls, and serves the previous one
+# until then.
+#
+# Segments finish in no particular order. So that exporting an unchanged
+# table gives the same snapshot, and the same ETags, every time, each
+# segment's mysfits are spooled to a temporary file as they arrive and the
+# spools are read back in segment order.
+
+
+def iterSegmentMysfits(plan):
+    # the mysfits of every segment of the plan's Scan, segment by segment.
+    spools = {}
+    try:
+        pages = mysfitsTableClient.runPlan(plan, ordered=False, withSegments=True)
+        for segment, items in pages:
+            spool = spools.get(segment)
+            if spool is None:
+                spool = spools[segment] = tempfile.TemporaryFile()
+            for mysfit in mysfitsTableClient.itemsToMysfits(items):
+                spool.write(mysfitsJson.dumps(mysfit) + b"\n")
+        for segment in sorted(spools):
+            spool = spools[segment]
+            spool.seek(0)
+            for line in spool:
+                yield mysfitsJson.loads(line)
+    finally:
+        for spool in spools.values():
+            spool.close()
+
+
+def writeJsonSnapshot(mysfits, path):
+    # the service response document, {"mysfits": [...]}, replacing any file
+    # at path in one rename. Returns the number of mysfits written.
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporaryPath = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    count = 0
+    try:
+        with os.fdopen(descriptor, "wb") as output:
+            output.write(b'{"mysfits":[')
+            for mysfit in mysfits:
+                if count:
+                    output.write(b",")
+                output.write(mysfitsJson.dumps(mysfit))
+                count += 1
+            output.write(b"]}")
+            output.flush()
+            os.fsync(output.fileno())
+        os.chmod(temporaryPath, 0o644)
+        os.replace(temporaryPath, path)
+    except BaseException:
+        os.unlink(temporaryPath)
+        raise
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export MysfitsTable to a mysfits snapshot for the service."
+    )
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--format", choices=("binary", "json"), default="binary")
+    parser.add_argument(
+        "--segments",
+        type=int,
+        default=None,
+        help="Scan segments; by default one per MB of table, as the service uses",
+    )
+    parser.add_argument("--no-compress", action="store_true")
+    parser.add_argument("--gzip-level", type=int, default=9)
+    parser.add_argument("--brotli-quality", type=int, default=9)
+    options = parser.parse_args(argv)
+
+    started = time.monotonic()
+    plan = mysfitsTableClient.planListing()
+    if options.segments:
+        plan.segments = options.segments
+    mysfits = iterSegmentMysfits(plan)
+    report = None
+    if options.format == "json":
+        count = writeJsonSnapshot(mysfits, options.output)
+    else:
+        report = mysfitsBinarySnapshot.writeSnapshot(
+            mysfits,
+            options.output,
+            compress=not options.no_compress,
+            gzipLevel=options.gzip_level,
+            brotliQuality=options.brotli_quality,
+        )
+        count = report.count
+    sys.stderr.write(
+        "exported {} mysfits from {} in {} segments to {} in {:.1f}s, "
+        "{:.0f} RCU\n".format(
+            count,
+            mysfitsTableClient.TABLE_NAME,
+            plan.segments,
+            options.output,
+            time.monotonic() - started,
+            mysfitsTableClient.consumedReadCapacity,
+        )
+    )
+    return buildSnapshot.checkSize(report) if report is not None else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import argparse
+import json
+import math
+import os
+import random
+import uuid
+
+import tools  # noqa: F401  (makes the service modules importable)
+
+import mysfitsTableClient
+
+# Generates a synthetic catalog of any number of mysfits for scale testing, in
+# both of the formats the repository keeps its data in:
+#
+#   mysfits-response.json   the service response document served by the
+#                           snapshot source (MYSFITS_SNAPSHOT_PATH)
+#   populate-dynamodb.json  the batch-write-item request items for MysfitsTable
+#
+#   python -m tools.generateCatalog 100000 --output-dir /tmp/catalog [--seed 1]
+#
+# Every mysfit is generated once, as a DynamoDB item, and written to both files
+# before the next one is generated, the response entry being converted from
+# the item exactly as the dynamodb source converts it. The two files therefore
+# always describe the same mysfits, and neither is ever held in memory as a
+# whole, so a million mysfits take no more memory than a dozen.
+#
+# The same count and seed always produce the same catalog. Field sizes follow
+# the hand-written mysfits: names of one or two words, descriptions of roughly
+# 350 to 600 characters and ages anywhere from a few years to billions. Every
+# alignment occurs, with neutral mysfits a little more common on the law and
+# chaos axis, and likes are skewed so that a few mysfits hold most of them.
+#
+# aws dynamodb batch-write-item only takes 25 writes per call, so anything
+# past a couple of dozen mysfits is loaded into the table with tools.loadTable.
+
+SPECIES = (
+    "Chimera",
+    "Cyclops",
+    "Dragon",
+    "Gorgon",
+    "Haetae",
+    "Yeti",
+    "Kraken",
+    "Plesiosaurus",
+    "Mandrake",
+    "Pegasus",
+    "Phoenix",
+    "Troll",
+    "Griffin",
+    "Basilisk",
+    "Kitsune",
+    "Minotaur",
+)
+
+GOOD_EVIL = (("Good", 1.0), ("Neutral", 1.0), ("Evil", 1.0))
+LAW_CHAOS = (("Lawful", 3.0), ("Neutral", 4.0), ("Chaotic", 3.0))
+
+NAME_SYLLABLES = (
+    "ab al an ar be bel co da el eva fi glit gre ka la li lo ma mi na ne "
+    "no pa ri ru sa sha ta ter ti twi va ze zu"
+).split()
+
+DESCRIPTION_WORDS = (
+    "a an and the of with to in is for her his their never always ready "
+    "mythical world companion mysterious charming loyal fierce gentle curious "
+    "ancient young wise mischievous brave shy clever loves hates collects "
+    "guards sings dreams about mountains oceans forests caves castles stars "
+    "treasure riddles music books gardens storms fire ice gold secrets "
+    "friends adventures naps snacks puzzles dances flies swims roars whispers"
+).split()
+
+IMAGE_URI = "https://www.mythicalmysfits.com/images/{}_{}.png"
+
+
+def pick(rng, weighted):
+    values, weights = zip(*weighted)
+    return rng.choices(values, weights)[0]
+
+
+def generateName(rng):
+    words = [
+        "".join(rng.choice(NAME_SYLLABLES) for _ in range(rng.randint(2, 3)))
+        for _ in range(1 if rng.random() < 0.8 else 2)
+    ]
+    return " ".join(word.capitalize() for word in words)
+
+
+def generateDescription(rng, name):
+    length = rng.randint(350, 600)
+    sentences = []
+    size = 0
+    while size < length:
+        words = [rng.choice(DESCRIPTION_WORDS) for _ in range(rng.randint(8, 20))]
+        if not sentences:
+            words[0] = name
+        sentence = " ".join(words)
+        sentence = sentence[0].upper() + sentence[1:] + "."
+        sentences.append(sentence)
+        size += len(sentence) + 1
+    return " ".join(sentences)
+
+
+def generateItem(rng):
+    name = generateName(rng)
+    species = rng.choice(SPECIES)
+    image = species.lower()
+    return {
+        "MysfitId": {"S": str(uuid.UUID(int=rng.getrandbits(128), version=4))},
+        "Name": {"S": name},
+        "Species": {"S": species},
+        "Description": {"S": generateDescription(rng, name)},
+        "Age": {"N": str(int(math.exp(rng.uniform(0, math.log(2e9)))))},
+        "GoodEvil": {"S": pick(rng, GOOD_EVIL)},
+        "LawChaos": {"S": pick(rng, LAW_CHAOS)},
+        "ThumbImageUri": {"S": IMAGE_URI.format(image, "thumb")},
+        "ProfileImageUri": {"S": IMAGE_URI.format(image, "hover")},
+        "Likes": {"N": str(int((rng.paretovariate(1.2) - 1) * 10))},
+        "Adopted": {"BOOL": rng.random() < 0.1},
+    }
+
+
+def generateItems(count, seed=1):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield generateItem(rng)
+
+
+def writeCatalog(items, responseFile, dynamodbFile):
+    # stream both documents out one mysfit at a time, returning the count.
+    responseFile.write('{"mysfits": [')
+    dynamodbFile.write('{"' + mysfitsTableClient.TABLE_NAME + '": [')
+    count = 0
+    for item in items:
+        separator = ",\n" if count else "\n"
+        responseFile.write(
+            separator + json.dumps(mysfitsTableClient.itemToMysfit(item))
+        )
+        dynamodbFile.write(separator + json.dumps({"PutRequest": {"Item": item}}))
+        count += 1
+    responseFile.write("\n]}\n")
+    dynamodbFile.write("\n]}\n")
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic mysfits catalog in both data formats."
+    )
+    parser.add_argument("count", type=int)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output-dir", default=".")
+    options = parser.parse_args(argv)
+
+    os.makedirs(options.output_dir, exist_ok=True)
+    with open(
+        os.path.join(options.output_dir, "mysfits-response.json"), "w"
+    ) as responseFile, open(
+        os.path.join(options.output_dir, "populate-dynamodb.json"), "w"
+    ) as dynamodbFile:
+        writeCatalog(
+            generateItems(options.count, options.seed), responseFile, dynamodbFile
+        )
+
+
+if __name__ == "__main__":
+    main()
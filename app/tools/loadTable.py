@@ -0,0 +1,412 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from tools import catalogFiles
+
+import mysfitsTableClient
+
+# Loads a mysfits catalog of any size into MysfitsTable:
+#
+#   python -m tools.loadTable data/populate-dynamodb.json [--workers 16]
+#
+# The input, in either catalog format (see tools.catalogFiles), is read one
+# mysfit at a time and written in BatchWriteItem calls of 25 items, the most
+# one call takes, by a pool of worker threads. DynamoDB rejects a batch that
+# writes the same mysfitId twice, so a mysfitId repeated within a batch is
+# written once, as it last appears. Items DynamoDB leaves
+# unprocessed are written again after an exponential backoff with full
+# jitter.
+#
+# Writes are paced to a shared rate in items per second. It starts at
+# --initial-rate, grows by a tenth for every second in which DynamoDB accepts
+# everything, up to --max-rate if one is given, and halves whenever it
+# throttles. A table with provisioned capacity is therefore written about as
+# fast as it allows, and an on-demand table as fast as the workers go. Every
+# item is also written to each of the table's global secondary indexes, which
+# have write capacity of their own.
+#
+# Progress is saved to a checkpoint file (by default one for the input and
+# table in a mysfits-load directory under the system's temporary directory,
+# well away from the catalog) every few seconds. A load that is interrupted, by an
+# error or by Ctrl-C, resumes from its checkpoint when run again with the same
+# input; --restart starts it over. Writes are plain puts, so the few batches
+# written after the last checkpoint are written again harmlessly.
+#
+# Every item is written with a hash of its content (see contentHash), so that
+# tools.syncTable can later tell which items a new catalog changes.
+
+BATCH_SIZE = 25
+
+CONTENT_HASH_ATTRIBUTE = "ContentHash"
+
+# DynamoDB errors that mean a call was throttled and can be made again.
+THROTTLING_ERRORS = frozenset(
+    (
+        "ProvisionedThroughputExceededException",
+        "ThrottlingException",
+        "RequestLimitExceeded",
+    )
+)
+
+BACKOFF_SECONDS = 0.05
+MAX_BACKOFF_SECONDS = 5.0
+
+
+class RateController(object):
+    # Paces the writes of every worker to a shared rate, in items per second,
+    # raised while DynamoDB keeps up and halved when it throttles.
+    def __init__(self, rate, maxRate=None, minRate=BATCH_SIZE, clock=time.monotonic):
+        self.rate = float(rate)
+        self.maxRate = maxRate
+        self.minRate = minRate
+        self.throttles = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._next = clock()
+        self._waited = False
+        self._lastIncrease = self._lastThrottle = clock()
+
+    def acquire(self, items):
+        # wait for the turn of a write of `items` items.
+        with self._lock:
+            now = self._clock()
+            start = max(now, self._next)
+            self._next = start + items / self.rate
+            self._waited = self._waited or start > now
+        if start > now:
+            time.sleep(start - now)
+
+    def accepted(self):
+        # the rate grows once for every second without a throttled call, as
+        # long as it is what holds the writes back, so that it never runs far
+        # ahead of what the workers actually send.
+        with self._lock:
+            now = self._clock()
+            if (
+                self._waited
+                and min(now - self._lastIncrease, now - self._lastThrottle) >= 1.0
+            ):
+                self.rate *= 1.1
+                if self.maxRate:
+                    self.rate = min(self.rate, self.maxRate)
+                self._lastIncrease = now
+                self._waited = False
+
+    def throttled(self):
+        # the rate is cut at most once a second, however many of the calls
+        # in flight at the time come back throttled.
+        with self._lock:
+            self.throttles += 1
+            now = self._clock()
+            if now - self._lastThrottle >= 1.0:
+                self.rate = max(self.minRate, self.rate / 2)
+                self._lastThrottle = now
+
+
+def contentHash(item):
+    # a hash of everything in an item but its content hash, the same however
+    # its attributes are ordered.
+    content = {
+        name: value for name, value in item.items() if name != CONTENT_HASH_ATTRIBUTE
+    }
+    encoded = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:32]
+
+
+def withContentHash(item):
+    return dict(item, **{CONTENT_HASH_ATTRIBUTE: {"S": contentHash(item)}})
+
+
+def isThrottling(error):
+    return error.response.get("Error", {}).get("Code") in THROTTLING_ERRORS
+
+
+def writeBatch(client, tableName, writes, controller, maxAttempts=10):
+    # make every write, a PutRequest or DeleteRequest, returning the write
+    # capacity consumed.
+    capacityUnits = 0.0
+    for attempt in range(maxAttempts):
+        controller.acquire(len(writes))
+        try:
+            response = client.batch_write_item(
+                RequestItems={tableName: writes}, ReturnConsumedCapacity="TOTAL"
+            )
+        except client.exceptions.ClientError as error:
+            if not isThrottling(error):
+                raise
+        else:
+            for consumed in response.get("ConsumedCapacity") or []:
+                capacityUnits += consumed.get("CapacityUnits", 0.0)
+            writes = (response.get("UnprocessedItems") or {}).get(tableName)
+            if not writes:
+                controller.accepted()
+                return capacityUnits
+        controller.throttled()
+        time.sleep(
+            random.uniform(0, min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2**attempt))
+        )
+    raise RuntimeError(
+        "BatchWriteItem left items unprocessed after {} attempts".format(maxAttempts)
+    )
+
+
+def writeKey(write):
+    # the mysfitId a PutRequest or DeleteRequest writes.
+    request = write.get("PutRequest")
+    key = request["Item"] if request is not None else write["DeleteRequest"]["Key"]
+    return key["MysfitId"]["S"]
+
+
+def iterBatches(writes, skip=0, key=writeKey):
+    # (index, writes) for each batch of BATCH_SIZE writes to distinct
+    # mysfitIds, starting at batch `skip`. A later write to a mysfitId already
+    # in the batch takes the place of the earlier one.
+    batch = {}
+    index = 0
+    for write in writes:
+        batch[key(write)] = write
+        if len(batch) == BATCH_SIZE:
+            if index >= skip:
+                yield index, list(batch.values())
+            batch = {}
+            index += 1
+    if batch and index >= skip:
+        yield index, list(batch.values())
+
+
+class Checkpoint(object):
+    # The number of batches from the start of the input that have all been
+    # written. Batches finish out of order, so later batches that are already
+    # written are held back until every batch before them is.
+    def __init__(self, path, identity, batches=0, items=0):
+        self.path = path
+        self.identity = identity
+        self.batches = batches
+        self.items = items
+        self._finished = {}
+
+    @classmethod
+    def load(cls, path, identity):
+        try:
+            with open(path) as checkpointFile:
+                saved = json.load(checkpointFile)
+        except FileNotFoundError:
+            return cls(path, identity)
+        if saved.get("identity") != identity:
+            raise SystemExit(
+                "{} is for another input or table; run with --restart to start "
+                "over".format(path)
+            )
+        return cls(path, identity, saved["batches"], saved["items"])
+
+    def finished(self, index, items):
+        self._finished[index] = items
+        while self.batches in self._finished:
+            self.items += self._finished.pop(self.batches)
+            self.batches += 1
+
+    def save(self):
+        temporaryPath = self.path + ".tmp"
+        with open(temporaryPath, "w") as checkpointFile:
+            json.dump(
+                {
+                    "identity": self.identity,
+                    "batches": self.batches,
+                    "items": self.items,
+                },
+                checkpointFile,
+            )
+        os.replace(temporaryPath, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def loadTable(
+    client,
+    batches,
+    tableName,
+    controller,
+    workers,
+    report,
+    checkpoint=None,
+    write=writeBatch,
+):
+    # write every batch with a pool of `workers` threads, keeping at most
+    # twice that many batches in memory, noting each one finished on the
+    # checkpoint if there is one. Each batch is written by
+    # write(client, tableName, batch, controller), writeBatch by default,
+    # which returns the capacity it consumed. Returns the writes made and the
+    # write capacity they consumed.
+    written = 0
+    capacityUnits = 0.0
+    pending = {}
+
+    def collect(futures):
+        nonlocal written, capacityUnits
+        for future in futures:
+            index, size = pending[future]
+            capacityUnits += future.result()
+            del pending[future]
+            written += size
+            if checkpoint is not None:
+                checkpoint.finished(index, size)
+
+    with ThreadPoolExecutor(workers, thread_name_prefix="mysfits-load") as executor:
+        try:
+            for index, batch in batches:
+                while len(pending) >= 2 * workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                    report(written, capacityUnits)
+                future = executor.submit(write, client, tableName, batch, controller)
+                pending[future] = (index, len(batch))
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+                report(written, capacityUnits)
+        except BaseException:
+            # let the batches already sent finish, so that the checkpoint
+            # covers as much as possible, and send no more.
+            for future in pending:
+                future.cancel()
+            done, _ = wait(pending)
+            if checkpoint is not None:
+                for future in done:
+                    if not future.cancelled() and future.exception() is None:
+                        index, size = pending[future]
+                        checkpoint.finished(index, size)
+                checkpoint.save()
+            raise
+    return written, capacityUnits
+
+
+class ProgressReport(object):
+    # writes progress to stderr, and saves the checkpoint if there is one,
+    # every `interval` seconds.
+    def __init__(self, controller, interval, checkpoint=None, verb="loaded"):
+        self.controller = controller
+        self.interval = interval
+        self.checkpoint = checkpoint
+        self.verb = verb
+        self.started = time.monotonic()
+        self._last = self.started
+
+    def __call__(self, written, capacityUnits, final=False):
+        now = time.monotonic()
+        if not final and now - self._last < self.interval:
+            return
+        self._last = now
+        elapsed = max(now - self.started, 1e-9)
+        sys.stderr.write(
+            "{}{} items in {:.0f}s ({:.0f} items/s), {:.0f} WCU ({:.0f} WCU/s), "
+            "{} throttled, pacing at {:.0f} items/s\n".format(
+                self.verb + " " if final else "",
+                written,
+                elapsed,
+                written / elapsed,
+                capacityUnits,
+                capacityUnits / elapsed,
+                self.controller.throttles,
+                self.controller.rate,
+            )
+        )
+        if not final and self.checkpoint is not None:
+            self.checkpoint.save()
+
+
+def defaultCheckpointPath(inputPath, tableName):
+    key = "{}\0{}".format(os.path.abspath(inputPath), tableName)
+    directory = os.path.join(tempfile.gettempdir(), "mysfits-load")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(
+        directory,
+        "{}-{}.checkpoint".format(
+            os.path.basename(inputPath),
+            hashlib.sha256(key.encode("utf-8")).hexdigest()[:16],
+        ),
+    )
+
+
+def getClient(workers):
+    # the service's client, keeping a connection open for every worker.
+    mysfitsTableClient.MAX_POOL_CONNECTIONS = max(
+        mysfitsTableClient.MAX_POOL_CONNECTIONS, workers
+    )
+    return mysfitsTableClient.getClient()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load a mysfits catalog into MysfitsTable."
+    )
+    parser.add_argument("input", help="populate-dynamodb.json or mysfits-response.json")
+    parser.add_argument("--table", default=mysfitsTableClient.TABLE_NAME)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--initial-rate", type=float, default=1000.0)
+    parser.add_argument("--max-rate", type=float, default=None)
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--restart", action="store_true")
+    parser.add_argument("--progress-seconds", type=float, default=5.0)
+    options = parser.parse_args(argv)
+
+    stat = os.stat(options.input)
+    identity = {
+        "input": os.path.abspath(options.input),
+        "size": stat.st_size,
+        "modified": stat.st_mtime_ns,
+        "table": options.table,
+    }
+    checkpointPath = options.checkpoint or defaultCheckpointPath(
+        options.input, options.table
+    )
+    if options.restart:
+        checkpoint = Checkpoint(checkpointPath, identity)
+    else:
+        checkpoint = Checkpoint.load(checkpointPath, identity)
+        if checkpoint.batches:
+            sys.stderr.write(
+                "resuming after {} items from {}\n".format(
+                    checkpoint.items, checkpointPath
+                )
+            )
+
+    controller = RateController(options.initial_rate, options.max_rate)
+    report = ProgressReport(controller, options.progress_seconds, checkpoint)
+    writes = (
+        {"PutRequest": {"Item": withContentHash(item)}}
+        for item in catalogFiles.iterItems(options.input)
+    )
+    try:
+        written, capacityUnits = loadTable(
+            getClient(options.workers),
+            iterBatches(writes, checkpoint.batches),
+            options.table,
+            controller,
+            options.workers,
+            report,
+            checkpoint,
+        )
+    except KeyboardInterrupt:
+        sys.stderr.write(
+            "interrupted after {} items; run again to resume\n".format(checkpoint.items)
+        )
+        return 130
+    report(written, capacityUnits, final=True)
+    checkpoint.remove()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import argparse
+import sys
+
+import tools  # noqa: F401  (makes the service modules importable)
+
+import mysfitsTableClient
+
+# Moves the like counters of popular mysfits onto sharded counter items in
+# MysfitsLikesTable, or gives an already sharded mysfit more shards.
+#
+#   python -m tools.shardLikeCounters <mysfitId>=<shards> [...] [--dry-run]
+#
+# A mysfit moving off a single counter has its current Likes carried over to
+# shard 0 and its LikeShards attribute set, in one transaction. A mysfit that
+# is already sharded only has LikeShards raised; its new shards are created by
+# the first like that lands on them.
+#
+# Shard counts can only grow. Running services cache a mysfit's shard count
+# for up to a minute and keep writing to the shards they know about, which
+# stays correct only as long as every one of those shards is still summed.
+
+
+def parseAssignment(text):
+    mysfitId, _, shards = text.partition("=")
+    if not mysfitId or not shards.isdigit() or int(shards) < 1:
+        raise argparse.ArgumentTypeError(
+            "expected <mysfitId>=<shards>, got {!r}".format(text)
+        )
+    return mysfitId, int(shards)
+
+
+def shardMysfit(client, mysfitId, shards, dryRun=False):
+    response = client.get_item(
+        TableName=mysfitsTableClient.TABLE_NAME,
+        Key={"MysfitId": {"S": mysfitId}},
+        ProjectionExpression="MysfitId, Likes, LikeShards",
+        ConsistentRead=True,
+    )
+    item = response.get("Item")
+    if item is None:
+        return "unknown mysfit"
+    current = mysfitsTableClient.likeShardCount(item)
+    if shards < current:
+        return "already has {} shards; shard counts cannot shrink".format(current)
+    if shards == current:
+        return "already has {} shards".format(current)
+    if dryRun:
+        return "would go from {} to {} shards".format(current, shards)
+
+    key = {"MysfitId": {"S": mysfitId}}
+    if current > 1:
+        client.update_item(
+            TableName=mysfitsTableClient.TABLE_NAME,
+            Key=key,
+            UpdateExpression="SET LikeShards = :new",
+            ConditionExpression="LikeShards = :old",
+            ExpressionAttributeValues={
+                ":new": {"N": str(shards)},
+                ":old": {"N": str(current)},
+            },
+        )
+        return "went from {} to {} shards".format(current, shards)
+
+    # the conditions make the transaction fail, rather than lose likes, if a
+    # like lands on the mysfit between the read above and this write.
+    likes = item.get("Likes", {"N": "0"})
+    client.transact_write_items(
+        TransactItems=[
+            {
+                "Update": {
+                    "TableName": mysfitsTableClient.TABLE_NAME,
+                    "Key": key,
+                    "UpdateExpression": "SET LikeShards = :shards REMOVE Likes",
+                    "ConditionExpression": (
+                        "attribute_not_exists(LikeShards) AND "
+                        "(Likes = :likes OR attribute_not_exists(Likes))"
+                    ),
+                    "ExpressionAttributeValues": {
+                        ":shards": {"N": str(shards)},
+                        ":likes": likes,
+                    },
+                }
+            },
+            {
+                "Update": {
+                    "TableName": mysfitsTableClient.LIKES_TABLE_NAME,
+                    "Key": {"ShardId": {"S": mysfitsTableClient.shardId(mysfitId, 0)}},
+                    "UpdateExpression": "ADD Likes :likes",
+                    "ExpressionAttributeValues": {":likes": likes},
+                }
+            },
+        ]
+    )
+    return "moved {} likes onto {} shards".format(likes["N"], shards)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Move mysfit like counters onto sharded counter items."
+    )
+    parser.add_argument("assignments", nargs="+", type=parseAssignment)
+    parser.add_argument("--dry-run", action="store_true")
+    options = parser.parse_args(argv)
+
+    client = mysfitsTableClient.getClient()
+    failed = False
+    for mysfitId, shards in options.assignments:
+        try:
+            outcome = shardMysfit(client, mysfitId, shards, options.dry_run)
+        except (
+            client.exceptions.TransactionCanceledException,
+            client.exceptions.ConditionalCheckFailedException,
+        ):
+            # the mysfit was liked or resharded between the read and the
+            # write.
+            outcome = "changed while migrating, run again"
+            failed = True
+        print("{}: {}".format(mysfitId, outcome))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
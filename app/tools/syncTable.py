@@ -0,0 +1,300 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import time
+
+from tools import catalogFiles, loadTable
+
+import mysfitsTableClient
+
+# Brings MysfitsTable in line with a new mysfits catalog by writing only what
+# changed, rather than every item the way tools.loadTable does:
+#
+#   python -m tools.syncTable data/populate-dynamodb.json [--dry-run]
+#   python -m tools.syncTable catalog.json --manifest catalog.manifest
+#
+# Each catalog item is compared by its content hash (see
+# loadTable.contentHash) with the hash of the version last written. Items
+# that are new are put, items whose content changed are updated, items no
+# longer in the catalog are deleted, and nothing else is written, so a nightly
+# refresh costs write capacity in proportion to the changes rather than to
+# the catalog.
+#
+# The hashes last written are read from the ContentHash attribute tools.loadTable
+# and this tool store on every item, with a parallel Scan reading just the
+# keys and hashes. With --manifest they are kept in a local file instead,
+# saved once a sync completes, and the table is not read at all; that
+# manifest must then be the only way the table is written to.
+#
+# The diff is worked out and reported before anything is written, and
+# --dry-run stops there, listing every mysfitId to be added (+), changed (~)
+# or removed (-). The catalog is read again for the items to add and once
+# more for the items to update, so it is never held in memory; only the
+# mysfitIds and hashes are.
+#
+# Items are compared as the catalog describes them, so likes and adoptions
+# recorded since an item was last written do not count as changes. An item
+# that did change is updated in place rather than put whole: its catalog
+# attributes and content hash are set, and the likes, adoption and like
+# shards (see tools.shardLikeCounters) the table has recorded are kept.
+
+_ABSENT = object()
+
+# Attributes the service keeps up to date in the table. A changed item keeps
+# the table's values; the catalog's only fill in one that is missing.
+COUNTER_ATTRIBUTES = frozenset(("Likes", "Adopted"))
+
+
+def readTableHashes(tableName):
+    # mysfitId -> content hash of every item in the table, None for an item
+    # written without one.
+    request = {
+        "TableName": tableName,
+        "ProjectionExpression": "MysfitId, #hash",
+        "ExpressionAttributeNames": {"#hash": loadTable.CONTENT_HASH_ATTRIBUTE},
+        "ReturnConsumedCapacity": "TOTAL",
+    }
+    plan = mysfitsTableClient.ListingPlan(
+        "scan", request, mysfitsTableClient.MAX_SCAN_SEGMENTS, "projected"
+    )
+    hashes = {}
+    for items, _ in mysfitsTableClient.runPlan(plan, ordered=False):
+        for item in items:
+            stored = item.get(loadTable.CONTENT_HASH_ATTRIBUTE)
+            hashes[item["MysfitId"]["S"]] = stored["S"] if stored else None
+    return hashes
+
+
+def readManifest(path):
+    try:
+        with open(path) as manifestFile:
+            return json.load(manifestFile)["hashes"]
+    except FileNotFoundError:
+        return {}
+
+
+def writeManifest(path, hashes):
+    temporaryPath = path + ".tmp"
+    with open(temporaryPath, "w") as manifestFile:
+        json.dump({"hashes": hashes}, manifestFile, separators=(",", ":"))
+    os.replace(temporaryPath, path)
+
+
+class CatalogDiff(object):
+    # The mysfitIds a catalog adds, changes and removes relative to the
+    # hashes last written, and the write capacity writing them will take.
+    def __init__(self, items, storedHashes):
+        self.added = []
+        self.changed = []
+        self.unchanged = 0
+        self.capacityUnits = 0
+        self.hashes = {}
+        for item in items:
+            mysfitId = item["MysfitId"]["S"]
+            itemHash = loadTable.contentHash(item)
+            self.hashes[mysfitId] = itemHash
+            stored = storedHashes.get(mysfitId, _ABSENT)
+            if stored == itemHash:
+                self.unchanged += 1
+                continue
+            (self.added if stored is _ABSENT else self.changed).append(mysfitId)
+            self.capacityUnits += writeUnits(loadTable.withContentHash(item))
+        self.removed = sorted(set(storedHashes) - set(self.hashes))
+        # a delete costs one unit however large the item was.
+        self.capacityUnits += len(self.removed)
+
+    def report(self, out, listIds=False):
+        if listIds:
+            for sign, mysfitIds in (
+                ("+", self.added),
+                ("~", self.changed),
+                ("-", self.removed),
+            ):
+                for mysfitId in mysfitIds:
+                    out.write("{} {}\n".format(sign, mysfitId))
+        out.write(
+            "{} added, {} changed, {} removed, {} unchanged; about {} WCU "
+            "to write\n".format(
+                len(self.added),
+                len(self.changed),
+                len(self.removed),
+                self.unchanged,
+                self.capacityUnits,
+            )
+        )
+
+
+def updateRequest(item):
+    # the UpdateItem arguments that bring a stored mysfit in line with its
+    # catalog item. Response attributes the catalog item no longer has are
+    # removed; attributes only the table knows about, like LikeShards, are
+    # left alone.
+    item = loadTable.withContentHash(item)
+    names = {}
+    values = {}
+    assignments = []
+    for position, (attribute, value) in enumerate(sorted(item.items())):
+        if attribute == "MysfitId":
+            continue
+        name = "#a{}".format(position)
+        placeholder = ":v{}".format(position)
+        names[name] = attribute
+        values[placeholder] = value
+        if attribute in COUNTER_ATTRIBUTES:
+            assignments.append(
+                "{0} = if_not_exists({0}, {1})".format(name, placeholder)
+            )
+        else:
+            assignments.append("{} = {}".format(name, placeholder))
+    removals = []
+    for position, (_, attribute, _) in enumerate(mysfitsTableClient.ATTRIBUTES):
+        if attribute not in item and attribute not in COUNTER_ATTRIBUTES:
+            name = "#r{}".format(position)
+            names[name] = attribute
+            removals.append(name)
+    expression = "SET " + ", ".join(assignments)
+    if removals:
+        expression += " REMOVE " + ", ".join(removals)
+    return {
+        "Key": {"MysfitId": item["MysfitId"]},
+        "UpdateExpression": expression,
+        "ExpressionAttributeNames": names,
+        "ExpressionAttributeValues": values,
+    }
+
+
+def updateItems(client, tableName, items, controller, maxAttempts=10):
+    # update every catalog item in the table one UpdateItem call at a time,
+    # paced and retried like loadTable.writeBatch, returning the write
+    # capacity consumed.
+    capacityUnits = 0.0
+    for item in items:
+        request = updateRequest(item)
+        for attempt in range(maxAttempts):
+            controller.acquire(1)
+            try:
+                response = client.update_item(
+                    TableName=tableName, ReturnConsumedCapacity="TOTAL", **request
+                )
+            except client.exceptions.ClientError as error:
+                if not loadTable.isThrottling(error):
+                    raise
+            else:
+                consumed = response.get("ConsumedCapacity") or {}
+                capacityUnits += consumed.get("CapacityUnits", 0.0)
+                controller.accepted()
+                break
+            controller.throttled()
+            time.sleep(
+                random.uniform(
+                    0,
+                    min(
+                        loadTable.MAX_BACKOFF_SECONDS,
+                        loadTable.BACKOFF_SECONDS * 2**attempt,
+                    ),
+                )
+            )
+        else:
+            raise RuntimeError(
+                "UpdateItem was throttled {} times in a row".format(maxAttempts)
+            )
+    return capacityUnits
+
+
+def itemKey(item):
+    return item["MysfitId"]["S"]
+
+
+def writeUnits(item):
+    # DynamoDB charges a unit per started KB of the item, on the table and on
+    # each index it is written to; this counts the table's alone.
+    return max(1, -(-len(json.dumps(item)) // 1024))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Write only the changes a mysfits catalog makes to MysfitsTable."
+    )
+    parser.add_argument("input", help="populate-dynamodb.json or mysfits-response.json")
+    parser.add_argument("--table", default=mysfitsTableClient.TABLE_NAME)
+    parser.add_argument("--manifest", default=None)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--initial-rate", type=float, default=1000.0)
+    parser.add_argument("--max-rate", type=float, default=None)
+    parser.add_argument("--progress-seconds", type=float, default=5.0)
+    options = parser.parse_args(argv)
+
+    # the client is created by the first call made with it, reading the
+    # hashes, and has to have a connection for every worker by then.
+    client = loadTable.getClient(options.workers)
+    started = time.monotonic()
+    if options.manifest:
+        storedHashes = readManifest(options.manifest)
+    else:
+        storedHashes = readTableHashes(options.table)
+        sys.stderr.write(
+            "read {} hashes from {} in {:.1f}s, {:.0f} RCU\n".format(
+                len(storedHashes),
+                options.table,
+                time.monotonic() - started,
+                mysfitsTableClient.consumedReadCapacity,
+            )
+        )
+    diff = CatalogDiff(catalogFiles.iterItems(options.input), storedHashes)
+    diff.report(sys.stdout if options.dry_run else sys.stderr, options.dry_run)
+    if options.dry_run:
+        return 0
+
+    added = set(diff.added)
+    changed = set(diff.changed)
+    if not added and not changed and not diff.removed:
+        if options.manifest:
+            writeManifest(options.manifest, diff.hashes)
+        return 0
+    writes = [
+        {"DeleteRequest": {"Key": {"MysfitId": {"S": mysfitId}}}}
+        for mysfitId in diff.removed
+    ]
+    puts = (
+        {"PutRequest": {"Item": loadTable.withContentHash(item)}}
+        for item in catalogFiles.iterItems(options.input)
+        if itemKey(item) in added
+    )
+    updates = (
+        item
+        for item in catalogFiles.iterItems(options.input)
+        if itemKey(item) in changed
+    )
+    controller = loadTable.RateController(options.initial_rate, options.max_rate)
+    report = loadTable.ProgressReport(
+        controller, options.progress_seconds, verb="synced"
+    )
+    written, capacityUnits = loadTable.loadTable(
+        client,
+        loadTable.iterBatches(itertools.chain(writes, puts)),
+        options.table,
+        controller,
+        options.workers,
+        report,
+    )
+    updated, updateCapacityUnits = loadTable.loadTable(
+        client,
+        loadTable.iterBatches(updates, key=itemKey),
+        options.table,
+        controller,
+        options.workers,
+        lambda count, units: report(written + count, capacityUnits + units),
+        write=updateItems,
+    )
+    report(written + updated, capacityUnits + updateCapacityUnits, final=True)
+    if options.manifest:
+        writeManifest(options.manifest, diff.hashes)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
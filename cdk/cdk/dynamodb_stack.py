@@ -10,6 +10,10 @@ class DynamoDbStack(core.Stack):
     def table(self) -> aws_dynamodb.Table:
         return self._table
 
+    @property
+    def likes_table(self) -> aws_dynamodb.Table:
+        return self._likes_table
+
     def __init__(
         self, scope: core.Construct, id: str, props: DynamoDbStackProps, **kwargs
     ) -> None:
@@ -50,11 +54,38 @@ class DynamoDbStack(core.Stack):
             projection_type=aws_dynamodb.ProjectionType.ALL,
         )
 
+        # Like counters for popular mysfits are split across several items,
+        # each with its own partition key ("<MysfitId>#<shard>"), so that the
+        # likes for a single mysfit are spread over many partitions.
+        likes_table = aws_dynamodb.Table(
+            self,
+            "LikesTable",
+            table_name="MysfitsLikesTable",
+            partition_key=aws_dynamodb.Attribute(
+                name="ShardId", type=aws_dynamodb.AttributeType.STRING
+            ),
+        )
+
         fargate_policy = aws_iam.PolicyStatement()
-        for action in ["Scan", "Query", "UpdateItem", "GetItem", "DescribeTable"]:
+        for action in [
+            "Scan",
+            "Query",
+            "UpdateItem",
+            "GetItem",
+            "BatchGetItem",
+            "DescribeTable",
+        ]:
             fargate_policy.add_actions("dynamodb:{}".format(action))
         fargate_policy.add_resources(table.table_arn)
         fargate_policy.add_resources("{}/index/LawChaosIndex".format(table.table_arn))
         fargate_policy.add_resources("{}/index/GoodEvilIndex".format(table.table_arn))
         props.fargate_service.task_definition.add_to_task_role_policy(fargate_policy)
+
+        likes_policy = aws_iam.PolicyStatement()
+        for action in ["UpdateItem", "GetItem", "BatchGetItem"]:
+            likes_policy.add_actions("dynamodb:{}".format(action))
+        likes_policy.add_resources(likes_table.table_arn)
+        props.fargate_service.task_definition.add_to_task_role_policy(likes_policy)
+
         self._table = table
+        self._likes_table = likes_table